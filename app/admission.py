@@ -0,0 +1,261 @@
+"""
+准入控制: 按客户端的令牌桶限流 + 各服务的并发上限
+
+在路由之前的 ASGI 中间件中执行，被拒绝的请求在读取请求体 (上传的音频) 之前就返回:
+- 429: 客户端超过请求速率，Retry-After 为攒够一个令牌所需的秒数。
+  客户端按 X-API-Key 识别，但只认 API_KEYS 中配置的 Key；没有 Key 或 Key 未知时按 IP，
+  每次换一个随机 Key 不能绕过限流
+- 503: 该服务正在处理的请求数已达上限 (每个 worker 进程单独计数)
+
+令牌桶默认存在进程内；配置 Redis 后由多个实例共享 (Redis 不可用时改用进程内令牌桶)。
+中间件同时记下请求所属的租户 (current_tenant()，已知 API Key 的 SHA-256 前 16 位)，用于用量统计；
+未知的 Key 不作为租户，避免伪造的请求头打乱按租户的用量报表。
+"""
+import hashlib
+import json
+import logging
+import math
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Tuple
+from app.config import get_settings
+from app.lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# 受并发上限约束的处理接口: POST /api/{服务}/...
+SERVICES = ("piano", "spleeter", "yourmt3")
+
+# KEYS[1] = 桶, ARGV = (每秒令牌数, 容量, 当前时间)；返回需要等待的秒数 (字符串)，0 表示放行
+_REDIS_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+# 当前请求的租户，由 AdmissionMiddleware 设置
+_tenant: ContextVar[Optional[str]] = ContextVar("tenant", default=None)
+
+
+def key_digest(value: bytes) -> str:
+    """API Key 的 SHA-256 (不在内存和数据库中保存原始 Key)"""
+    return hashlib.sha256(value).hexdigest()
+
+
+def parse_api_keys(spec: str) -> Tuple[str, ...]:
+    """解析逗号分隔的 API Key，返回各自的 SHA-256"""
+    return tuple(key_digest(key.strip().encode()) for key in spec.split(",") if key.strip())
+
+
+def current_tenant() -> Optional[str]:
+    return _tenant.get()
+
+
+def processing_service(scope) -> Optional[str]:
+    """POST /api/{服务}/... 对应的服务名，其他请求返回 None"""
+    if scope["method"] != "POST":
+        return None
+    parts = scope["path"].split("/", 3)
+    # ["", "api", 服务, ...]
+    if len(parts) > 3 and parts[1] == "api" and parts[2] in SERVICES:
+        return parts[2]
+    return None
+
+
+async def send_error(send, status: int, detail: str, headers: Tuple[Tuple[bytes, bytes], ...] = ()):
+    """在中间件中直接返回 JSON 错误 (格式与 HTTPException 相同)"""
+    body = json.dumps({"detail": detail}, ensure_ascii=False).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            *headers,
+            # 请求体没有读完，不能复用连接
+            (b"connection", b"close"),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def parse_limits(spec: str) -> Dict[str, int]:
+    """解析 "spleeter=4,piano=8" 形式的并发上限"""
+    limits: Dict[str, int] = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        service, _, value = item.partition("=")
+        service = service.strip().lower()
+        if service not in SERVICES:
+            raise ValueError(f"未知服务: {service}")
+        limits[service] = int(value)
+    return limits
+
+
+class MemoryBuckets:
+    """进程内的令牌桶 (只在事件循环线程中使用)，最久未访问的客户端超出条目上限后丢弃"""
+
+    def __init__(self, rate: float, burst: int, max_clients: int = 100_000):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = LRUCache(max_clients)
+
+    async def take(self, client: str) -> float:
+        now = time.monotonic()
+        tokens, last = self._buckets.get(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens >= 1:
+            self._buckets.set(client, (tokens - 1, now))
+            return 0.0
+        self._buckets.set(client, (tokens, now))
+        return (1 - tokens) / self.rate
+
+
+class RedisBuckets:
+    """Redis 中的令牌桶，多个实例共享同一客户端的配额"""
+
+    def __init__(self, url: str, rate: float, burst: int, fallback: MemoryBuckets):
+        # 可选依赖，只在配置了 Redis 时导入
+        import redis.asyncio as redis
+
+        self.rate = rate
+        self.burst = burst
+        self._client = redis.from_url(url)
+        self._script = self._client.register_script(_REDIS_SCRIPT)
+        self._fallback = fallback
+
+    async def take(self, client: str) -> float:
+        try:
+            wait = await self._script(keys=[f"ratelimit:{client}"], args=[self.rate, self.burst, time.time()])
+            return float(wait)
+        except Exception as e:
+            logger.warning("Redis 限流不可用，改用进程内令牌桶: %s", e)
+            return await self._fallback.take(client)
+
+
+class AdmissionController:
+    """限流与并发计数，AdmissionMiddleware 与 /metrics 共用"""
+
+    def __init__(
+        self,
+        rate_per_minute: float = 0,
+        burst: int = 20,
+        redis_url: Optional[str] = None,
+        trust_forwarded: bool = False,
+        inflight_limits: Optional[Dict[str, int]] = None,
+        inflight_retry_after: int = 5,
+        api_keys: Iterable[str] = ()
+    ):
+        self.buckets = None
+        if rate_per_minute > 0:
+            rate = rate_per_minute / 60
+            self.buckets = MemoryBuckets(rate, burst)
+            if redis_url:
+                try:
+                    self.buckets = RedisBuckets(redis_url, rate, burst, fallback=self.buckets)
+                except ImportError:
+                    logger.warning("⚠️ 未安装 redis，限流使用进程内令牌桶")
+        self.trust_forwarded = trust_forwarded
+        # 已知 API Key 的 SHA-256
+        self.api_keys = frozenset(api_keys)
+        self.inflight_limits = inflight_limits or {}
+        self.inflight_retry_after = inflight_retry_after
+        self.inflight: Dict[str, int] = defaultdict(int)
+        self.rejected: Dict[str, int] = defaultdict(int)
+
+    def api_key_id(self, scope) -> Optional[str]:
+        """请求头 X-API-Key 是已知的 Key 时返回其 SHA-256 前 16 位，否则返回 None"""
+        for name, value in scope.get("headers") or []:
+            if name == b"x-api-key" and value:
+                digest = key_digest(value)
+                return digest[:16] if digest in self.api_keys else None
+        return None
+
+    def client_id(self, scope) -> str:
+        key_id = self.api_key_id(scope)
+        if key_id is not None:
+            return "key:" + key_id
+        headers = dict(scope.get("headers") or [])
+        forwarded = headers.get(b"x-forwarded-for")
+        if self.trust_forwarded and forwarded:
+            return "ip:" + forwarded.decode("latin-1").split(",", 1)[0].strip()
+        client = scope.get("client")
+        return "ip:" + (client[0] if client else "unknown")
+
+    async def admit(self, scope) -> Tuple[Optional[int], Optional[int], Optional[str]]:
+        """返回 (状态码, Retry-After 秒数, 服务名)；状态码为 None 时放行，服务名非空时需在结束后 release()"""
+        if self.buckets is not None:
+            wait = await self.buckets.take(self.client_id(scope))
+            if wait > 0:
+                self.rejected["rate_limit"] += 1
+                return 429, max(1, math.ceil(wait)), None
+
+        service = processing_service(scope)
+        if service is None:
+            return None, None, None
+        limit = self.inflight_limits.get(service)
+        if limit is not None and self.inflight[service] >= limit:
+            self.rejected["inflight"] += 1
+            return 503, self.inflight_retry_after, None
+        self.inflight[service] += 1
+        return None, None, service
+
+    def release(self, service: str):
+        self.inflight[service] -= 1
+
+
+class AdmissionMiddleware:
+    """纯 ASGI 中间件: 只检查 /api/ 下的请求，被拒绝时不调用 receive()，请求体不会被读取"""
+
+    def __init__(self, app, controller: Optional["AdmissionController"] = None):
+        self.app = app
+        self.controller = controller or get_admission_controller()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+
+        token = _tenant.set(self.controller.api_key_id(scope))
+        try:
+            status, retry_after, service = await self.controller.admit(scope)
+            if status is not None:
+                detail = "请求过于频繁，请稍后重试" if status == 429 else "服务繁忙，请稍后重试"
+                await send_error(send, status, detail, headers=((b"retry-after", str(retry_after).encode()),))
+                return
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                if service is not None:
+                    self.controller.release(service)
+        finally:
+            _tenant.reset(token)
+
+
+@lru_cache
+def get_admission_controller() -> AdmissionController:
+    settings = get_settings()
+    return AdmissionController(
+        rate_per_minute=settings.rate_limit_per_minute if settings.rate_limit_enabled else 0,
+        burst=settings.rate_limit_burst,
+        redis_url=settings.rate_limit_redis_url,
+        trust_forwarded=settings.rate_limit_trust_forwarded,
+        inflight_limits=parse_limits(settings.inflight_limits),
+        inflight_retry_after=settings.inflight_retry_after_s,
+        api_keys=parse_api_keys(settings.api_keys)
+    )
@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Optional
 
 
 class Settings(BaseSettings):
@@ -8,6 +9,7 @@ class Settings(BaseSettings):
     aws_secret_access_key: str
     aws_region: str = "ap-southeast-1"
     s3_bucket_name: str = "qiupupu"
+    s3_endpoint_url: Optional[str] = None   # 自定义 S3 端点 (MinIO 等本地替身)
     
     # 数据库配置
     db_host: str
@@ -15,6 +17,109 @@ class Settings(BaseSettings):
     db_user: str
     db_password: str
     db_port: int = 5432
+    db_read_host: Optional[str] = None  # 只读副本主机 (可选)，用于缓存查询和任务状态查询
+    db_read_port: Optional[int] = None
+    
+    # 数据库连接池配置 (每个 worker 进程)
+    db_pool_size: int = 20              # 0 表示使用 NullPool
+    db_max_overflow: int = 10
+    db_pool_timeout: int = 30
+    db_pool_recycle: int = 3600
+    db_pooler_mode: bool = False        # 经由 PgBouncer/Supavisor transaction 模式连接
+    web_concurrency: int = 1            # 每个实例的 worker 进程数
+    db_instance_count: int = 1          # 部署的实例 (副本) 数，用于启动时的连接预算检查
+    schema_auto_update: bool = True     # gunicorn 启动 worker 之前执行 ensure-schema
+    schema_check_enabled: bool = True   # 启动时数据库结构与模型不一致则拒绝启动
+    
+    # 处理记录写后缓冲: 状态更新按周期合并为批量 UPDATE
+    write_behind_enabled: bool = True
+    write_behind_interval_ms: int = 50
+    write_behind_max_batch: int = 500
+    
+    # 优雅关闭时转交后台 (handed_off) 的任务由各 worker 定期认领并继续轮询
+    job_resume_enabled: bool = True
+    job_resume_interval_s: int = 15
+    job_resume_batch: int = 20
+    job_resume_lease_s: int = 120       # 认领的租约，超过该时间未续租 (worker 被强制结束) 时由其他 worker 重新认领
+    
+    # 上传前的音频规整 (ffmpeg 解码、降混、重采样并重新编码)
+    audio_normalize_enabled: bool = False
+    audio_normalize_codec: str = "flac"             # flac / opus
+    audio_normalize_min_bytes: int = 1024 * 1024    # 小于该大小的文件直接上传
+    audio_normalize_concurrency: int = 0            # 同时运行的 ffmpeg 进程数, 0 表示 CPU 核数
+    ffmpeg_path: str = "ffmpeg"
+    ffprobe_path: str = "ffprobe"
+    
+    # 长音频分段处理: 切成相互重叠的分段并发提交，再合并结果
+    chunking_enabled: bool = False
+    chunk_probe_min_bytes: int = 8 * 1024 * 1024    # 小于该大小的文件不检测时长
+    chunk_min_duration_s: int = 600                 # 超过该时长才分段
+    chunk_duration_s: int = 300
+    chunk_overlap_s: float = 4.0
+    chunk_concurrency: int = 4                      # 单个请求同时处理的分段数
+    
+    # Spleeter 音轨派生: 由已有的更多音轨结果混合出较少音轨的布局 (如 4 轨 → 2 轨)，不调用 RunPod
+    stem_derive_enabled: bool = True
+    stem_url_expires_s: int = 3600      # 单轨下载链接的有效期
+    
+    # MIDI 派生格式 (音符 JSON / 按音色拆分 / 量化) 的进程内缓存条目数
+    midi_view_cache_entries: int = 256
+    
+    # 结果下发: 复制到内容寻址的 key (immutable Cache-Control)，经 CDN 或临时签名链接下发
+    output_copy_enabled: bool = False
+    output_cdn_base_url: Optional[str] = None   # 如 https://cdn.example.com，指向存储桶的 CDN 域名
+    output_presign_ttl_s: int = 0               # 结果链接的签名有效期, 0 表示返回存储桶的原始 URL
+    output_presign_cache_entries: int = 4096
+    
+    # 节点本地的磁盘缓存: S3 对象与结果文件的读写都经过它，按 LRU 淘汰
+    disk_cache_enabled: bool = False
+    disk_cache_dir: str = "/tmp/audio-processing-cache"
+    disk_cache_max_bytes: int = 10 * 1024 * 1024 * 1024
+    
+    # 准入控制: 超出时在读取请求体之前返回 429 / 503
+    rate_limit_enabled: bool = False
+    rate_limit_per_minute: float = 60           # 每个客户端 (X-API-Key 或 IP) 的请求速率
+    rate_limit_burst: int = 20
+    rate_limit_redis_url: Optional[str] = None  # 多实例共享令牌桶 (需安装 redis)
+    rate_limit_trust_forwarded: bool = False    # 部署在反向代理之后时按 X-Forwarded-For 识别客户端
+    api_keys: str = ""                          # 已知的 API Key (逗号分隔)，只有这些 Key 按 Key 限流，其他请求按 IP
+    result_token_secret: str = ""               # 结果地址中访问令牌的签名密钥，空时由 RUNPOD_API_KEY 派生
+    inflight_limits: str = ""                   # 每个 worker 各服务同时处理的请求数, 如 "spleeter=4,piano=8"
+    inflight_retry_after_s: int = 5
+    
+    # 上传检查: 大小上限与音频格式识别 (读完请求体之前拒绝)
+    upload_max_bytes: int = 200 * 1024 * 1024
+    upload_sniff_enabled: bool = True
+    
+    # 用量统计: 缓存命中计数写入 usage_rollups 的间隔，以及后台增量汇总的间隔 (0 表示只由 maintenance rollup 汇总)
+    usage_flush_interval_s: int = 60
+    usage_rollup_interval_s: int = 900
+    
+    # 缓存预热: 热门文件在空闲时预先跑其他服务 (每个 worker 单独统计与计算预算)
+    cache_warm_enabled: bool = False
+    cache_warm_targets: str = "yourmt3,spleeter:stems=4"   # 服务[:参数=值...], 逗号分隔
+    cache_warm_min_hits: int = 3                # 时间窗口内请求次数达到该值视为热门
+    cache_warm_window_s: int = 3600
+    cache_warm_track_entries: int = 10000       # 统计次数的哈希数上限
+    cache_warm_queue_size: int = 100
+    cache_warm_budget_per_hour: int = 20        # 每小时最多提交的预热任务数
+    cache_warm_max_inflight: int = 0            # 正在处理的请求数不超过该值时才预热
+    cache_warm_hours: str = ""                  # 允许预热的 UTC 小时, 如 "0-7,22-23", 空表示不限
+    cache_warm_interval_s: int = 30
+    
+    # 失败处理: 可重试 (transient) 的失败按指数退避重新提交；输入无法处理 (permanent) 的请求在 TTL 内直接拒绝
+    job_retry_attempts: int = 2
+    job_retry_backoff_s: float = 2.0
+    negative_cache_ttl_s: int = 86400           # 0 表示不缓存失败结果
+    # 同一请求 (文件哈希, 服务, 参数) 已有进行中的任务时等待它的结果而不重复提交；超过 TTL 没有更新的记录视为已中断
+    single_flight_ttl_s: int = 1800             # 0 表示不合并并发的相同请求
+    single_flight_poll_s: float = 2.0
+    
+    # 短音频走 RunPod /runsync: 在 RunPod 端等待结果，超时后按 job_id 继续轮询
+    runsync_enabled: bool = True
+    runsync_wait_s: float = 20
+    runsync_max_duration_s: float = 60          # 已检测时长时的判断依据
+    runsync_max_bytes: int = 2 * 1024 * 1024    # 未检测时长时按上传大小判断
     
     # RunPod API 配置
     runpod_api_key: str
@@ -26,10 +131,31 @@ class Settings(BaseSettings):
     app_name: str = "Audio Processing API"
     debug: bool = False
     
+    # 日志配置
+    log_level: str = "INFO"
+    log_format: str = "text"            # text / json
+    log_sample_rates: str = ""          # 轮询类日志按级别采样, 如 "DEBUG=0,INFO=0.1"
+    
+    # Server-Timing 响应头
+    server_timing_enabled: bool = True
+    
+    # 诊断: 事件循环延迟与阻塞检测
+    diagnostics_enabled: bool = False
+    loop_lag_interval_ms: int = 100
+    blocking_threshold_ms: int = 100
+    admin_token: Optional[str] = None   # 管理接口令牌 (请求头 X-Admin-Token)，未配置时管理接口不可用
+    
     @property
     def database_url(self) -> str:
         return f"postgresql+asyncpg://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{self.db_name}"
     
+    @property
+    def read_database_url(self) -> Optional[str]:
+        if not self.db_read_host:
+            return None
+        port = self.db_read_port or self.db_port
+        return f"postgresql+asyncpg://{self.db_user}:{self.db_password}@{self.db_read_host}:{port}/{self.db_name}"
+    
     class Config:
         env_file = ".env"
         case_sensitive = False
@@ -1,51 +1,166 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import NullPool
+from sqlalchemy import text
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from uuid import uuid4
 from app.config import get_settings
+import logging
 
-settings = get_settings()
-
-# 创建异步引擎 (优化参数)
-engine = create_async_engine(
-    settings.database_url,
-    pool_size=100,              # 增加连接池大小以支持更高并发
-    max_overflow=50,            # 超出后最多再创建
-    pool_pre_ping=True,         # 自动检测失效连接
-    pool_recycle=3600,          # 1小时回收连接
-    pool_timeout=30,            # 获取连接超时时间
-    echo=False,
-    connect_args={
-        "server_settings": {
-            "application_name": "receipt_processing_center",
-            "jit": "off"        # 关闭 JIT 以避免某些性能问题
-        },
+logger = logging.getLogger(__name__)
+
+
+def build_engine(database_url: str):
+    """
+    按 Settings 中的连接池配置创建异步引擎。
+
+    - DB_POOL_SIZE=0 时使用 NullPool，每个会话单独建连 (适合前面已有连接池代理的场景)
+    - DB_POOLER_MODE=true 时兼容 PgBouncer / Supavisor 的 transaction 模式:
+      关闭 asyncpg 预编译语句缓存、使用随机语句名，并且不发送代理不支持的 jit 启动参数
+    """
+    settings = get_settings()
+    server_settings = {"application_name": "receipt_processing_center"}
+    connect_args = {
         "command_timeout": 60,  # 命令超时 60 秒
         "timeout": 30           # 连接超时 30 秒
     }
-)
+    if settings.db_pooler_mode:
+        connect_args.update({
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__"
+        })
+    else:
+        server_settings["jit"] = "off"  # 关闭 JIT 以避免某些性能问题
+    connect_args["server_settings"] = server_settings
+
+    if settings.db_pool_size == 0:
+        pool_kwargs = {"poolclass": NullPool}
+    else:
+        pool_kwargs = {
+            "pool_size": settings.db_pool_size,
+            "max_overflow": settings.db_max_overflow,
+            "pool_recycle": settings.db_pool_recycle,
+            "pool_timeout": settings.db_pool_timeout
+        }
+
+    return create_async_engine(
+        database_url,
+        pool_pre_ping=True,         # 自动检测失效连接
+        echo=False,
+        connect_args=connect_args,
+        **pool_kwargs
+    )
+
+
+def _build_sessionmaker(target) -> async_sessionmaker:
+    return async_sessionmaker(
+        target,
+        class_=AsyncSession,
+        expire_on_commit=False,
+        autocommit=False,
+        autoflush=False
+    )
+
+
+# 引擎与会话工厂在第一次使用时创建 (而不是导入时)，导入本模块不需要任何配置，
+# 也保证 gunicorn 预加载应用时连接池在 fork 之后才建立
+@lru_cache
+def get_engine():
+    """主库异步引擎"""
+    return build_engine(get_settings().database_url)
+
+
+@lru_cache
+def get_read_engine():
+    """只读副本引擎，未配置 DB_READ_HOST 时为 None"""
+    read_database_url = get_settings().read_database_url
+    return build_engine(read_database_url) if read_database_url else None
+
+
+@lru_cache
+def get_sessionmaker() -> async_sessionmaker:
+    return _build_sessionmaker(get_engine())
+
+
+@lru_cache
+def get_read_sessionmaker() -> async_sessionmaker:
+    """只读会话工厂，未配置只读副本时与主库相同"""
+    read_engine = get_read_engine()
+    return _build_sessionmaker(read_engine) if read_engine is not None else get_sessionmaker()
+
+
+async def dispose_engines():
+    """关闭已创建的引擎并清空缓存 (应用关闭、命令行工具退出时调用)"""
+    engines = []
+    if get_engine.cache_info().currsize:
+        engines.append(get_engine())
+    if get_read_engine.cache_info().currsize and get_read_engine() is not None:
+        engines.append(get_read_engine())
+    for target in engines:
+        await target.dispose()
+    for factory in (get_engine, get_read_engine, get_sessionmaker, get_read_sessionmaker):
+        factory.cache_clear()
 
-# 创建异步 Session 工厂
-AsyncSessionLocal = async_sessionmaker(
-    engine,
-    class_=AsyncSession,
-    expire_on_commit=False,
-    autocommit=False,
-    autoflush=False
-)
 
 Base = declarative_base()
 
 
 async def get_db():
     """获取数据库会话的依赖函数"""
-    async with AsyncSessionLocal() as session:
+    async with get_sessionmaker()() as session:
         try:
             yield session
         finally:
             await session.close()
 
 
+@asynccontextmanager
+async def session_scope():
+    """
+    短生命周期会话: 只在实际读写数据库时借出连接。
+    处理流程在等待 RunPod 期间不持有会话，并发任务数不再受连接池大小限制。
+    """
+    async with get_sessionmaker()() as session:
+        yield session
+
+
+@asynccontextmanager
+async def read_session_scope():
+    """只读短会话: 配置了只读副本时查询副本，否则查询主库"""
+    async with get_read_sessionmaker()() as session:
+        yield session
+
+
 async def init_db():
     """初始化数据库表"""
     from app.models import Base
-    async with engine.begin() as conn:
+    async with get_engine().begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+
+
+async def check_connection_budget():
+    """
+    启动检查: 所有实例的 worker × 每进程最大连接数 超过数据库 max_connections 时告警。
+    连接池代理模式下客户端连接由代理复用，不做检查。
+    """
+    settings = get_settings()
+    if settings.db_pooler_mode:
+        return
+    per_process = settings.db_pool_size + settings.db_max_overflow
+    if per_process == 0:
+        return
+    planned = settings.web_concurrency * settings.db_instance_count * per_process
+    async with get_engine().connect() as conn:
+        max_connections = int((await conn.execute(text("SHOW max_connections"))).scalar())
+        reserved = int((await conn.execute(text("SHOW superuser_reserved_connections"))).scalar())
+    available = max_connections - reserved
+    if planned > available:
+        logger.warning(
+            "⚠️ 数据库连接预算超限: %s 实例 × %s worker × %s 连接/进程 = %s，"
+            "而数据库可用连接为 %s (max_connections=%s)。请调小 DB_POOL_SIZE / DB_MAX_OVERFLOW 或启用 DB_POOLER_MODE",
+            settings.db_instance_count, settings.web_concurrency, per_process, planned, available, max_connections
+        )
+    else:
+        logger.info("数据库连接预算: %s / %s", planned, available)
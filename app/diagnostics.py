@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BlockingEvent:
+    """一次事件循环阻塞: 开始时间、持续时间和检测时刻的调用栈"""
+    started_at: float
+    duration: float
+    stack: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict:
+        return {
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 1),
+            "stack": self.stack,
+        }
+
+
+class LoopMonitor:
+    """
+    事件循环诊断:
+    - 协程每隔 interval 醒来一次，实际醒来时间与预期的差值即为循环延迟
+    - 看门狗线程检查协程心跳，超过 threshold 未更新时抓取事件循环线程的调用栈，
+      即正在阻塞循环的那段同步代码
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.1,
+        threshold: float = 0.1,
+        history: int = 1000,
+        max_events: int = 50
+    ):
+        self.interval = interval
+        self.threshold = threshold
+        self._lags: Deque[float] = deque(maxlen=history)
+        self._events: Deque[BlockingEvent] = deque(maxlen=max_events)
+        self._lag_max = 0.0
+        self._lag_samples = 0
+        self._blocked_total = 0
+        self._blocked_seconds = 0.0
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._measure())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info("事件循环诊断已启动，采样间隔: %ss, 阻塞阈值: %ss", self.interval, self.threshold)
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._watchdog:
+            self._watchdog.join(timeout=1)
+
+    async def _measure(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            with self._lock:
+                self._heartbeat = now
+                self._lags.append(lag)
+                self._lag_samples += 1
+                self._lag_max = max(self._lag_max, lag)
+
+    def _watch(self):
+        current: Optional[BlockingEvent] = None
+        while not self._stop.wait(self.threshold / 2):
+            with self._lock:
+                stalled = time.monotonic() - self._heartbeat - self.interval
+                heartbeat = self._heartbeat
+            if stalled > self.threshold:
+                if current is None:
+                    current = BlockingEvent(started_at=time.time() - stalled, duration=stalled, stack=self._capture_stack())
+                    logger.warning(
+                        "⚠️ 事件循环阻塞超过 %.0fms，调用栈:\n%s",
+                        stalled * 1000, "".join(current.stack)
+                    )
+                else:
+                    current.duration = stalled
+            elif current is not None:
+                # 心跳恢复，结束本次阻塞
+                with self._lock:
+                    self._blocked_total += 1
+                    self._blocked_seconds += current.duration
+                    self._events.append(current)
+                current = None
+
+    def _capture_stack(self) -> List[str]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return []
+        return traceback.format_stack(frame)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lags = sorted(self._lags)
+            events = [e.to_dict() for e in self._events]
+            blocked_total = self._blocked_total
+            blocked_seconds = self._blocked_seconds
+            lag_max = self._lag_max
+            samples = self._lag_samples
+
+        def quantile(q: float) -> float:
+            return lags[min(len(lags) - 1, int(q * len(lags)))] if lags else 0.0
+
+        return {
+            "interval_s": self.interval,
+            "threshold_s": self.threshold,
+            "samples": samples,
+            "lag_p50_s": quantile(0.5),
+            "lag_p99_s": quantile(0.99),
+            "lag_max_s": lag_max,
+            "blocked_total": blocked_total,
+            "blocked_seconds_total": blocked_seconds,
+            "recent_blocking": events,
+        }
+
+
+# 由应用生命周期创建，未开启诊断时为 None
+loop_monitor: Optional[LoopMonitor] = None
+
+
+async def start_loop_monitor(interval: float, threshold: float) -> LoopMonitor:
+    global loop_monitor
+    loop_monitor = LoopMonitor(interval=interval, threshold=threshold)
+    loop_monitor.start()
+    return loop_monitor
+
+
+async def stop_loop_monitor():
+    global loop_monitor
+    if loop_monitor is not None:
+        await loop_monitor.stop()
+        loop_monitor = None
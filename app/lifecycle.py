@@ -0,0 +1,86 @@
+"""
+进程优雅关闭 (drain) 状态
+
+应用启动时 (lifespan) 调用 install_signal_handlers()，进程收到 SIGTERM / SIGINT 时先调用 start_draining()。
+正在等待 RunPod 的请求据此把任务转交给数据库中的持久状态 (ProcessingRecord.status = "handed_off")
+并立即返回，由其他 worker 的 JobResumer 接着轮询，滚动发布时不会丢弃已经在 GPU 上运行的任务。
+"""
+import asyncio
+import logging
+import signal
+import threading
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 按事件循环创建: gunicorn 预加载应用时主进程不会创建，同一进程中重新启动事件循环 (如测试) 时状态也会重置
+_drain_event: Optional[asyncio.Event] = None
+_drain_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# 触发优雅关闭的信号
+DRAIN_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+# 安装之前的 Python 层信号处理函数
+_previous_handlers: Dict[int, object] = {}
+
+
+def _event() -> asyncio.Event:
+    global _drain_event, _drain_loop
+    loop = asyncio.get_running_loop()
+    if _drain_event is None or _drain_loop is not loop:
+        _drain_event = asyncio.Event()
+        _drain_loop = loop
+    return _drain_event
+
+
+def start_draining():
+    """进入关闭流程，由事件循环线程中的信号处理函数调用"""
+    if not _event().is_set():
+        logger.info("进程开始优雅关闭，等待中的任务将转交后台继续处理")
+        _event().set()
+
+
+def is_draining() -> bool:
+    return _event().is_set()
+
+
+async def wait_for_drain():
+    """阻塞直到进程进入关闭流程"""
+    await _event().wait()
+
+
+def install_signal_handlers():
+    """
+    收到 SIGTERM / SIGINT 时先进入关闭流程，再交给原来的处理函数 (由应用生命周期在启动时调用)。
+
+    uvicorn (包括 gunicorn 的 UvicornWorker) 用 loop.add_signal_handler 处理退出信号: 信号经 wakeup fd
+    交给事件循环，Python 层的处理函数只是占位。这里在 Python 层包一层，服务器自己的退出处理照常执行，
+    不依赖 worker / Server 的内部实现。原处理函数为默认行为时恢复它并重新发送信号。
+    只能在主线程中安装 (如 TestClient 在其他线程运行应用时跳过)。
+    """
+    if threading.current_thread() is not threading.main_thread() or _previous_handlers:
+        return
+    loop = asyncio.get_running_loop()
+
+    def handle(sig, frame):
+        # 信号处理函数可能打断事件循环自身的代码，通过 call_soon_threadsafe 回到事件循环中执行
+        loop.call_soon_threadsafe(start_draining)
+        previous = _previous_handlers.get(sig)
+        if callable(previous):
+            previous(sig, frame)
+        elif previous == signal.SIG_DFL:
+            signal.signal(sig, previous)
+            signal.raise_signal(sig)
+
+    for sig in DRAIN_SIGNALS:
+        _previous_handlers[sig] = signal.getsignal(sig)
+        signal.signal(sig, handle)
+
+
+def restore_signal_handlers():
+    """恢复 install_signal_handlers() 之前的处理函数"""
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for sig, previous in _previous_handlers.items():
+        if previous is not None:
+            signal.signal(sig, previous)
+    _previous_handlers.clear()
@@ -0,0 +1,88 @@
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+# 标记需要采样的高频日志 (如任务轮询): logger.info("...", extra=SAMPLED)
+SAMPLED = {"sampled": True}
+
+# LogRecord 自带属性, JSON 输出时只额外输出 extra 传入的字段
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """结构化 JSON 日志，每条记录一行"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            # 参数在这里才会被格式化 (被过滤/采样掉的记录不会走到这一步)
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    按级别对带 sampled 标记的日志做 1/N 采样。
+    未标记的日志不受影响；比例 0 表示全部丢弃，1 表示全部保留。
+    """
+
+    def __init__(self, rates: Dict[int, float]):
+        super().__init__()
+        self.rates = rates
+        self._counters: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "sampled", False):
+            return True
+        rate = self.rates.get(record.levelno)
+        if rate is None or rate >= 1:
+            return True
+        if rate <= 0:
+            return False
+        every = max(1, round(1 / rate))
+        with self._lock:
+            count = self._counters.get(record.levelno, 0)
+            self._counters[record.levelno] = count + 1
+        return count % every == 0
+
+
+def parse_sample_rates(spec: str) -> Dict[int, float]:
+    """解析 "DEBUG=0,INFO=0.1" 形式的采样配置"""
+    rates: Dict[int, float] = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        level_name, _, value = item.partition("=")
+        level = logging.getLevelName(level_name.strip().upper())
+        if not isinstance(level, int):
+            raise ValueError(f"未知日志级别: {level_name}")
+        rates[level] = float(value)
+    return rates
+
+
+def configure_logging(
+    level: str = "INFO",
+    log_format: str = "text",
+    sample_rates: Optional[str] = None
+):
+    """配置根日志: 文本/JSON 格式 + 轮询日志采样"""
+    handler = logging.StreamHandler()
+    if log_format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    if sample_rates:
+        handler.addFilter(SamplingFilter(parse_sample_rates(sample_rates)))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level.upper())
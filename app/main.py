@@ -2,79 +2,180 @@ from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
+import asyncio
 import logging
 from app.config import get_settings
-from app.database import init_db
-from app.routers import piano_router, spleeter_router, yourmt3_router
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+from app.database import check_connection_budget, dispose_engines
+from app.maintenance import check_schema
+from app.admission import AdmissionMiddleware
+from app.upload_guard import UploadGuardMiddleware
+from app.diagnostics import start_loop_monitor, stop_loop_monitor
+from app.lifecycle import install_signal_handlers, restore_signal_handlers, start_draining
+from app.services import (
+    get_s3_service, get_piano_service, get_spleeter_service, get_yourmt3_service,
+    get_processing_pipeline, get_job_service, get_record_writer, get_job_resumer, get_usage_recorder,
+    get_cache_warmer
 )
+from app.logging_config import configure_logging
+from app.routers import piano_router, spleeter_router, yourmt3_router, jobs_router, midi_router, admin_router
+from app.timing import ServerTimingMiddleware
+
 logger = logging.getLogger(__name__)
 
-settings = get_settings()
+
+def warm_up_services():
+    """
+    创建各服务实例 (S3 客户端会话、RunPod 服务、处理流程)。
+    在线程中执行，不阻塞启动: 健康检查可以先就绪，首个请求如果先到会直接复用已创建的实例。
+    """
+    try:
+        for factory in (
+            get_s3_service, get_piano_service, get_spleeter_service, get_yourmt3_service,
+            get_processing_pipeline, get_job_service
+        ):
+            factory()
+        logger.info("服务实例创建完成")
+    except Exception as e:
+        # 请求到来时会再次尝试创建
+        logger.error("服务实例创建失败: %s", e, exc_info=True)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
-    # 启动时
-    logger.info("初始化数据库...")
+    settings = get_settings()
+    # 收到 SIGTERM / SIGINT 时先进入关闭流程 (等待 RunPod 的请求转交后台)，再由服务器正常退出
+    install_signal_handlers()
+    # 启动时: 数据库结构由部署流程更新 (gunicorn on_starting 或 ensure-schema)，落后于模型时拒绝启动
+    if settings.schema_check_enabled:
+        try:
+            drift = await check_schema()
+        except Exception as e:
+            drift = []
+            logger.warning("数据库结构检查失败: %s", e)
+        if drift:
+            raise RuntimeError(
+                f"数据库结构与模型不一致 ({'; '.join(drift)})，请先执行 python -m app.maintenance ensure-schema"
+            )
+    
     try:
-        #await init_db()
-        logger.info("数据库初始化完成")
+        await check_connection_budget()
     except Exception as e:
-        logger.error(f"数据库初始化失败: {e}")
+        logger.warning("数据库连接预算检查失败: %s", e)
+    
+    warm_up = asyncio.create_task(asyncio.to_thread(warm_up_services))
+    
+    record_writer = get_record_writer()
+    if settings.write_behind_enabled:
+        record_writer.start()
+    
+    job_resumer = get_job_resumer()
+    if settings.job_resume_enabled:
+        job_resumer.start()
+    
+    usage_recorder = get_usage_recorder()
+    usage_recorder.start()
+    
+    # 预热需要 S3 与处理流程，未开启时不创建
+    cache_warmer = get_cache_warmer() if settings.cache_warm_enabled else None
+    if cache_warmer is not None:
+        cache_warmer.start(get_processing_pipeline())
+    
+    if settings.diagnostics_enabled:
+        await start_loop_monitor(
+            interval=settings.loop_lag_interval_ms / 1000,
+            threshold=settings.blocking_threshold_ms / 1000
+        )
     
     yield
     
-    # 关闭时
+    # 关闭时: 仍在继续的后台任务转交给其他 worker，再写完积压的状态更新
+    start_draining()
+    if cache_warmer is not None:
+        await cache_warmer.stop()
+    await job_resumer.stop()
+    await record_writer.stop()
+    try:
+        await usage_recorder.stop()
+    except Exception as e:
+        logger.warning("写入缓存命中统计失败: %s", e)
+    await stop_loop_monitor()
+    await warm_up
+    await dispose_engines()
+    restore_signal_handlers()
     logger.info("应用关闭")
 
 
-# 创建 FastAPI 应用
-app = FastAPI(
-    title="Audio Processing API",
-    description="音频处理后端服务 - 支持钢琴扒谱、音频分离、多轨扒谱",
-    version="1.0.0",
-    lifespan=lifespan,
-    docs_url="/docs",
-    redoc_url="/redoc"
-)
+def create_app() -> FastAPI:
+    """
+    创建 FastAPI 应用 (读取配置、配置日志、注册中间件与路由)
 
-# 配置 CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # 生产环境需要设置具体域名
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+    导入 app.main 不需要任何配置: 部署时由 gunicorn / uvicorn 调用工厂函数
+    (app.main:create_app() / --factory)。
+    """
+    settings = get_settings()
 
+    # 配置日志
+    configure_logging(
+        level=settings.log_level,
+        log_format=settings.log_format,
+        sample_rates=settings.log_sample_rates
+    )
 
-# 全局异常处理
-@app.exception_handler(Exception)
-async def global_exception_handler(request: Request, exc: Exception):
-    logger.error(f"全局异常: {exc}", exc_info=True)
-    return JSONResponse(
-        status_code=500,
-        content={
-            "status": "error",
-            "message": "服务器内部错误",
-            "detail": str(exc) if settings.debug else None
-        }
+    app = FastAPI(
+        title="Audio Processing API",
+        description="音频处理后端服务 - 支持钢琴扒谱、音频分离、多轨扒谱",
+        version="1.0.0",
+        lifespan=lifespan,
+        docs_url="/docs",
+        redoc_url="/redoc"
     )
 
+    # 上传大小与格式检查，位于限流之后
+    app.add_middleware(UploadGuardMiddleware)
+
+    # 限流与并发上限，并记下请求所属的租户 (在 CORS 之内，429 / 503 响应同样带 CORS 头)
+    app.add_middleware(AdmissionMiddleware)
+
+    # 配置 CORS
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # 生产环境需要设置具体域名
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["Server-Timing", "Retry-After"],
+    )
 
-# 注册路由
-app.include_router(piano_router)
-app.include_router(spleeter_router)
-app.include_router(yourmt3_router)
+    # 各阶段耗时响应头
+    if settings.server_timing_enabled:
+        app.add_middleware(ServerTimingMiddleware)
+
+    # 全局异常处理
+    @app.exception_handler(Exception)
+    async def global_exception_handler(request: Request, exc: Exception):
+        logger.error("全局异常: %s", exc, exc_info=True)
+        return JSONResponse(
+            status_code=500,
+            content={
+                "status": "error",
+                "message": "服务器内部错误",
+                "detail": str(exc) if settings.debug else None
+            }
+        )
+
+    # 注册路由
+    app.include_router(piano_router)
+    app.include_router(spleeter_router)
+    app.include_router(yourmt3_router)
+    app.include_router(jobs_router)
+    app.include_router(midi_router)
+    app.include_router(admin_router)
+    app.add_api_route("/", root, methods=["GET"])
+    app.add_api_route("/health", health_check, methods=["GET"])
+    return app
 
 
-@app.get("/")
 async def root():
     """根路径"""
     return {
@@ -89,7 +190,6 @@ async def root():
     }
 
 
-@app.get("/health")
 async def health_check():
     """健康检查"""
     return {
@@ -101,8 +201,9 @@ async def health_check():
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
-        "app.main:app",
+        "app.main:create_app",
+        factory=True,
         host="0.0.0.0",
         port=8000,
-        reload=settings.debug
+        reload=get_settings().debug
     )
@@ -0,0 +1,323 @@
+"""
+数据库维护命令
+
+    python -m app.maintenance ensure-schema
+    python -m app.maintenance check-schema
+    python -m app.maintenance prune --failed-days 7 --stale-hours 6
+    python -m app.maintenance rollup
+    python -m app.maintenance report --hours 168 --group-by service_type,tenant
+
+- ensure-schema: 创建缺失的表和索引、补齐新增的列，并把 file_hash 的唯一索引改为普通索引；
+  为旧的 Spleeter 记录补写 params_fingerprint 与音轨登记 (StemArtifact)，升级前的缓存仍能命中。
+  生产环境由 gunicorn 在启动 worker 之前执行 (gunicorn.conf.py 的 on_starting，SCHEMA_AUTO_UPDATE=false 时跳过)
+- check-schema: 只检查数据库结构是否与模型一致，不一致时列出差异并以状态码 1 退出 (应用启动时也会检查)
+- prune: 把过期的失败记录和长时间卡在 processing 的记录分批移入 processing_records_archive，
+  每批一个短事务 (DELETE ... RETURNING + INSERT)，批次之间可以休眠以减轻对线上流量的影响
+- rollup: 把新结束的任务增量汇总到 usage_rollups (可由 cron 定时执行，应在 prune 之前)
+- report: 输出 usage_rollups 中的用量汇总 (JSON)
+"""
+import argparse
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import and_, delete, func, insert, inspect, or_, select, text
+from sqlalchemy.schema import CreateColumn
+
+from app.config import get_settings
+from app.database import get_engine, dispose_engines
+from app.logging_config import configure_logging
+from app.models import Base, ProcessingRecord, StemArtifact, processing_records_archive
+
+logger = logging.getLogger(__name__)
+
+# 更新数据库结构用的事务级咨询锁: 多个实例同时启动时依次执行，后执行的看到的已是更新后的结构
+SCHEMA_LOCK_KEY = 0x736368656d61
+
+
+def build_prune_condition(
+    failed_days: int,
+    stale_hours: int,
+    completed_days: Optional[int] = None,
+    now: Optional[datetime] = None
+):
+    """需要归档的记录: 过期的失败记录、卡住的处理中记录，以及 (可选) 过期的已完成记录"""
+    now = now or datetime.utcnow()
+    last_touched = func.coalesce(ProcessingRecord.updated_at, ProcessingRecord.created_at)
+    conditions = [
+        and_(ProcessingRecord.status == "failed", last_touched < now - timedelta(days=failed_days)),
+        and_(ProcessingRecord.status == "processing", last_touched < now - timedelta(hours=stale_hours)),
+    ]
+    if completed_days is not None:
+        conditions.append(
+            and_(ProcessingRecord.status == "completed", last_touched < now - timedelta(days=completed_days))
+        )
+    return or_(*conditions)
+
+
+def build_archive_batch(condition, batch_size: int):
+    """
+    移动一批记录的语句:
+        WITH moved AS (DELETE FROM processing_records WHERE id IN (... FOR UPDATE SKIP LOCKED) RETURNING *)
+        INSERT INTO processing_records_archive SELECT ... FROM moved
+    SKIP LOCKED 保证不会等待正在被写后缓冲更新的行。
+    """
+    columns = [column.name for column in ProcessingRecord.__table__.columns]
+    batch = (
+        select(ProcessingRecord.id)
+        .where(condition)
+        .order_by(ProcessingRecord.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    moved = (
+        delete(ProcessingRecord)
+        .where(ProcessingRecord.id.in_(batch.scalar_subquery()))
+        .returning(*ProcessingRecord.__table__.columns)
+        .cte("moved")
+    )
+    return (
+        insert(processing_records_archive)
+        .from_select(
+            [*columns, "archived_at"],
+            select(*(moved.c[name] for name in columns), func.timezone("utc", func.now()))
+        )
+    )
+
+
+async def prune(
+    failed_days: int = 7,
+    stale_hours: int = 6,
+    completed_days: Optional[int] = None,
+    batch_size: int = 1000,
+    sleep: float = 0.5,
+    dry_run: bool = False
+) -> int:
+    """分批归档，返回移动的记录数"""
+    condition = build_prune_condition(failed_days, stale_hours, completed_days)
+
+    if dry_run:
+        async with get_engine().connect() as conn:
+            count = (await conn.execute(
+                select(func.count()).select_from(ProcessingRecord).where(condition)
+            )).scalar()
+        logger.info("待归档记录: %s 条 (dry run)", count)
+        return count
+
+    stmt = build_archive_batch(condition, batch_size)
+    total = 0
+    while True:
+        async with get_engine().begin() as conn:
+            moved = (await conn.execute(stmt)).rowcount
+        total += moved
+        if moved:
+            logger.info("已归档 %s 条记录，累计 %s 条", moved, total)
+        if moved < batch_size:
+            break
+        await asyncio.sleep(sleep)
+    logger.info("✅ 归档完成，共移动 %s 条记录", total)
+    return total
+
+
+async def ensure_schema():
+    """
+    让已有数据库跟上模型定义 (项目没有迁移工具):
+    - 创建缺失的表 (如 processing_records_archive) 和索引
+    - 为已有表补齐模型中新增的列
+    - file_hash 改为普通索引: 同一文件允许多条记录 (失败后重试)
+    - 列与模型定义不一致的同名索引删除后重建 (如缓存查询索引加入 params_fingerprint)
+    - 补写旧 Spleeter 记录的参数指纹与音轨登记 (backfill_spleeter)
+    """
+    def _sync(conn):
+        inspector = inspect(conn)
+        existing_tables = set(inspector.get_table_names())
+
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+                    logger.info("补齐列: %s.%s", table.name, column.name)
+
+        if ProcessingRecord.__tablename__ in existing_tables:
+            for index in inspector.get_indexes(ProcessingRecord.__tablename__):
+                if index["name"] == "ix_processing_records_file_hash" and index["unique"]:
+                    conn.execute(text("DROP INDEX ix_processing_records_file_hash"))
+                    logger.info("已删除 file_hash 唯一索引")
+
+        model_indexes = {index.name: index for table in Base.metadata.sorted_tables for index in table.indexes}
+        for table_name in existing_tables & {table.name for table in Base.metadata.sorted_tables}:
+            for index in inspect(conn).get_indexes(table_name):
+                model_index = model_indexes.get(index["name"])
+                if model_index is not None and index["column_names"] != [column.name for column in model_index.columns]:
+                    conn.execute(text(f"DROP INDEX {index['name']}"))
+                    logger.info("索引定义已变化，删除后重建: %s", index["name"])
+
+        # create_all 只处理缺失的表，已有表上缺失的索引需要单独创建
+        Base.metadata.create_all(conn)
+        for table in Base.metadata.sorted_tables:
+            if table.name in existing_tables:
+                for index in table.indexes:
+                    index.create(conn, checkfirst=True)
+
+    async with get_engine().begin() as conn:
+        if conn.dialect.name == "postgresql":
+            await conn.execute(select(func.pg_advisory_xact_lock(SCHEMA_LOCK_KEY)))
+        await conn.run_sync(_sync)
+    await backfill_spleeter()
+    logger.info("✅ 数据库结构已更新")
+
+
+def find_schema_drift(conn) -> List[str]:
+    """数据库结构与模型定义的差异 (缺失的表、列、索引，以及列或唯一性不一致的索引)，一致时为空"""
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+    drift = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            drift.append(f"缺少表 {table.name}")
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        drift.extend(
+            f"缺少列 {table.name}.{column.name}" for column in table.columns if column.name not in existing_columns
+        )
+        existing_indexes = {index["name"]: index for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            existing = existing_indexes.get(index.name)
+            if existing is None:
+                drift.append(f"缺少索引 {index.name}")
+            elif (
+                existing["column_names"] != [column.name for column in index.columns]
+                or bool(existing["unique"]) != bool(index.unique)
+            ):
+                drift.append(f"索引定义不一致 {index.name}")
+    return drift
+
+
+async def check_schema() -> List[str]:
+    async with get_engine().connect() as conn:
+        return await conn.run_sync(find_schema_drift)
+
+
+async def backfill_spleeter(batch_size: int = 1000) -> int:
+    """
+    params_fingerprint 上线之前的 Spleeter 记录没有指纹，缓存查询永远不会命中它们:
+    按 output_data 中 RunPod 返回的 format / bitrate 补写 (没有时按 SpleeterService.default_params)。
+    其中已完成、还没有登记音轨的记录同时登记 StemArtifact，可作为派生其他布局与编码的来源。
+    按 id 分批，每批一个短事务，可重复执行，返回补写的记录数。
+    """
+    from app.database import session_scope
+    from app.services.spleeter_service import get_spleeter_service
+    from app.services.stems import record_artifacts
+
+    service = get_spleeter_service()
+    total = 0
+    last_id = 0
+    while True:
+        async with session_scope() as db:
+            records = (await db.scalars(
+                select(ProcessingRecord)
+                .where(
+                    ProcessingRecord.service_type == service.service_type,
+                    ProcessingRecord.params_fingerprint.is_(None),
+                    ProcessingRecord.id > last_id
+                )
+                .order_by(ProcessingRecord.id)
+                .limit(batch_size)
+            )).all()
+            if not records:
+                break
+            registered = set((await db.execute(
+                select(StemArtifact.file_hash, StemArtifact.layout)
+                .where(StemArtifact.file_hash.in_({record.file_hash for record in records}))
+            )).all())
+            for record in records:
+                output_data = record.output_data or {}
+                record.params_fingerprint = service.params_fingerprint(**{
+                    name: output_data.get(name) or service.default_params.get(name)
+                    for name in service.fingerprint_params
+                })
+                if record.status == "completed" and (record.file_hash, record.stems) not in registered:
+                    artifacts = record_artifacts(record)
+                    db.add_all(artifacts)
+                    if artifacts:
+                        registered.add((record.file_hash, record.stems))
+            await db.commit()
+        total += len(records)
+        last_id = records[-1].id
+        logger.info("已补写 %s 条 Spleeter 记录的参数指纹，累计 %s 条", len(records), total)
+    return total
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.maintenance", description="数据库维护")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("ensure-schema", help="创建缺失的表、索引和列")
+    commands.add_parser("check-schema", help="检查数据库结构是否与模型一致")
+
+    prune_parser = commands.add_parser("prune", help="把失败和卡住的记录移入归档表")
+    prune_parser.add_argument("--failed-days", type=int, default=7, help="失败记录保留天数")
+    prune_parser.add_argument("--stale-hours", type=int, default=6, help="processing 状态超过该时长视为卡住")
+    prune_parser.add_argument("--completed-days", type=int, help="已完成记录保留天数 (默认永久保留，作为缓存)")
+    prune_parser.add_argument("--batch-size", type=int, default=1000)
+    prune_parser.add_argument("--sleep", type=float, default=0.5, help="批次之间休眠的秒数")
+    prune_parser.add_argument("--dry-run", action="store_true", help="只统计待归档记录数")
+
+    commands.add_parser("rollup", help="增量汇总用量到 usage_rollups")
+
+    report_parser = commands.add_parser("report", help="输出用量汇总")
+    report_parser.add_argument("--hours", type=int, default=24, help="统计最近多少小时")
+    report_parser.add_argument("--group-by", default="service_type", help="逗号分隔: bucket / service_type / tenant")
+    return parser
+
+
+async def main_async(args) -> int:
+    try:
+        if args.command == "ensure-schema":
+            await ensure_schema()
+        elif args.command == "check-schema":
+            drift = await check_schema()
+            for item in drift:
+                logger.error("数据库结构与模型不一致: %s", item)
+            if drift:
+                return 1
+            logger.info("✅ 数据库结构与模型一致")
+        elif args.command == "prune":
+            await prune(
+                failed_days=args.failed_days,
+                stale_hours=args.stale_hours,
+                completed_days=args.completed_days,
+                batch_size=args.batch_size,
+                sleep=args.sleep,
+                dry_run=args.dry_run
+            )
+        elif args.command in ("rollup", "report"):
+            # 只有这两个命令需要，避免其他命令导入整个服务层
+            from app.services.usage import rollup_usage, usage_report
+
+            await rollup_usage()
+            if args.command == "report":
+                rows = await usage_report(
+                    datetime.utcnow() - timedelta(hours=args.hours),
+                    group_by=[name.strip() for name in args.group_by.split(",") if name.strip()]
+                )
+                print(json.dumps(rows, default=str, ensure_ascii=False, indent=2))
+    finally:
+        await dispose_engines()
+    return 0
+
+
+def main():
+    settings = get_settings()
+    configure_logging(settings.log_level, settings.log_format)
+    raise SystemExit(asyncio.run(main_async(build_parser().parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, DateTime, Float, JSON
+from sqlalchemy import Column, String, Integer, BigInteger, Boolean, DateTime, Float, JSON, Index, Table, text
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 
@@ -10,19 +10,120 @@ class ProcessingRecord(Base):
     __tablename__ = "processing_records"
     
     id = Column(Integer, primary_key=True, index=True)
-    file_hash = Column(String, unique=True, index=True, nullable=False, comment="文件MD5哈希值")
+    file_hash = Column(String, index=True, nullable=False, comment="文件MD5哈希值")
     original_filename = Column(String, nullable=False, comment="原始文件名")
     service_type = Column(String, nullable=False, index=True, comment="服务类型: piano/spleeter/yourmt3")
     input_s3_url = Column(String, nullable=False, comment="输入音频S3 URL")
     output_s3_url = Column(String, comment="输出结果S3 URL")
     output_data = Column(JSON, comment="额外的输出数据(如spleeter的文件列表)")
-    status = Column(String, default="processing", comment="状态: processing/completed/failed")
+    status = Column(String, default="processing", comment="状态: processing/completed/failed/handed_off")
     runpod_job_id = Column(String, comment="RunPod任务ID")
     error_message = Column(String, comment="错误信息")
+    failure_kind = Column(String, comment="失败类型: permanent (输入无法处理) / transient (可重试) / environment (配置或权限问题)")
     processing_time = Column(Float, comment="处理时间(秒)")
     stems = Column(Integer, comment="Spleeter stems参数")
+    params_fingerprint = Column(String, comment="影响结果编码的参数指纹, 如 format=mp3;bitrate=192k")
+    tenant = Column(String, comment="租户 (API Key 的哈希)，匿名请求为空")
+    input_bytes = Column(BigInteger, comment="上传文件大小(字节)")
+    input_duration = Column(Float, comment="音频时长(秒)，检测过时长才有")
+    queue_seconds = Column(Float, comment="RunPod 排队时间(秒)")
+    exec_seconds = Column(Float, comment="RunPod 执行时间(秒)，即 GPU 时间")
+    poll_count = Column(Integer, comment="查询任务状态的次数")
+    finished_at = Column(DateTime, comment="完成或失败的时间")
+    claimed_at = Column(DateTime, comment="转交任务被 worker 认领 / 续租的时间 (租约)，普通请求为空")
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        # 缓存查询专用的部分索引: 只索引已完成的记录，失败、处理中的记录再多也不影响其大小
+        Index(
+            "ix_processing_records_cache_lookup",
+            "file_hash", "service_type", "stems", "params_fingerprint",
+            postgresql_where=text("status = 'completed'")
+        ),
+        # 失败记录缓存 (输入无法处理的请求在一段时间内直接拒绝) 专用的部分索引
+        Index(
+            "ix_processing_records_failure_lookup",
+            "file_hash", "service_type", "stems", "params_fingerprint", "finished_at",
+            postgresql_where=text("status = 'failed' AND failure_kind = 'permanent'")
+        ),
+        # 合并并发的相同请求 (single-flight) 时查询进行中记录的部分索引
+        Index(
+            "ix_processing_records_inflight_lookup",
+            "file_hash", "service_type", "stems", "params_fingerprint",
+            postgresql_where=text("status IN ('processing', 'handed_off')")
+        ),
+        # 归档清理按状态和更新时间扫描
+        Index("ix_processing_records_status_updated_at", "status", "updated_at"),
+        # 用量汇总按完成时间增量扫描
+        Index("ix_processing_records_finished_at", "finished_at"),
+    )
+    
     def __repr__(self):
         return f"<ProcessingRecord(id={self.id}, file_hash={self.file_hash}, service_type={self.service_type})>"
+
+
+class StemArtifact(Base):
+    """Spleeter 单个音轨文件 (音轨级缓存)，用于由更多音轨的结果派生较少音轨的布局"""
+    __tablename__ = "stem_artifacts"
+    
+    id = Column(Integer, primary_key=True)
+    file_hash = Column(String, nullable=False, comment="源文件MD5哈希值")
+    layout = Column(Integer, nullable=False, comment="所属音轨布局 (stems 参数)")
+    stem = Column(String, nullable=False, comment="音轨名: vocals/accompaniment/drums/bass/piano/other")
+    format = Column(String, comment="编码格式")
+    bitrate = Column(String, comment="比特率")
+    s3_url = Column(String, nullable=False, comment="文件 URL (archive_member 不为空时为所在 ZIP 的 URL)")
+    archive_member = Column(String, comment="在 ZIP 中的路径，为空表示单独存放的文件")
+    s3_key = Column(String, comment="单独存放的音轨文件的 S3 key")
+    size_kb = Column(Float, comment="文件大小(KB)")
+    record_id = Column(Integer, index=True, comment="产生该音轨的处理记录")
+    derived = Column(Boolean, default=False, comment="是否由更多音轨的结果混合得到")
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("ix_stem_artifacts_lookup", "file_hash", "layout", "stem"),
+    )
+    
+    def __repr__(self):
+        return f"<StemArtifact(id={self.id}, file_hash={self.file_hash}, layout={self.layout}, stem={self.stem})>"
+
+
+class UsageRollup(Base):
+    """
+    按小时、服务、租户汇总的用量 (由 app.services.usage 增量维护，报表只查询该表)。
+    任务相关的列按 processing_records.finished_at 重新计算，缓存命中的列由各进程累加写入。
+    """
+    __tablename__ = "usage_rollups"
+    
+    bucket = Column(DateTime, primary_key=True, comment="小时 (UTC)")
+    service_type = Column(String, primary_key=True)
+    tenant = Column(String, primary_key=True, default="", comment="租户，匿名为空字符串")
+    jobs = Column(Integer, default=0, comment="结束的任务数")
+    completed = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    queue_seconds = Column(Float, default=0.0)
+    exec_seconds = Column(Float, default=0.0, comment="GPU 时间")
+    input_bytes = Column(BigInteger, default=0)
+    input_seconds = Column(Float, default=0.0, comment="已知时长的音频总时长")
+    poll_count = Column(Integer, default=0)
+    cache_hits = Column(Integer, default=0)
+    saved_seconds = Column(Float, default=0.0, comment="缓存命中节省的 GPU 时间")
+    rolled_at = Column(DateTime, comment="任务列最后一次重新计算的时间，为空表示只有缓存命中")
+    
+    def __repr__(self):
+        return f"<UsageRollup(bucket={self.bucket}, service_type={self.service_type}, tenant={self.tenant})>"
+
+
+# 归档表: 结构与 processing_records 相同 (不含索引和默认值)，另加归档时间。
+# 失败、长时间卡在处理中的记录由 app.maintenance 批量移入，保持热表精简。
+processing_records_archive = Table(
+    "processing_records_archive",
+    Base.metadata,
+    *(
+        Column(column.name, column.type, primary_key=column.primary_key, autoincrement=False, comment=column.comment)
+        for column in ProcessingRecord.__table__.columns
+    ),
+    Column("archived_at", DateTime, default=datetime.utcnow, index=True, comment="归档时间"),
+)
+
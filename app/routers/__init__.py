@@ -1,9 +1,15 @@
 from .piano import router as piano_router
 from .spleeter import router as spleeter_router
 from .yourmt3 import router as yourmt3_router
+from .jobs import router as jobs_router
+from .midi import router as midi_router
+from .admin import router as admin_router
 
 __all__ = [
     "piano_router",
     "spleeter_router",
-    "yourmt3_router"
+    "yourmt3_router",
+    "jobs_router",
+    "midi_router",
+    "admin_router"
 ]
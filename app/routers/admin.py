@@ -0,0 +1,111 @@
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from datetime import datetime, timedelta
+import hmac
+from typing import Optional
+from app import diagnostics
+from app.admission import get_admission_controller
+from app.config import get_settings
+from app.database import get_engine, get_read_engine
+from app.services.cache_warmer import get_cache_warmer
+from app.services.usage import usage_report
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(tags=["Admin"])
+
+
+def verify_admin(x_admin_token: Optional[str]):
+    """要求请求头 X-Admin-Token 与 ADMIN_TOKEN 一致；未配置 ADMIN_TOKEN 时管理接口不可用 (404)"""
+    admin_token = get_settings().admin_token
+    if not admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode(), admin_token.encode()):
+        raise HTTPException(status_code=403, detail="无权访问")
+
+
+def _pool_stats(target=None) -> dict:
+    pool = (target or get_engine()).pool
+    stats = {}
+    for name in ("size", "checkedout", "checkedin", "overflow"):
+        method = getattr(pool, name, None)
+        if callable(method):
+            stats[name] = method()
+    return stats
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus 文本格式指标"""
+    lines = []
+    for name, value in _pool_stats().items():
+        lines.append(f"db_pool_{name} {value}")
+    read_engine = get_read_engine()
+    if read_engine is not None:
+        for name, value in _pool_stats(read_engine).items():
+            lines.append(f"db_read_pool_{name} {value}")
+
+    monitor = diagnostics.loop_monitor
+    if monitor is not None:
+        stats = monitor.stats()
+        lines += [
+            "# TYPE event_loop_lag_seconds summary",
+            f'event_loop_lag_seconds{{quantile="0.5"}} {stats["lag_p50_s"]:.6f}',
+            f'event_loop_lag_seconds{{quantile="0.99"}} {stats["lag_p99_s"]:.6f}',
+            f"event_loop_lag_seconds_max {stats['lag_max_s']:.6f}",
+            "# TYPE event_loop_blocked_total counter",
+            f"event_loop_blocked_total {stats['blocked_total']}",
+            "# TYPE event_loop_blocked_seconds_total counter",
+            f"event_loop_blocked_seconds_total {stats['blocked_seconds_total']:.6f}",
+        ]
+    admission = get_admission_controller()
+    lines.append("# TYPE admission_rejected_total counter")
+    for reason, count in admission.rejected.items():
+        lines.append(f'admission_rejected_total{{reason="{reason}"}} {count}')
+    lines.append("# TYPE inflight_requests gauge")
+    for service, count in admission.inflight.items():
+        lines.append(f'inflight_requests{{service="{service}"}} {count}')
+    if get_settings().cache_warm_enabled:
+        lines.append("# TYPE cache_warm_total counter")
+        for outcome, count in get_cache_warmer().stats.items():
+            lines.append(f'cache_warm_total{{outcome="{outcome}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+@router.get("/admin/usage")
+async def get_usage(
+    hours: int = Query(default=24, ge=1, le=24 * 366, description="统计最近多少小时"),
+    group_by: str = Query(default="service_type", description="逗号分隔: bucket / service_type / tenant"),
+    x_admin_token: Optional[str] = Header(default=None)
+):
+    """
+    按服务 / 租户 / 小时汇总的用量 (排队与 GPU 时间、输入大小与时长、轮询次数、缓存命中节省的 GPU 时间)
+
+    只读 usage_rollups，数据由后台任务 (USAGE_ROLLUP_INTERVAL_S) 或 maintenance rollup 汇总
+    """
+    verify_admin(x_admin_token)
+    await get_usage_recorder().flush()
+    await rollup_usage()
+    try:
+        rows = await usage_report(
+            datetime.utcnow() - timedelta(hours=hours),
+            group_by=[name.strip() for name in group_by.split(",") if name.strip()]
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"hours": hours, "group_by": group_by, "rows": rows}
+
+
+@router.get("/admin/diagnostics")
+async def get_diagnostics(x_admin_token: Optional[str] = Header(default=None)):
+    """事件循环延迟统计与最近的阻塞调用栈"""
+    verify_admin(x_admin_token)
+    monitor = diagnostics.loop_monitor
+    read_engine = get_read_engine()
+    return {
+        "enabled": monitor is not None,
+        "db_pool": _pool_stats(),
+        "db_read_pool": _pool_stats(read_engine) if read_engine is not None else None,
+        "event_loop": monitor.stats() if monitor is not None else None,
+    }
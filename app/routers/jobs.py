@@ -0,0 +1,21 @@
+from fastapi import APIRouter, HTTPException, Query, Depends
+from app.schemas import ProcessingRecordSchema
+from app.services import JobService, get_job_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/jobs", tags=["Jobs"])
+
+
+@router.get("/{token}", response_model=ProcessingRecordSchema)
+async def get_job(
+    token: str,
+    fresh: bool = Query(default=False, description="是否强制读取主库 (跳过只读副本)"),
+    job_service: JobService = Depends(get_job_service)
+):
+    """查询处理记录 (任务状态)，token 为处理接口返回的结果令牌"""
+    record = await job_service.get_record_by_token(token, fresh=fresh)
+    if record is None:
+        raise HTTPException(status_code=404, detail="记录不存在")
+    return record
@@ -0,0 +1,96 @@
+from fastapi import APIRouter, HTTPException, Depends, Path, Query
+from fastapi.responses import Response
+from typing import Optional
+from app.models import ProcessingRecord
+from app.schemas import MidiProgramsResponse, MidiProgramInfo
+from app.services import JobService, get_job_service, MidiViews, get_midi_views
+from app.services.midi_views import MIDI_SERVICES
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/midi", tags=["MIDI"])
+
+GRID_QUERY = Query(default=None, ge=1, le=64, description="量化网格: 按 1/N 音符对齐，如 16 为十六分音符")
+
+
+async def _midi_record(token: str, job_service: JobService) -> ProcessingRecord:
+    """结果令牌对应的已完成的扒谱记录 (Piano / YourMT3)"""
+    record = await job_service.get_record_by_token(token)
+    if record is None or record.service_type not in MIDI_SERVICES:
+        raise HTTPException(status_code=404, detail="记录不存在")
+    if record.status != "completed" or not record.output_s3_url:
+        raise HTTPException(status_code=409, detail=f"处理尚未完成，当前状态: {record.status}")
+    return record
+
+
+async def _render(coroutine):
+    try:
+        return await coroutine
+    except Exception as e:
+        logger.error("❌ 生成 MIDI 派生格式失败: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail=f"生成失败: {str(e)}")
+
+
+@router.get("/{token}/notes")
+async def get_notes(
+    token: str,
+    quantize: Optional[int] = GRID_QUERY,
+    job_service: JobService = Depends(get_job_service),
+    views: MidiViews = Depends(get_midi_views)
+):
+    """
+    音符 JSON: {"bpm", "tracks", "fields", "notes"}，notes 为按 fields 排列的二维数组
+    (start_ms, end_ms, pitch, velocity, program, channel, track)
+    """
+    record = await _midi_record(token, job_service)
+    content = await _render(views.notes_json(record, grid=quantize))
+    return Response(content=content, media_type="application/json")
+
+
+@router.get("/{token}/programs", response_model=MidiProgramsResponse)
+async def list_programs(
+    token: str,
+    job_service: JobService = Depends(get_job_service),
+    views: MidiViews = Depends(get_midi_views)
+):
+    """结果中的各音色及其音符数，附单独下载的地址"""
+    record = await _midi_record(token, job_service)
+    notes = await _render(views.notes(record))
+    return MidiProgramsResponse(
+        record_id=record.id,
+        bpm=notes.bpm,
+        programs=[
+            MidiProgramInfo(program=program, notes=count, midi_url=f"/api/midi/{token}/programs/{program}.mid")
+            for program, count in notes.programs().items()
+        ]
+    )
+
+
+@router.get("/{token}/programs/{program}.mid")
+async def get_program_midi(
+    token: str,
+    program: int = Path(ge=0, le=128),
+    quantize: Optional[int] = GRID_QUERY,
+    job_service: JobService = Depends(get_job_service),
+    views: MidiViews = Depends(get_midi_views)
+):
+    """单个音色的 MIDI (按乐器拆分)"""
+    record = await _midi_record(token, job_service)
+    content = await _render(views.program_midi(record, program, grid=quantize))
+    if content is None:
+        raise HTTPException(status_code=404, detail=f"结果中没有音色 {program}")
+    return Response(content=content, media_type="audio/midi")
+
+
+@router.get("/{token}/quantized.mid")
+async def get_quantized_midi(
+    token: str,
+    grid: int = Query(default=16, ge=1, le=64, description="按 1/N 音符对齐，如 16 为十六分音符"),
+    job_service: JobService = Depends(get_job_service),
+    views: MidiViews = Depends(get_midi_views)
+):
+    """量化后的完整 MIDI"""
+    record = await _midi_record(token, job_service)
+    content = await _render(views.quantized_midi(record, grid))
+    return Response(content=content, media_type="audio/midi")
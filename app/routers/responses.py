@@ -0,0 +1,20 @@
+from fastapi.responses import JSONResponse
+from app.schemas import HandedOffResponse
+from app.services.job_service import result_token
+from app.services.pipeline import PipelineResult
+
+# 在路由上声明 202 响应，供 OpenAPI 文档使用
+HANDED_OFF_RESPONSES = {202: {"model": HandedOffResponse, "description": "服务重启，任务已转交后台继续处理"}}
+
+
+def handed_off_response(result: PipelineResult) -> JSONResponse:
+    """任务已转交后台: 返回 202 与任务状态查询地址"""
+    return JSONResponse(
+        status_code=202,
+        content=HandedOffResponse(
+            message="服务正在重启，任务已转入后台继续处理，请稍后查询结果",
+            record_id=result.record_id,
+            job_id=result.job_id,
+            status_url=f"/api/jobs/{result_token(result.record_id)}"
+        ).model_dump()
+    )
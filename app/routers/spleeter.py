@@ -1,8 +1,19 @@
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Form
-from sqlalchemy.ext.asyncio import AsyncSession
-from app.database import get_db
-from app.schemas import SpleeterResponse, SpleeterStems, SpleeterFileInfo
-from app.services import s3_service, spleeter_service
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Form, Query
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
+from typing import List, Optional
+from app.config import get_settings
+from app.models import ProcessingRecord, StemArtifact
+from app.schemas import SpleeterResponse, SpleeterStems, SpleeterFileInfo, SpleeterStemsResponse, StemFileInfo
+from app.services import (
+    SpleeterService, get_spleeter_service, ProcessingPipeline, get_processing_pipeline, JobFailedError,
+    JobService, get_job_service, StemStore, get_stem_store, OutputDelivery, get_output_delivery,
+    S3Service, get_s3_service, result_token
+)
+from app.services.delivery import IMMUTABLE_CACHE_CONTROL
+from app.services.stems import BITRATE_PATTERN, STEM_FORMATS
+from app.services.zip_stream import stream_zip
+from app.routers.responses import HANDED_OFF_RESPONSES, handed_off_response
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,125 +21,179 @@ logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/spleeter", tags=["Spleeter"])
 
 
-@router.post("/separate", response_model=SpleeterResponse)
+@router.post("/separate", response_model=SpleeterResponse, responses=HANDED_OFF_RESPONSES)
 async def separate_audio(
     file: UploadFile = File(..., description="音频文件 (MP3/WAV/M4A)"),
-    stems: int = Form(default=2, description="音轨数量: 2, 4, 或 5"),
-    format: str = Form(default="mp3", description="输出格式"),
-    bitrate: str = Form(default="192k", description="比特率"),
-    db: AsyncSession = Depends(get_db)
+    stems: int = Form(default=SpleeterService.default_params["stems"], description="音轨数量: 2, 4, 或 5"),
+    format: str = Form(default=SpleeterService.default_params["format"], description="输出格式"),
+    bitrate: str = Form(default=SpleeterService.default_params["bitrate"], description="比特率"),
+    service: SpleeterService = Depends(get_spleeter_service),
+    pipeline: ProcessingPipeline = Depends(get_processing_pipeline),
+    delivery: OutputDelivery = Depends(get_output_delivery)
 ):
     """音频分离 API"""
-    logger.info(f"========== 开始音频分离请求 ==========")
-    logger.info(f"文件名: {file.filename}, stems: {stems}, format: {format}, bitrate: {bitrate}")
+    logger.info("========== 开始音频分离请求 ==========")
+    logger.info("文件名: %s, stems: %s, format: %s, bitrate: %s", file.filename, stems, format, bitrate)
+    
+    # 验证stems参数
+    if stems not in [2, 4, 5]:
+        logger.error("stems参数无效: %s", stems)
+        raise HTTPException(status_code=400, detail="stems参数必须是 2, 4 或 5")
+    if format.strip().lower() not in STEM_FORMATS:
+        logger.error("format参数无效: %s", format)
+        raise HTTPException(status_code=400, detail=f"format参数必须是 {', '.join(STEM_FORMATS)} 之一")
+    if not BITRATE_PATTERN.match(bitrate.strip().lower()):
+        logger.error("bitrate参数无效: %s", bitrate)
+        raise HTTPException(status_code=400, detail="bitrate参数格式无效，如 128k、192k、320k")
     
     try:
-        # 验证stems参数
-        if stems not in [2, 4, 5]:
-            logger.error(f"stems参数无效: {stems}")
-            raise HTTPException(status_code=400, detail="stems参数必须是 2, 4 或 5")
-        
         # 读取文件内容
-        logger.info("读取上传文件内容...")
         file_content = await file.read()
-        logger.info(f"文件读取完成，大小: {len(file_content)} bytes ({len(file_content)/1024/1024:.2f} MB)")
-        
-        # 计算文件哈希
-        file_hash = s3_service.calculate_file_hash(file_content)
-        logger.info(f"文件哈希: {file_hash}")
-        
-        # 检查是否已有处理记录
-        existing_record = await spleeter_service.check_existing_record(db, file_hash, stems)
-        
-        if existing_record and existing_record.output_s3_url:
-            logger.info(f"✅ 找到缓存记录，直接返回结果")
-            files_info = []
-            if existing_record.output_data:
-                files_data = existing_record.output_data.get("files", [])
-                files_info = [SpleeterFileInfo(**f) for f in files_data]
-            
-            return SpleeterResponse(
-                status="success",
-                message="从缓存返回结果",
-                download_url=existing_record.output_s3_url,
-                files=files_info,
-                size_mb=existing_record.output_data.get("size_mb") if existing_record.output_data else None,
-                from_cache=True,
-                job_id=existing_record.runpod_job_id
-            )
-        
-        # 获取文件扩展名
-        file_extension = file.filename.split(".")[-1] if "." in file.filename else "mp3"
-        logger.info(f"文件扩展名: {file_extension}")
+        logger.info("文件读取完成，大小: %s bytes (%.2f MB)", len(file_content), len(file_content) / 1024 / 1024)
         
-        # 上传到S3
-        s3_url, _ = await s3_service.upload_file(
+        result = await pipeline.run(
+            service,
             file_content=file_content,
-            folder="url2mp3",
-            extension=file_extension,
-            content_type=file.content_type or "audio/mpeg"
+            filename=file.filename,
+            content_type=file.content_type,
+            stems=stems,
+            format=format,
+            bitrate=bitrate
         )
-        
-        # 创建处理记录
-        record = await spleeter_service.create_record(
-            db=db,
-            file_hash=file_hash,
-            original_filename=file.filename,
-            input_s3_url=s3_url,
-            stems=stems
-        )
-        
-        # 提交事务
-        await db.commit()
-        logger.info("数据库事务已提交")
-        
-        # 调用RunPod API
-        try:
-            result = await spleeter_service.process_audio(
-                audio_url=s3_url,
-                stems=stems,
-                format=format,
-                bitrate=bitrate
-            )
-            
-            # 检查处理状态
-            if result.get("status") == "COMPLETED":
-                await spleeter_service.update_record_success(db, record, result)
-                
-                output = result.get("output", {})
-                files_data = output.get("files", [])
-                files_info = [SpleeterFileInfo(**f) for f in files_data]
-                
-                logger.info(f"========== 音频分离请求完成 ==========")
-                return SpleeterResponse(
-                    status="success",
-                    message="音频分离完成",
-                    download_url=output.get("download_url"),
-                    files=files_info,
-                    size_mb=output.get("size_mb"),
-                    from_cache=False,
-                    job_id=result.get("id")
-                )
-            else:
-                error_msg = f"RunPod任务状态异常: {result.get('status')}"
-                await spleeter_service.update_record_failure(db, record, error_msg)
-                logger.error(f"❌ {error_msg}")
-                raise HTTPException(status_code=500, detail=error_msg)
-                
-        except Exception as e:
-            error_msg = f"RunPod API调用失败: {str(e)}"
-            logger.error(f"❌ {error_msg}", exc_info=True)
-            await spleeter_service.update_record_failure(db, record, error_msg)
-            raise HTTPException(status_code=500, detail=error_msg)
-            
-    except HTTPException:
-        raise
+    except JobFailedError as e:
+        # 输入无法处理 (重试同一文件也不会成功) 时返回 422
+        raise HTTPException(status_code=422 if e.permanent else 500, detail=str(e))
     except Exception as e:
-        logger.error(f"❌ 处理失败: {str(e)}", exc_info=True)
+        logger.error("❌ 处理失败: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
+    
+    if result.handed_off:
+        return handed_off_response(result)
+    
+    output_data = result.output_data or {}
+    logger.info("========== 音频分离请求完成 ==========")
+    return SpleeterResponse(
+        status="success",
+        message="从缓存返回结果" if result.from_cache else "音频分离完成",
+        download_url=await delivery.public_url(result.output_url),
+        files=[SpleeterFileInfo(**f) for f in output_data.get("files", [])],
+        size_mb=output_data.get("size_mb"),
+        from_cache=result.from_cache,
+        job_id=result.job_id,
+        record_id=result.record_id,
+        stems_url=f"/api/spleeter/results/{result_token(result.record_id)}/stems",
+        zip_url=f"/api/spleeter/results/{result_token(result.record_id)}/zip"
+    )
+
+
+async def _stem_files(
+    record: Optional[ProcessingRecord],
+    format: Optional[str],
+    bitrate: Optional[str],
+    stem_store: StemStore
+) -> List[StemArtifact]:
+    """已完成的分离结果中单独存放的各音轨 (首次请求某个格式时拆分 / 转换)"""
+    if record is None or record.service_type != "spleeter":
+        raise HTTPException(status_code=404, detail="记录不存在")
+    if record.status != "completed" or not record.output_s3_url:
+        raise HTTPException(status_code=409, detail=f"处理尚未完成，当前状态: {record.status}")
+    try:
+        return await stem_store.stem_files(record, format=format, bitrate=bitrate)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error("❌ 音轨拆分失败，记录ID %s: %s", record.id, e, exc_info=True)
+        raise HTTPException(status_code=500, detail=f"音轨拆分失败: {str(e)}")
+
+
+@router.get("/results/{token}/stems", response_model=SpleeterStemsResponse)
+async def get_stem_urls(
+    token: str,
+    format: Optional[str] = Query(default=None, description="输出格式 (mp3/ogg/wav/flac)，默认与分离结果相同"),
+    bitrate: Optional[str] = Query(default=None, description="比特率，默认与分离结果相同"),
+    job_service: JobService = Depends(get_job_service),
+    stem_store: StemStore = Depends(get_stem_store),
+    delivery: OutputDelivery = Depends(get_output_delivery)
+):
+    """各音轨的临时下载链接，只需要部分音轨的客户端不必下载整个 ZIP"""
+    record = await job_service.get_record_by_token(token)
+    artifacts = await _stem_files(record, format, bitrate, stem_store)
+    expires_in = get_settings().stem_url_expires_s
+    urls = await asyncio.gather(*(delivery.url_for_key(artifact.s3_key, expires_in) for artifact in artifacts))
+    return SpleeterStemsResponse(
+        record_id=record.id,
+        stems=[
+            StemFileInfo(
+                stem=artifact.stem,
+                url=url,
+                format=artifact.format,
+                bitrate=artifact.bitrate,
+                size_kb=artifact.size_kb
+            )
+            for artifact, url in zip(artifacts, urls)
+        ],
+        expires_in=expires_in
+    )
+
+
+@router.get("/results/{token}/stems/{stem}")
+async def download_stem(
+    token: str,
+    stem: str,
+    format: Optional[str] = Query(default=None, description="输出格式 (mp3/ogg/wav/flac)，默认与分离结果相同"),
+    bitrate: Optional[str] = Query(default=None, description="比特率，默认与分离结果相同"),
+    job_service: JobService = Depends(get_job_service),
+    stem_store: StemStore = Depends(get_stem_store),
+    s3: S3Service = Depends(get_s3_service),
+    delivery: OutputDelivery = Depends(get_output_delivery)
+):
+    """下载单个音轨: 开启磁盘缓存时由本节点直接发送缓存文件，否则重定向到下载链接"""
+    record = await job_service.get_record_by_token(token)
+    artifacts = await _stem_files(record, format, bitrate, stem_store)
+    artifact = next((artifact for artifact in artifacts if artifact.stem == stem.lower()), None)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail=f"结果中没有该音轨: {stem}")
+    path = await s3.local_path(artifact.s3_key)
+    if path is None:
+        url = await delivery.url_for_key(artifact.s3_key, get_settings().stem_url_expires_s)
+        return RedirectResponse(url, status_code=307)
+    return FileResponse(
+        path,
+        media_type=STEM_FORMATS[artifact.format][0],
+        filename=f"{artifact.stem}.{artifact.format}",
+        headers={"Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    )
+
+
+@router.get("/results/{token}/zip")
+async def download_zip(
+    token: str,
+    stems: Optional[str] = Query(default=None, description="逗号分隔的音轨名，如 vocals,drums，默认全部"),
+    format: Optional[str] = Query(default=None, description="输出格式 (mp3/ogg/wav/flac)，默认与分离结果相同"),
+    bitrate: Optional[str] = Query(default=None, description="比特率，默认与分离结果相同"),
+    job_service: JobService = Depends(get_job_service),
+    stem_store: StemStore = Depends(get_stem_store)
+):
+    """按需打包所选音轨: 从 S3 分块读取、边读边输出，不在内存中缓存整个 ZIP"""
+    record = await job_service.get_record_by_token(token)
+    artifacts = await _stem_files(record, format, bitrate, stem_store)
+    if stems:
+        wanted = [name.strip().lower() for name in stems.split(",") if name.strip()]
+        available = {artifact.stem: artifact for artifact in artifacts}
+        unknown = [name for name in wanted if name not in available]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"结果中没有这些音轨: {', '.join(unknown)}")
+        artifacts = [available[name] for name in dict.fromkeys(wanted)]
+    return StreamingResponse(
+        stream_zip(stem_store.zip_entries(artifacts)),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="spleeter-{record.id}.zip"'}
+    )
 
 
 @router.get("/health")
 async def health_check():
     """健康检查"""
-    return {"status": "healthy", "service": "spleeter"}
\ No newline at end of file
+    return {"status": "healthy", "service": "spleeter"}
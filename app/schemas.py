@@ -14,6 +14,7 @@ class ProcessingStatus(str, Enum):
     PROCESSING = "processing"
     COMPLETED = "completed"
     FAILED = "failed"
+    HANDED_OFF = "handed_off"
 
 
 class SpleeterStems(int, Enum):
@@ -33,6 +34,8 @@ class PianoTransResponse(BaseModel):
     midi_url: Optional[str] = None
     from_cache: bool = False
     job_id: Optional[str] = None
+    record_id: Optional[int] = None
+    notes_url: Optional[str] = Field(default=None, description="音符 JSON 地址 (其他派生格式见 /api/midi)")
 
 
 # Spleeter 相关 Schema
@@ -55,6 +58,24 @@ class SpleeterResponse(BaseModel):
     size_mb: Optional[float] = None
     from_cache: bool = False
     job_id: Optional[str] = None
+    record_id: Optional[int] = None
+    stems_url: Optional[str] = Field(default=None, description="单轨下载链接查询地址")
+    zip_url: Optional[str] = Field(default=None, description="按需打包下载地址")
+
+
+class StemFileInfo(BaseModel):
+    stem: str
+    url: str
+    format: Optional[str] = None
+    bitrate: Optional[str] = None
+    size_kb: Optional[float] = None
+
+
+class SpleeterStemsResponse(BaseModel):
+    """各音轨的临时下载链接"""
+    record_id: int
+    stems: List[StemFileInfo]
+    expires_in: int
 
 
 # YourMT3 相关 Schema
@@ -68,6 +89,21 @@ class YourMT3Response(BaseModel):
     midi_url: Optional[str] = None
     from_cache: bool = False
     job_id: Optional[str] = None
+    record_id: Optional[int] = None
+    notes_url: Optional[str] = Field(default=None, description="音符 JSON 地址 (其他派生格式见 /api/midi)")
+
+
+# MIDI 派生格式
+class MidiProgramInfo(BaseModel):
+    program: int = Field(description="GM 音色号 (0-127)，128 表示打击乐")
+    notes: int
+    midi_url: str
+
+
+class MidiProgramsResponse(BaseModel):
+    record_id: int
+    bpm: float
+    programs: List[MidiProgramInfo]
 
 
 # 通用响应
@@ -77,13 +113,20 @@ class ErrorResponse(BaseModel):
     detail: Optional[str] = None
 
 
-# 数据库记录 Schema
+class HandedOffResponse(BaseModel):
+    """服务重启时任务已转交后台继续处理 (HTTP 202)"""
+    status: str = "accepted"
+    message: str
+    record_id: int
+    job_id: Optional[str] = None
+    status_url: str
+
+
+# 数据库记录 Schema (公开的任务状态: 不含输入文件地址、原始文件名与租户)
 class ProcessingRecordSchema(BaseModel):
     id: int
     file_hash: str
-    original_filename: str
     service_type: str
-    input_s3_url: str
     output_s3_url: Optional[str]
     output_data: Optional[Dict[str, Any]]
     status: str
@@ -1,11 +1,56 @@
-from .s3_service import s3_service
-from .piano_service import piano_service
-from .spleeter_service import spleeter_service
-from .yourmt3_service import yourmt3_service
+from .disk_cache import DiskCache, get_disk_cache
+from .s3_service import S3Service, get_s3_service
+from .audio_normalizer import AudioNormalizer, NormalizeProfile, get_audio_normalizer
+from .chunking import AudioChunker, get_audio_chunker
+from .runpod_service import RunPodService
+from .piano_service import PianoTransService, get_piano_service
+from .spleeter_service import SpleeterService, get_spleeter_service
+from .yourmt3_service import YourMT3Service, get_yourmt3_service
+from .delivery import OutputDelivery, get_output_delivery
+from .stems import StemStore, get_stem_store
+from .midi_views import MidiViews, get_midi_views
+from .usage import UsageRecorder, get_usage_recorder
+from .cache_warmer import CacheWarmer, get_cache_warmer
+from .pipeline import ProcessingPipeline, get_processing_pipeline, JobFailedError
+from .job_service import JobService, get_job_service, result_token
+from .record_writer import RecordWriteBuffer, get_record_writer
+from .job_resumer import JobResumer, get_job_resumer
 
 __all__ = [
-    "s3_service",
-    "piano_service",
-    "spleeter_service",
-    "yourmt3_service"
+    "DiskCache",
+    "get_disk_cache",
+    "S3Service",
+    "get_s3_service",
+    "AudioNormalizer",
+    "NormalizeProfile",
+    "get_audio_normalizer",
+    "AudioChunker",
+    "get_audio_chunker",
+    "RunPodService",
+    "PianoTransService",
+    "get_piano_service",
+    "SpleeterService",
+    "get_spleeter_service",
+    "YourMT3Service",
+    "get_yourmt3_service",
+    "OutputDelivery",
+    "get_output_delivery",
+    "StemStore",
+    "get_stem_store",
+    "MidiViews",
+    "get_midi_views",
+    "UsageRecorder",
+    "get_usage_recorder",
+    "CacheWarmer",
+    "get_cache_warmer",
+    "ProcessingPipeline",
+    "get_processing_pipeline",
+    "JobFailedError",
+    "JobService",
+    "get_job_service",
+    "result_token",
+    "RecordWriteBuffer",
+    "get_record_writer",
+    "JobResumer",
+    "get_job_resumer"
 ]
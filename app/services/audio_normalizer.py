@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional, Tuple
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# 编码格式 → (ffmpeg 编码参数, 容器格式, 扩展名, Content-Type)
+CODECS = {
+    "flac": (["-c:a", "flac", "-compression_level", "5"], "flac", "flac", "audio/flac"),
+    "opus": (["-c:a", "libopus", "-b:a", "96k"], "ogg", "ogg", "audio/ogg"),
+}
+
+
+def write_temp_file(file_content: bytes, suffix: str = "") -> str:
+    """把内容写入临时文件并返回路径 (调用方负责删除)，应在线程中调用"""
+    with tempfile.NamedTemporaryFile(prefix="audio-", suffix=suffix, delete=False) as f:
+        f.write(file_content)
+        return f.name
+
+
+async def run_process(args: List[str], timeout: float) -> Tuple[Optional[int], bytes, bytes]:
+    """运行子进程并收集输出；超时时结束进程并返回 returncode None"""
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        output, error = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        return None, b"", b""
+    return process.returncode, output, error
+
+
+@dataclass(frozen=True)
+class NormalizeProfile:
+    """模型需要的输入格式"""
+    sample_rate: int
+    channels: int
+    codec: str = "flac"
+
+    @property
+    def extension(self) -> str:
+        return CODECS[self.codec][2]
+
+    @property
+    def content_type(self) -> str:
+        return CODECS[self.codec][3]
+
+    def s3_key(self, file_hash: str) -> str:
+        """按源文件哈希与目标格式生成 key，不同服务只要目标格式相同就共用同一个文件"""
+        return f"normalized/{file_hash}/{self.sample_rate}_{self.channels}.{self.extension}"
+
+
+class AudioNormalizer:
+    """
+    上传前的音频规整: 解码、降混、重采样到模型的原生采样率并重新编码 (FLAC / Opus)
+
+    由 ffmpeg 子进程完成，事件循环只等待进程结束；同时运行的 ffmpeg 进程数受 max_concurrency 限制。
+    ffmpeg 不可用或转换失败时返回 None，调用方继续上传原文件。
+    """
+
+    def __init__(self, ffmpeg_path: str = "ffmpeg", max_concurrency: int = 0, timeout: float = 120):
+        self.ffmpeg_path = shutil.which(ffmpeg_path)
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency or os.cpu_count() or 1)
+        if self.ffmpeg_path is None:
+            logger.warning("⚠️ 未找到 ffmpeg (%s)，音频规整不可用，将上传原文件", ffmpeg_path)
+
+    @property
+    def available(self) -> bool:
+        return self.ffmpeg_path is not None
+
+    async def normalize(self, file_content: bytes, profile: NormalizeProfile) -> Optional[bytes]:
+        """返回规整后的音频；不可用或失败时返回 None"""
+        if not self.available:
+            return None
+        codec_args, container, _, _ = CODECS[profile.codec]
+        async with self._semaphore:
+            # 写入临时文件而不是管道: m4a 等容器需要可寻址的输入
+            source = await asyncio.to_thread(write_temp_file, file_content)
+            try:
+                returncode, output, error = await run_process([
+                    self.ffmpeg_path, "-hide_banner", "-loglevel", "error", "-nostdin",
+                    "-i", source,
+                    "-vn", "-map_metadata", "-1",
+                    "-ac", str(profile.channels), "-ar", str(profile.sample_rate),
+                    *codec_args, "-f", container, "pipe:1"
+                ], timeout=self.timeout)
+            finally:
+                await asyncio.to_thread(os.unlink, source)
+
+        if returncode is None:
+            logger.warning("音频规整超时 (%ss)，使用原文件", self.timeout)
+            return None
+        if returncode != 0 or not output:
+            logger.warning("音频规整失败，使用原文件: %s", error.decode(errors="replace").strip()[-500:])
+            return None
+        return output
+
+
+@lru_cache
+def get_audio_normalizer() -> AudioNormalizer:
+    settings = get_settings()
+    return AudioNormalizer(
+        ffmpeg_path=settings.ffmpeg_path,
+        max_concurrency=settings.audio_normalize_concurrency
+    )
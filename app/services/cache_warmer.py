@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+from app.admission import AdmissionController, get_admission_controller
+from app.config import get_settings
+from app.database import read_session_scope
+from app.lifecycle import is_draining
+from app.lru import LRUCache
+from app.services.piano_service import PianoTransService, get_piano_service
+from app.services.runpod_service import RunPodService
+from app.services.s3_service import S3Service, get_s3_service
+from app.services.spleeter_service import SpleeterService, get_spleeter_service
+from app.services.yourmt3_service import YourMT3Service, get_yourmt3_service
+
+logger = logging.getLogger(__name__)
+
+# 预热任务的处理记录与用量统计都记在这个租户下，报表中可单独查看预热花费的 GPU 时间
+WARM_TENANT = "cache-warmer"
+
+SERVICE_FACTORIES: Dict[str, Callable[[], RunPodService]] = {
+    "piano": get_piano_service,
+    "spleeter": get_spleeter_service,
+    "yourmt3": get_yourmt3_service,
+}
+
+# 与各路由的表单默认值相同 (都取自 RunPodService.default_params)，预热结果才能被之后的请求命中
+DEFAULT_PARAMS: Dict[str, Dict[str, Any]] = {
+    service.service_type: service.default_params
+    for service in (PianoTransService, SpleeterService, YourMT3Service)
+}
+
+
+def parse_targets(spec: str) -> List[Tuple[str, Dict[str, Any]]]:
+    """解析 "yourmt3,spleeter:stems=4" 形式的预热目标 (服务名后用 : 分隔参数，纯数字按整数处理)"""
+    targets = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        service, *pairs = item.split(":")
+        service = service.strip().lower()
+        if service not in SERVICE_FACTORIES:
+            raise ValueError(f"未知服务: {service}")
+        params = dict(DEFAULT_PARAMS.get(service, {}))
+        for pair in pairs:
+            name, _, value = pair.partition("=")
+            value = value.strip()
+            params[name.strip()] = int(value) if value.isdigit() else value
+        targets.append((service, params))
+    return targets
+
+
+def parse_hours(spec: str) -> Optional[Set[int]]:
+    """解析 "0-7,22-23" 形式的 UTC 小时范围，空字符串表示不限"""
+    if not spec.strip():
+        return None
+    hours: Set[int] = set()
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        start, _, end = item.partition("-")
+        hours.update(range(int(start), int(end or start) + 1))
+    return hours
+
+
+@dataclass
+class WarmEntry:
+    file_hash: str
+    filename: str
+    content_type: str
+    source_key: str
+    # 触发预热的请求 (服务, 参数)，不再重复处理
+    origin: Tuple[str, Dict[str, Any]]
+
+
+class CacheWarmer:
+    """
+    热门文件的缓存预热
+
+    同一首歌常在几小时内被许多用户上传，但只有第一个请求付出 RunPod 的延迟，而且每种服务都要各冷一次。
+    observe() 统计每个文件哈希在 window 秒内缓存未命中的请求次数 (进程内，按 LRU 保留 track_entries 个哈希)，
+    达到 min_hits 时把原始文件存到 sources/{哈希} 并加入队列。后台任务在空闲时按 targets 逐个调用处理流程，
+    之后对这些组合的请求直接命中缓存 (check_existing_record)。
+
+    只在以下条件都满足时提交预热任务:
+    - 本进程正在处理的请求数不超过 max_inflight (AdmissionController 的计数)，且当前 UTC 小时在 hours 内
+    - 最近一小时内本进程提交的预热任务少于 budget_per_hour
+
+    预热请求的记录租户为 WARM_TENANT。多个 worker 各自统计，同一文件可能被多个 worker 预热，
+    处理前会先查缓存，预算限制了重复的上限。
+    """
+
+    def __init__(
+        self,
+        s3: S3Service,
+        admission: AdmissionController,
+        targets: List[Tuple[str, Dict[str, Any]]],
+        min_hits: int = 3,
+        window: float = 3600,
+        track_entries: int = 10000,
+        queue_size: int = 100,
+        budget_per_hour: int = 20,
+        max_inflight: int = 0,
+        hours: Optional[Set[int]] = None,
+        interval: float = 30
+    ):
+        self.s3 = s3
+        self.admission = admission
+        self.targets = targets
+        self.min_hits = min_hits
+        self.window = window
+        self.budget_per_hour = budget_per_hour
+        self.max_inflight = max_inflight
+        self.hours = hours
+        self.interval = interval
+        self.pipeline = None
+        # 哈希 → (首次出现时间, 次数)；已加入队列的哈希次数记为 -1
+        self._seen = LRUCache(track_entries)
+        self._queue: Deque[WarmEntry] = deque(maxlen=queue_size)
+        self._submitted: Deque[float] = deque()
+        self._task: Optional[asyncio.Task] = None
+        self._job: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {"queued": 0, "warmed": 0, "skipped": 0, "failed": 0}
+
+    async def observe(
+        self,
+        service_type: str,
+        params: Dict[str, Any],
+        file_hash: str,
+        filename: str,
+        content_type: str,
+        file_content: bytes
+    ):
+        """
+        记录一次缓存未命中的请求；文件变热时保存原始文件并加入预热队列。
+        每个哈希只保存一次，在请求中直接上传，不在后台任务中持有整个文件。
+        """
+        now = time.monotonic()
+        first_seen, hits = self._seen.get(file_hash, (now, 0))
+        if hits < 0:
+            return
+        if now - first_seen > self.window:
+            first_seen, hits = now, 0
+        hits += 1
+        if hits < self.min_hits:
+            self._seen.set(file_hash, (first_seen, hits))
+            return
+        self._seen.set(file_hash, (first_seen, -1))
+
+        extension = filename.rsplit(".", 1)[-1].lower() if "." in filename else "mp3"
+        key = f"sources/{file_hash}.{extension}"
+        try:
+            if not await self.s3.check_file_exists(key):
+                await self.s3.upload_file(
+                    file_content=file_content,
+                    folder="sources",
+                    extension=extension,
+                    content_type=content_type,
+                    file_hash=file_hash,
+                    s3_key=key
+                )
+        except Exception as e:
+            logger.warning("保存预热源文件失败: %s", e)
+            self._seen.pop(file_hash)
+            return
+        self._queue.append(WarmEntry(file_hash, filename, content_type, key, (service_type, params)))
+        self.stats["queued"] += 1
+        logger.info("热门文件加入预热队列: %s (队列长度 %s)", file_hash, len(self._queue))
+
+    def start(self, pipeline):
+        self.pipeline = pipeline
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        logger.info("缓存预热已启动，目标: %s, 每小时预算: %s", self.targets, self.budget_per_hour)
+
+    async def stop(self):
+        """停止预热；正在进行的预热任务在关闭流程中会转交后台，等它返回"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._job is not None:
+            await asyncio.gather(self._job, return_exceptions=True)
+
+    def has_capacity(self) -> bool:
+        """空闲且还有预算时才提交预热任务"""
+        if is_draining():
+            return False
+        if self.hours is not None and datetime.utcnow().hour not in self.hours:
+            return False
+        if sum(self.admission.inflight.values()) > self.max_inflight:
+            return False
+        cutoff = time.monotonic() - 3600
+        while self._submitted and self._submitted[0] < cutoff:
+            self._submitted.popleft()
+        return len(self._submitted) < self.budget_per_hour
+
+    async def _run(self):
+        while not is_draining():
+            await asyncio.sleep(self.interval)
+            if self._queue and self.has_capacity():
+                # 停止时不取消正在进行的预热 (stop() 等它结束)
+                self._job = asyncio.get_running_loop().create_task(self._drain_queue())
+                await asyncio.shield(self._job)
+
+    async def _drain_queue(self):
+        while self._queue and self.has_capacity():
+            entry = self._queue.popleft()
+            try:
+                await self.warm(entry)
+            except Exception as e:
+                logger.warning("预热失败 (%s): %s", entry.file_hash, e)
+
+    async def warm(self, entry: WarmEntry):
+        """逐个处理 entry 还没有缓存的目标，空闲或预算不足时把剩余目标留到下次"""
+        content = None
+        for service_type, params in self.targets:
+            if (service_type, params) == entry.origin:
+                continue
+            service = SERVICE_FACTORIES[service_type]()
+            async with read_session_scope() as db:
+                if await service.check_existing_record(db, entry.file_hash, **params) is not None:
+                    self.stats["skipped"] += 1
+                    continue
+            if not self.has_capacity():
+                self._queue.appendleft(entry)
+                return
+            if content is None:
+                content = await self.s3.read_object(entry.source_key)
+                if content is None:
+                    logger.warning("预热源文件不存在: %s", entry.source_key)
+                    return
+            self._submitted.append(time.monotonic())
+            logger.info("预热: %s %s, 文件哈希: %s", service_type, params, entry.file_hash)
+            try:
+                await self.pipeline.run(
+                    service,
+                    file_content=content,
+                    filename=entry.filename,
+                    content_type=entry.content_type,
+                    tenant=WARM_TENANT,
+                    **params
+                )
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.warning("预热任务失败 (%s %s): %s", service_type, entry.file_hash, e)
+                continue
+            self.stats["warmed"] += 1
+
+
+@lru_cache
+def get_cache_warmer() -> CacheWarmer:
+    """缓存预热 (由应用生命周期启动 / 停止)"""
+    settings = get_settings()
+    return CacheWarmer(
+        get_s3_service(),
+        get_admission_controller(),
+        targets=parse_targets(settings.cache_warm_targets),
+        min_hits=settings.cache_warm_min_hits,
+        window=settings.cache_warm_window_s,
+        track_entries=settings.cache_warm_track_entries,
+        queue_size=settings.cache_warm_queue_size,
+        budget_per_hour=settings.cache_warm_budget_per_hour,
+        max_inflight=settings.cache_warm_max_inflight,
+        hours=parse_hours(settings.cache_warm_hours),
+        interval=settings.cache_warm_interval_s
+    )
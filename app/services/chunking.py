@@ -0,0 +1,265 @@
+import asyncio
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import zipfile
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from app.config import get_settings
+from app.services.audio_normalizer import run_process, write_temp_file
+from app.services.midi import read_tracks, write_midi
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Segment:
+    """长音频中的一段，前后各与相邻分段重叠 overlap 秒 (首尾除外)"""
+    index: int
+    start: float
+    duration: float
+    content: bytes
+
+
+@dataclass
+class SegmentOutput:
+    """一个分段的处理结果 (用于合并)"""
+    start: float
+    content: bytes
+
+
+def segment_bounds(total_duration: float, segment_duration: float, overlap: float) -> List[Tuple[float, float]]:
+    """
+    计算分段的 (起点, 时长)。第 i 段覆盖 [i × segment_duration, (i + 1) × segment_duration + overlap)，
+    与下一段重叠 overlap 秒；最后一段不足 overlap 的尾巴并入前一段。
+    """
+    bounds = []
+    start = 0.0
+    while start < total_duration:
+        end = min(start + segment_duration + overlap, total_duration)
+        if total_duration - (start + segment_duration) <= overlap:
+            end = total_duration
+        bounds.append((start, end - start))
+        if end >= total_duration:
+            break
+        start += segment_duration
+    return bounds
+
+
+def keep_window(index: int, starts: List[float], overlap: float) -> Tuple[float, float]:
+    """第 index 段负责的绝对时间区间: 以重叠区的中点为界，首段从 0 开始，末段到无穷"""
+    low = starts[index] + overlap / 2 if index > 0 else 0.0
+    high = starts[index + 1] + overlap / 2 if index + 1 < len(starts) else float("inf")
+    return low, high
+
+
+class AudioChunker:
+    """
+    长音频分段与结果合并
+
+    - split(): 用 ffmpeg 切出相互重叠的分段并编码为 FLAC (bitexact，相同音频得到相同字节，分段哈希可用于缓存)
+    - merge_midi(): 按分段起点平移时间，重叠区以中点为界去重，合并为一个 MIDI
+    - merge_stems(): 各音轨按重叠时长交叉淡化拼接，重新打包为 ZIP
+
+    只有不小于 probe_min_bytes 的文件才检测时长，时长超过 min_duration 的才分段。
+    """
+
+    def __init__(
+        self,
+        ffmpeg_path: str = "ffmpeg",
+        ffprobe_path: str = "ffprobe",
+        segment_duration: float = 300,
+        overlap: float = 4.0,
+        min_duration: float = 600,
+        probe_min_bytes: int = 0,
+        segment_concurrency: int = 4,
+        max_concurrency: int = 0,
+        timeout: float = 300
+    ):
+        self.ffmpeg_path = shutil.which(ffmpeg_path)
+        self.ffprobe_path = shutil.which(ffprobe_path)
+        self.segment_duration = segment_duration
+        self.overlap = overlap
+        self.min_duration = min_duration
+        self.probe_min_bytes = probe_min_bytes
+        # 单个请求同时在 RunPod 上处理的分段数
+        self.segment_concurrency = segment_concurrency
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency or os.cpu_count() or 1)
+        if not self.available:
+            logger.warning("⚠️ 未找到 ffmpeg / ffprobe，长音频分段处理不可用")
+
+    @property
+    def available(self) -> bool:
+        return self.ffmpeg_path is not None and self.ffprobe_path is not None
+
+    async def duration_to_chunk(self, file_content: bytes) -> Optional[float]:
+        """需要分段时返回音频时长，否则返回 None"""
+        if not self.available or len(file_content) < self.probe_min_bytes:
+            return None
+        duration = await self.probe_duration(file_content)
+        if duration is None or duration <= self.min_duration:
+            return None
+        return duration
+
+    async def probe_duration(self, file_content: bytes) -> Optional[float]:
+        """音频时长 (秒)，无法识别时返回 None"""
+        if not self.available:
+            return None
+        source = await asyncio.to_thread(write_temp_file, file_content)
+        try:
+            returncode, output, _ = await run_process([
+                self.ffprobe_path, "-v", "error", "-show_entries", "format=duration",
+                "-of", "json", source
+            ], timeout=60)
+        finally:
+            await asyncio.to_thread(os.unlink, source)
+        if returncode != 0:
+            return None
+        try:
+            return float(json.loads(output)["format"]["duration"])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    async def split(
+        self,
+        file_content: bytes,
+        total_duration: float,
+        sample_rate: Optional[int] = None,
+        channels: Optional[int] = None
+    ) -> List[Segment]:
+        """切分为相互重叠的 FLAC 分段；提供 sample_rate / channels 时顺带转换为模型的原生格式"""
+        bounds = segment_bounds(total_duration, self.segment_duration, self.overlap)
+        source = await asyncio.to_thread(write_temp_file, file_content)
+        format_args = []
+        if sample_rate:
+            format_args += ["-ar", str(sample_rate)]
+        if channels:
+            format_args += ["-ac", str(channels)]
+
+        async def cut(index: int, start: float, duration: float) -> Segment:
+            async with self._semaphore:
+                returncode, output, error = await run_process([
+                    self.ffmpeg_path, "-hide_banner", "-loglevel", "error", "-nostdin",
+                    "-ss", f"{start:.3f}", "-t", f"{duration:.3f}", "-i", source,
+                    "-vn", "-map_metadata", "-1", "-fflags", "+bitexact", "-flags:a", "+bitexact",
+                    *format_args, "-c:a", "flac", "-f", "flac", "pipe:1"
+                ], timeout=self.timeout)
+            if returncode != 0 or not output:
+                raise RuntimeError(f"音频分段失败 (第 {index} 段): {error.decode(errors='replace').strip()[-300:]}")
+            return Segment(index=index, start=start, duration=duration, content=output)
+
+        try:
+            return list(await asyncio.gather(*(
+                cut(index, start, duration) for index, (start, duration) in enumerate(bounds)
+            )))
+        finally:
+            await asyncio.to_thread(os.unlink, source)
+
+    async def merge_stems(
+        self,
+        parts: List[SegmentOutput],
+        bitrate: Optional[str] = None
+    ) -> Tuple[bytes, List[Dict[str, float]]]:
+        """
+        合并各分段的音轨 ZIP: 同名音轨按重叠时长交叉淡化拼接。
+        返回新的 ZIP 与文件列表 (与 Spleeter output["files"] 格式相同)。
+        """
+        archives = [zipfile.ZipFile(io.BytesIO(part.content)) for part in parts]
+        names = [name for name in archives[0].namelist() if not name.endswith("/")]
+        workdir = await asyncio.to_thread(tempfile.mkdtemp, prefix="stems-")
+        try:
+            async def merge_one(name: str) -> Tuple[str, bytes]:
+                extension = name.rsplit(".", 1)[-1]
+                inputs = []
+                for index, archive in enumerate(archives):
+                    path = os.path.join(workdir, f"{index:04d}-{os.path.basename(name)}")
+                    await asyncio.to_thread(self._write_file, path, archive.read(name))
+                    inputs.append(path)
+                return name, await self._crossfade(inputs, extension, bitrate)
+
+            merged = await asyncio.gather(*(merge_one(name) for name in names))
+        finally:
+            await asyncio.to_thread(shutil.rmtree, workdir, True)
+
+        buffer = io.BytesIO()
+        # 压缩音频无需再压缩
+        with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as output:
+            for name, content in merged:
+                output.writestr(name, content)
+        files = [{"name": name, "size_kb": round(len(content) / 1024, 2)} for name, content in merged]
+        return buffer.getvalue(), files
+
+    async def _crossfade(self, inputs: List[str], extension: str, bitrate: Optional[str]) -> bytes:
+        if len(inputs) == 1:
+            return await asyncio.to_thread(self._read_file, inputs[0])
+        # [0][1]acrossfade[a1];[a1][2]acrossfade[a2];...
+        filters = []
+        previous = "[0:a]"
+        for index in range(1, len(inputs)):
+            label = f"[a{index}]"
+            filters.append(f"{previous}[{index}:a]acrossfade=d={self.overlap}:c1=tri:c2=tri{label}")
+            previous = label
+        args = [self.ffmpeg_path, "-hide_banner", "-loglevel", "error", "-nostdin"]
+        for path in inputs:
+            args += ["-i", path]
+        args += ["-filter_complex", ";".join(filters), "-map", previous]
+        if bitrate and extension != "wav":
+            args += ["-b:a", bitrate]
+        args += ["-f", extension, "pipe:1"]
+        async with self._semaphore:
+            returncode, output, error = await run_process(args, timeout=self.timeout)
+        if returncode != 0 or not output:
+            raise RuntimeError(f"音轨拼接失败: {error.decode(errors='replace').strip()[-300:]}")
+        return output
+
+    @staticmethod
+    def _write_file(path: str, content: bytes):
+        with open(path, "wb") as f:
+            f.write(content)
+
+    @staticmethod
+    def _read_file(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+
+def merge_midi(parts: List[SegmentOutput], overlap: float) -> bytes:
+    """
+    合并各分段的 MIDI 结果 (CPU 密集，应在线程中调用)。
+    每段的音符平移到分段起点，重叠区以中点为界: 起音落在本段负责区间内的音符才保留，避免重复或截断。
+    合并结果为 120 BPM。
+    """
+    starts = [part.start for part in parts]
+    merged: Dict[str, dict] = {}
+    for index, part in enumerate(parts):
+        low, high = keep_window(index, starts, overlap)
+        tracks, _ = read_tracks(part.content)
+        for key, track in tracks.items():
+            target = merged.setdefault(key, {"name": track["name"], "programs": {}, "notes": []})
+            for channel, program in track["programs"].items():
+                target["programs"].setdefault(channel, program)
+            for start, end, channel, note, velocity in track["notes"]:
+                onset = part.start + start
+                if low <= onset < high:
+                    target["notes"].append((onset, part.start + end, channel, note, velocity))
+    return write_midi(merged.values())
+
+
+@lru_cache
+def get_audio_chunker() -> AudioChunker:
+    settings = get_settings()
+    return AudioChunker(
+        ffmpeg_path=settings.ffmpeg_path,
+        ffprobe_path=settings.ffprobe_path,
+        segment_duration=settings.chunk_duration_s,
+        overlap=settings.chunk_overlap_s,
+        min_duration=settings.chunk_min_duration_s,
+        probe_min_bytes=settings.chunk_probe_min_bytes,
+        segment_concurrency=settings.chunk_concurrency,
+        max_concurrency=settings.audio_normalize_concurrency
+    )
@@ -0,0 +1,96 @@
+import logging
+import mimetypes
+import time
+from functools import lru_cache
+from typing import Optional
+from app.config import get_settings
+from app.lru import LRUCache
+from app.services.s3_service import S3Service, get_s3_service
+
+logger = logging.getLogger(__name__)
+
+# 内容寻址 / 确定性 key 的对象内容不会变化，CDN 与浏览器可以缓存一年且无需回源校验
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+CONTENT_TYPES = {"mid": "audio/midi", "midi": "audio/midi", "zip": "application/zip"}
+
+
+class OutputDelivery:
+    """
+    结果文件的下发
+
+    - store(): 结果完成时把 RunPod 输出复制到本存储桶的内容寻址 key (outputs/{MD5}.{扩展名})，
+      并写入 immutable 的 Cache-Control。内容相同的结果共用一个对象，已存在时不再上传。
+    - public_url() / url_for_key(): 返回给客户端的链接。配置了 CDN 时指向 CDN (由边缘节点缓存热门结果)；
+      否则按 presign_ttl 生成临时签名链接。签名链接在进程内 LRU 中复用，剩余有效期不足一半时才重新签名，
+      同一对象在这段时间内返回同一个 URL，CDN / 浏览器的缓存才能命中。
+    """
+
+    def __init__(
+        self,
+        s3: S3Service,
+        copy_outputs: bool = False,
+        cdn_base_url: Optional[str] = None,
+        presign_ttl: int = 0,
+        cache_entries: int = 4096
+    ):
+        self.s3 = s3
+        self.copy_outputs = copy_outputs
+        self.cdn_base_url = cdn_base_url.rstrip("/") if cdn_base_url else None
+        self.presign_ttl = presign_ttl
+        self._presigned = LRUCache(cache_entries)
+
+    async def store(self, url: str) -> str:
+        """复制到内容寻址的 key 并返回其 URL；已在 outputs/ 下的对象原样返回"""
+        key = self.s3.key_from_url(url)
+        if key is not None and key.startswith("outputs/"):
+            return url
+        content, = await self.s3.download_urls([url])
+        extension = url.split("?", 1)[0].rsplit("/", 1)[-1].rpartition(".")[2].lower() or "bin"
+        key = f"outputs/{self.s3.calculate_file_hash(content)}.{extension}"
+        if not await self.s3.check_file_exists(key):
+            await self.s3.upload_file(
+                file_content=content,
+                folder="outputs",
+                extension=extension,
+                content_type=CONTENT_TYPES.get(extension)
+                or mimetypes.guess_type(key)[0]
+                or "application/octet-stream",
+                s3_key=key,
+                cache_control=IMMUTABLE_CACHE_CONTROL,
+                write_through=True
+            )
+        return self.s3.get_file_url(key)
+
+    async def public_url(self, url: Optional[str]) -> Optional[str]:
+        """结果 URL 的下发形式；不是本存储桶的 URL (如未复制的 RunPod 输出) 原样返回"""
+        if not url or (self.cdn_base_url is None and not self.presign_ttl):
+            return url
+        key = self.s3.key_from_url(url)
+        if key is None:
+            return url
+        return await self.url_for_key(key, self.presign_ttl)
+
+    async def url_for_key(self, key: str, expires_in: int) -> str:
+        """CDN 链接，或有效期至少为 expires_in / 2 的签名链接"""
+        if self.cdn_base_url is not None:
+            return f"{self.cdn_base_url}/{key}"
+        now = time.time()
+        cached = self._presigned.get((key, expires_in))
+        if cached is not None and cached[1] - now > expires_in / 2:
+            return cached[0]
+        url = await self.s3.presign_url(key, expires_in)
+        self._presigned.set((key, expires_in), (url, now + expires_in))
+        return url
+
+
+@lru_cache
+def get_output_delivery() -> OutputDelivery:
+    settings = get_settings()
+    return OutputDelivery(
+        get_s3_service(),
+        copy_outputs=settings.output_copy_enabled,
+        cdn_base_url=settings.output_cdn_base_url,
+        presign_ttl=settings.output_presign_ttl_s,
+        cache_entries=settings.output_presign_cache_entries
+    )
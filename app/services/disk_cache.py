@@ -0,0 +1,212 @@
+import hashlib
+import logging
+import mmap
+import os
+import threading
+import time
+import uuid
+from functools import lru_cache
+from typing import List, Optional, Tuple
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# 超过该时间仍未提交的临时文件视为写入中断，淘汰时一并删除
+STALE_TMP_SECONDS = 3600
+
+
+class CachedFile:
+    """缓存文件的只读内存映射，按区间取数据时不经过额外的缓冲区"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self.size = os.fstat(self._file.fileno()).st_size
+        # 空文件无法映射
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+
+    def read(self, offset: int = 0, size: Optional[int] = None) -> bytes:
+        if self._map is None:
+            return b""
+        end = self.size if size is None else min(offset + size, self.size)
+        return self._map[offset:end]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+
+class PendingFile:
+    """
+    边下载边写入的缓存文件: 先写临时文件，commit() 时原子替换为正式文件。
+    写入出错 (如磁盘已满) 或超过大小上限时放弃缓存，不影响调用方继续读取数据。
+    """
+
+    def __init__(self, cache: "DiskCache", path: str):
+        self._cache = cache
+        self._path = path
+        self._tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        self.size = 0
+        try:
+            self._file = open(self._tmp, "wb")
+        except OSError as e:
+            logger.warning("写入磁盘缓存失败: %s", e)
+            self._file = None
+
+    def write(self, chunk: bytes):
+        if self._file is None:
+            return
+        self.size += len(chunk)
+        if self.size > self._cache.max_object_bytes:
+            logger.debug("文件超过单个文件的缓存上限，不缓存: %s", self._path)
+            self.abort()
+            return
+        try:
+            self._file.write(chunk)
+        except OSError as e:
+            logger.warning("写入磁盘缓存失败: %s", e)
+            self.abort()
+
+    def commit(self) -> Optional[str]:
+        if self._file is None:
+            return None
+        try:
+            self._file.close()
+            self._file = None
+            os.replace(self._tmp, self._path)
+        except OSError as e:
+            logger.warning("写入磁盘缓存失败: %s", e)
+            self.abort()
+            return None
+        self._cache._added(self.size)
+        return self._path
+
+    def abort(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        try:
+            os.unlink(self._tmp)
+        except FileNotFoundError:
+            pass
+
+
+class DiskCache:
+    """
+    节点本地的磁盘 LRU 缓存 (S3 对象与结果文件)
+
+    - 文件名为缓存 key (S3 key) 的 SHA-256，outputs/、stems/ 等 key 本身由内容决定，内容不会变化，无需失效
+    - 写入先写临时文件再 os.replace，读者不会看到写了一半的文件
+    - 读取使用内存映射；下载接口直接把文件路径交给 FileResponse
+    - 命中时更新 mtime，总大小超过 max_bytes 时按 mtime 从旧到新删除到 90%。
+      同一节点的多个 worker 进程共用目录，淘汰时重新扫描目录而不依赖进程内的索引
+
+    方法均为阻塞 IO，应在线程中调用。写入失败只记录日志 (缓存不影响主流程)。
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # 超过上限一半的文件不缓存，避免一个文件挤掉所有热点
+        self.max_object_bytes = max_bytes // 2
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # 本进程估算的总大小，超出上限时扫描目录得到实际值
+        self._total: Optional[int] = None
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest())
+
+    def path(self, key: str) -> Optional[str]:
+        """已缓存时返回文件路径 (并记为最近使用)，否则返回 None"""
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def open(self, key: str) -> Optional[CachedFile]:
+        path = self.path(key)
+        if path is None:
+            return None
+        try:
+            return CachedFile(path)
+        except FileNotFoundError:
+            # 刚被其他进程淘汰
+            return None
+
+    def read(self, key: str) -> Optional[bytes]:
+        cached = self.open(key)
+        if cached is None:
+            return None
+        try:
+            return cached.read()
+        finally:
+            cached.close()
+
+    def put(self, key: str, content: bytes) -> Optional[str]:
+        """写入缓存，返回文件路径 (未缓存时为 None)"""
+        if len(content) > self.max_object_bytes:
+            return None
+        pending = self.writer(key)
+        pending.write(content)
+        return pending.commit()
+
+    def writer(self, key: str) -> PendingFile:
+        return PendingFile(self, self._path(key))
+
+    def _added(self, size: int):
+        with self._lock:
+            if self._total is not None:
+                self._total += size
+            if self._total is None or self._total > self.max_bytes:
+                self._total = self._evict()
+
+    def _evict(self) -> int:
+        """扫描目录，按 mtime 删除最旧的文件直到不超过上限的 90%，返回剩余总大小"""
+        now = time.time()
+        entries: List[Tuple[float, int, str]] = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.endswith(".tmp"):
+                    if now - stat.st_mtime > STALE_TMP_SECONDS:
+                        self._unlink(entry.path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return total
+        target = self.max_bytes * 0.9
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            # 正在读取的文件删除后，已打开的句柄仍可读完
+            self._unlink(path)
+            total -= size
+            removed += 1
+        logger.info("磁盘缓存淘汰 %s 个文件，剩余 %.1f MB", removed, total / 1024 / 1024)
+        return total
+
+    @staticmethod
+    def _unlink(path: str):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+@lru_cache
+def get_disk_cache() -> Optional[DiskCache]:
+    """未开启磁盘缓存时返回 None"""
+    settings = get_settings()
+    if not settings.disk_cache_enabled:
+        return None
+    return DiskCache(settings.disk_cache_dir, settings.disk_cache_max_bytes)
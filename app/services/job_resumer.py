@@ -0,0 +1,154 @@
+import asyncio
+import logging
+from functools import lru_cache
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Set
+from sqlalchemy import and_, or_, select, update
+from app.config import get_settings
+from app.database import session_scope
+from app.lifecycle import is_draining
+from app.models import ProcessingRecord
+from app.services.pipeline import JobFailedError, get_processing_pipeline
+from app.services.piano_service import get_piano_service
+from app.services.runpod_service import RunPodService
+from app.services.spleeter_service import get_spleeter_service
+from app.services.yourmt3_service import get_yourmt3_service
+
+logger = logging.getLogger(__name__)
+
+# service_type → 服务实例
+SERVICE_FACTORIES: Dict[str, Callable[[], RunPodService]] = {
+    "piano": get_piano_service,
+    "spleeter": get_spleeter_service,
+    "yourmt3": get_yourmt3_service,
+}
+
+
+class JobResumer:
+    """
+    继续处理被转交后台的任务
+
+    进程优雅关闭时，仍在等待 RunPod 的请求把记录标记为 handed_off (见 ProcessingPipeline)。
+    每个 worker 定期用 FOR UPDATE SKIP LOCKED 认领一批这样的记录 (改回 processing，claimed_at 记为认领时间)，
+    再通过 ProcessingPipeline.resume() 从 await 阶段继续轮询并保存结果，同一条记录只会被一个 worker 认领。
+    本进程也在关闭时，正在继续的任务会再次被转交。
+
+    claimed_at 是租约: 认领的 worker 每个周期续租，认领后被强制结束 (来不及再次转交) 时租约在 lease 秒后过期，
+    这样的 processing 记录会被其他 worker 重新认领，不会一直停留在 processing。
+    """
+
+    def __init__(self, interval: float = 15, batch_size: int = 20, lease: float = 120):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lease = lease
+        self._task: Optional[asyncio.Task] = None
+        self._jobs: Set[asyncio.Task] = set()
+        # 本进程持有租约的记录
+        self._claimed: Set[int] = set()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        logger.info("后台任务续跑已启动，检查间隔: %ss", self.interval)
+
+    async def stop(self):
+        """停止认领新记录，并等待正在继续的任务结束 (关闭流程中它们会被再次转交)"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._jobs:
+            await asyncio.gather(*self._jobs, return_exceptions=True)
+
+    async def _run(self):
+        while not is_draining():
+            try:
+                await self.renew()
+            except Exception as e:
+                logger.warning("续租转交任务失败: %s", e)
+            try:
+                for record in await self.claim():
+                    job = asyncio.get_running_loop().create_task(self._resume(record))
+                    self._jobs.add(job)
+                    job.add_done_callback(self._jobs.discard)
+            except Exception as e:
+                logger.warning("认领转交任务失败: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def claim(self) -> List[ProcessingRecord]:
+        """认领一批 handed_off 记录，以及租约已过期的 processing 记录"""
+        now = datetime.utcnow()
+        batch = (
+            select(ProcessingRecord.id)
+            .where(or_(
+                ProcessingRecord.status == "handed_off",
+                and_(
+                    ProcessingRecord.status == "processing",
+                    ProcessingRecord.claimed_at < now - timedelta(seconds=self.lease)
+                )
+            ))
+            .order_by(ProcessingRecord.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        async with session_scope() as db:
+            records = (await db.scalars(
+                update(ProcessingRecord)
+                .where(ProcessingRecord.id.in_(batch))
+                .values(status="processing", claimed_at=now)
+                .returning(ProcessingRecord)
+            )).all()
+            await db.commit()
+        self._claimed.update(record.id for record in records)
+        if records:
+            logger.info("认领 %s 条转交任务: %s", len(records), [record.id for record in records])
+        return list(records)
+
+    async def renew(self):
+        """为本进程仍在继续的记录续租"""
+        if not self._claimed:
+            return
+        async with session_scope() as db:
+            await db.execute(
+                update(ProcessingRecord)
+                .where(ProcessingRecord.id.in_(self._claimed), ProcessingRecord.status == "processing")
+                .values(claimed_at=datetime.utcnow())
+            )
+            await db.commit()
+
+    async def _resume(self, record: ProcessingRecord):
+        try:
+            factory = SERVICE_FACTORIES.get(record.service_type)
+            if factory is None:
+                logger.error("未知的服务类型，无法继续处理记录 %s: %s", record.id, record.service_type)
+                return
+            try:
+                result = await get_processing_pipeline().resume(factory(), record)
+            except JobFailedError:
+                return
+            except Exception as e:
+                logger.error("继续处理记录 %s 失败: %s", record.id, e, exc_info=True)
+                return
+            if not result.handed_off:
+                logger.info("✅ 转交任务处理完成，记录ID: %s", record.id)
+        finally:
+            self._claimed.discard(record.id)
+
+
+@lru_cache
+def get_job_resumer() -> JobResumer:
+    """转交任务续跑 (由应用生命周期启动 / 停止)"""
+    settings = get_settings()
+    return JobResumer(
+        interval=settings.job_resume_interval_s,
+        batch_size=settings.job_resume_batch,
+        lease=settings.job_resume_lease_s
+    )
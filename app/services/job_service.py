@@ -0,0 +1,67 @@
+import base64
+import hashlib
+import hmac
+from functools import lru_cache
+from typing import Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import get_settings
+from app.database import session_scope, read_session_scope, get_read_engine
+from app.models import ProcessingRecord
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _token_signature(record_id: int) -> str:
+    settings = get_settings()
+    secret = settings.result_token_secret or f"result-token:{settings.runpod_api_key}"
+    digest = hmac.new(secret.encode(), str(record_id).encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).decode().rstrip("=")
+
+
+def result_token(record_id: int) -> str:
+    """
+    结果地址 (/api/jobs、/api/midi、/api/spleeter/results) 中的访问令牌: 记录ID 加 HMAC 签名。
+    只有拿到处理接口响应 (或上传过同一文件) 的客户端知道令牌，不能由递增的记录ID 猜出其他人的结果
+    """
+    return f"{record_id}.{_token_signature(record_id)}"
+
+
+def parse_result_token(token: str) -> Optional[int]:
+    """令牌对应的记录ID，格式或签名不对时为 None"""
+    record_id, _, signature = token.partition(".")
+    if not record_id.isdigit() or not hmac.compare_digest(signature, _token_signature(int(record_id))):
+        return None
+    return int(record_id)
+
+
+class JobService:
+    """处理记录 (任务状态) 查询"""
+
+    async def _get(self, db: AsyncSession, record_id: int) -> Optional[ProcessingRecord]:
+        return await db.get(ProcessingRecord, record_id)
+
+    async def get_record(self, record_id: int, fresh: bool = False) -> Optional[ProcessingRecord]:
+        """
+        查询任务状态。默认读只读副本；fresh=True 或副本上查不到 (刚创建、尚未同步) 时读主库。
+        """
+        if not fresh:
+            async with read_session_scope() as db:
+                record = await self._get(db, record_id)
+            if record is not None or get_read_engine() is None:
+                return record
+            logger.debug("只读副本未找到记录 %s，回退到主库", record_id)
+        async with session_scope() as db:
+            return await self._get(db, record_id)
+
+    async def get_record_by_token(self, token: str, fresh: bool = False) -> Optional[ProcessingRecord]:
+        """按结果地址中的访问令牌查询，令牌无效时与记录不存在一样返回 None"""
+        record_id = parse_result_token(token)
+        if record_id is None:
+            return None
+        return await self.get_record(record_id, fresh=fresh)
+
+
+@lru_cache
+def get_job_service() -> JobService:
+    return JobService()
@@ -0,0 +1,204 @@
+import io
+import json
+import struct
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# 生成 MIDI 的时间基准: 每拍 480 tick，未指定速度时为 120 BPM
+TICKS_PER_BEAT = 480
+DEFAULT_TEMPO = 500000
+# GM 第 10 通道 (channel 9) 为打击乐，用 128 与音色 0-127 区分
+DRUM_PROGRAM = 128
+DRUM_CHANNEL = 9
+
+# 音符数组的二进制格式: 头部 (魔数, 版本, 速度, 音符数)，之后每个音符 14 字节，末尾为音轨名 JSON
+_HEADER = struct.Struct("<4sBII")
+_NOTE = struct.Struct("<IIBBBBH")
+_MAGIC = b"NOTE"
+_VERSION = 1
+
+NOTE_FIELDS = ("start_ms", "end_ms", "pitch", "velocity", "program", "channel", "track")
+
+
+def _tick_converter(midi) -> Tuple[Callable[[int], float], int]:
+    """根据 MIDI 中的速度变化把 tick 换算为秒，同时返回起始速度"""
+    import mido
+
+    changes = []
+    for track in midi.tracks:
+        ticks = 0
+        for message in track:
+            ticks += message.time
+            if message.type == "set_tempo":
+                changes.append((ticks, message.tempo))
+    changes.sort()
+    if not changes or changes[0][0] != 0:
+        changes.insert(0, (0, DEFAULT_TEMPO))
+
+    # 每个速度区间的起点 (tick, 秒, tempo)
+    points = []
+    seconds = 0.0
+    for index, (tick, tempo) in enumerate(changes):
+        if index > 0:
+            previous_tick, previous_tempo = changes[index - 1]
+            seconds += mido.tick2second(tick - previous_tick, midi.ticks_per_beat, previous_tempo)
+        points.append((tick, seconds, tempo))
+
+    def to_seconds(tick: int) -> float:
+        for start_tick, start_seconds, tempo in reversed(points):
+            if tick >= start_tick:
+                return start_seconds + mido.tick2second(tick - start_tick, midi.ticks_per_beat, tempo)
+        return 0.0
+
+    return to_seconds, changes[0][1]
+
+
+def read_tracks(content: bytes) -> Tuple[Dict[str, dict], int]:
+    """
+    解析一个 MIDI: 返回 ({音轨标识: {"name", "programs", "notes"}}, 起始速度)，
+    notes 为 (起始秒, 结束秒, 通道, 音高, 力度)。音轨按名称识别 (无名称时按序号)，以便跨文件对应。
+    CPU 密集，应在线程中调用。
+    """
+    import mido
+
+    midi = mido.MidiFile(file=io.BytesIO(content))
+    to_seconds, tempo = _tick_converter(midi)
+    tracks = {}
+    for index, track in enumerate(midi.tracks):
+        name = next((message.name for message in track if message.type == "track_name"), None)
+        key = name or f"track-{index}"
+        entry = tracks.setdefault(key, {"name": name, "programs": {}, "notes": []})
+        active = defaultdict(list)
+        ticks = 0
+        for message in track:
+            ticks += message.time
+            if message.type == "program_change":
+                entry["programs"].setdefault(message.channel, message.program)
+            elif message.type == "note_on" and message.velocity > 0:
+                active[(message.channel, message.note)].append((to_seconds(ticks), message.velocity))
+            elif message.type in ("note_off", "note_on"):
+                pending = active.get((message.channel, message.note))
+                if pending:
+                    start, velocity = pending.pop(0)
+                    entry["notes"].append((start, to_seconds(ticks), message.channel, message.note, velocity))
+        if not entry["notes"] and not entry["programs"] and name is None:
+            del tracks[key]
+    return tracks, tempo
+
+
+def write_midi(tracks: Iterable[dict], tempo: int = DEFAULT_TEMPO) -> bytes:
+    """把 read_tracks() 格式的音轨写成 type 1 MIDI (时间以秒计，按 tempo 换算为 tick)"""
+    import mido
+
+    ticks_per_second = TICKS_PER_BEAT * 1_000_000 / tempo
+    output = mido.MidiFile(type=1, ticks_per_beat=TICKS_PER_BEAT)
+    conductor = mido.MidiTrack()
+    conductor.append(mido.MetaMessage("set_tempo", tempo=tempo, time=0))
+    output.tracks.append(conductor)
+    for track in tracks:
+        events = []
+        for onset, end, channel, note, velocity in track["notes"]:
+            start_tick = round(onset * ticks_per_second)
+            end_tick = max(round(end * ticks_per_second), start_tick + 1)
+            # 同一时刻先关后开
+            events.append((end_tick, 0, mido.Message("note_off", channel=channel, note=note, velocity=0)))
+            events.append((start_tick, 1, mido.Message("note_on", channel=channel, note=note, velocity=velocity)))
+        events.sort(key=lambda event: (event[0], event[1]))
+
+        midi_track = mido.MidiTrack()
+        if track["name"]:
+            midi_track.append(mido.MetaMessage("track_name", name=track["name"], time=0))
+        for channel, program in sorted(track["programs"].items()):
+            midi_track.append(mido.Message("program_change", channel=channel, program=program, time=0))
+        last_tick = 0
+        for tick, _, message in events:
+            midi_track.append(message.copy(time=tick - last_tick))
+            last_tick = tick
+        output.tracks.append(midi_track)
+
+    buffer = io.BytesIO()
+    output.save(file=buffer)
+    return buffer.getvalue()
+
+
+@dataclass
+class NoteArray:
+    """
+    紧凑的音符数组: 每个音符为 (起始毫秒, 结束毫秒, 音高, 力度, 音色, 通道, 音轨序号)，
+    音色为打击乐时记为 DRUM_PROGRAM。MIDI 只解析一次，各种派生格式都由它生成。
+    """
+    tempo: int = DEFAULT_TEMPO
+    track_names: List[Optional[str]] = field(default_factory=list)
+    notes: List[Tuple[int, int, int, int, int, int, int]] = field(default_factory=list)
+
+    @classmethod
+    def from_midi(cls, content: bytes) -> "NoteArray":
+        tracks, tempo = read_tracks(content)
+        array = cls(tempo=tempo)
+        for index, track in enumerate(tracks.values()):
+            array.track_names.append(track["name"])
+            for start, end, channel, note, velocity in track["notes"]:
+                program = DRUM_PROGRAM if channel == DRUM_CHANNEL else track["programs"].get(channel, 0)
+                array.notes.append((round(start * 1000), round(end * 1000), note, velocity, program, channel, index))
+        array.notes.sort()
+        return array
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "NoteArray":
+        magic, version, tempo, count = _HEADER.unpack_from(data)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("不是有效的音符数组")
+        end = _HEADER.size + count * _NOTE.size
+        notes = list(_NOTE.iter_unpack(data[_HEADER.size:end]))
+        return cls(tempo=tempo, track_names=json.loads(data[end:]), notes=notes)
+
+    def to_bytes(self) -> bytes:
+        return b"".join([
+            _HEADER.pack(_MAGIC, _VERSION, self.tempo, len(self.notes)),
+            *(_NOTE.pack(*note) for note in self.notes),
+            json.dumps(self.track_names, ensure_ascii=False).encode()
+        ])
+
+    @property
+    def bpm(self) -> float:
+        return round(60_000_000 / self.tempo, 3)
+
+    def programs(self) -> Dict[int, int]:
+        """各音色的音符数"""
+        counts: Dict[int, int] = defaultdict(int)
+        for note in self.notes:
+            counts[note[4]] += 1
+        return dict(sorted(counts.items()))
+
+    def select_program(self, program: int) -> "NoteArray":
+        return NoteArray(self.tempo, self.track_names, [note for note in self.notes if note[4] == program])
+
+    def quantize(self, grid: int) -> "NoteArray":
+        """按 1/grid 音符对齐起止时间 (如 grid=16 为十六分音符)，时值至少一格"""
+        step = self.tempo / 1000 * 4 / grid
+        notes = []
+        for start, end, *rest in self.notes:
+            start_q = round(start / step) * step
+            end_q = max(round(end / step) * step, start_q + step)
+            notes.append((round(start_q), round(end_q), *rest))
+        notes.sort()
+        return NoteArray(self.tempo, self.track_names, notes)
+
+    def to_json(self) -> bytes:
+        """列式字段名 + 二维数组，比逐个对象的 JSON 小得多"""
+        return json.dumps({
+            "bpm": self.bpm,
+            "tracks": self.track_names,
+            "fields": NOTE_FIELDS,
+            "notes": self.notes
+        }, ensure_ascii=False, separators=(",", ":")).encode()
+
+    def to_midi(self) -> bytes:
+        tracks: Dict[int, dict] = {}
+        for start, end, pitch, velocity, program, channel, track in self.notes:
+            entry = tracks.setdefault(track, {"name": self.track_names[track], "programs": {}, "notes": []})
+            if program != DRUM_PROGRAM:
+                entry["programs"].setdefault(channel, program)
+            entry["notes"].append((start / 1000, end / 1000, channel, pitch, velocity))
+        return write_midi([tracks[index] for index in sorted(tracks)], tempo=self.tempo)
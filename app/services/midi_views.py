@@ -0,0 +1,133 @@
+import asyncio
+import logging
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from app.config import get_settings
+from app.lru import LRUCache
+from app.models import ProcessingRecord
+from app.services.delivery import IMMUTABLE_CACHE_CONTROL
+from app.services.midi import NoteArray
+from app.services.s3_service import S3Service, get_s3_service
+
+logger = logging.getLogger(__name__)
+
+# 输出为 MIDI 的服务
+MIDI_SERVICES = ("piano", "yourmt3")
+
+CONTENT_TYPES = {"bin": "application/octet-stream", "json": "application/json", "mid": "audio/midi"}
+
+
+def _suffix(grid: Optional[int]) -> str:
+    return f"-q{grid}" if grid else ""
+
+
+class MidiViews:
+    """
+    MIDI 结果的派生格式: 音符 JSON、按音色拆分的 MIDI、量化后的 MIDI
+
+    源 MIDI 只下载、解析一次，转换为紧凑的音符数组 (NoteArray) 存入 S3 的 midi/{记录ID}/notes.bin；
+    各派生格式第一次生成后同样存入 midi/{记录ID}/ 下。已完成的记录不会再变化，两层都无需失效:
+    进程内 LRU → S3 → 重新生成。同一个派生格式同时被多次请求时只生成一次。
+    """
+
+    def __init__(self, s3: S3Service, max_entries: int = 256):
+        self.s3 = s3
+        self._cache = LRUCache(max_entries)
+        self._inflight: Dict[Tuple[int, str], asyncio.Future] = {}
+
+    async def notes(self, record: ProcessingRecord) -> NoteArray:
+        return await self._cached(
+            record, "notes.bin", lambda: self._parse_source(record), NoteArray.from_bytes, NoteArray.to_bytes
+        )
+
+    async def notes_json(self, record: ProcessingRecord, grid: Optional[int] = None) -> bytes:
+        async def build() -> bytes:
+            notes = await self.notes(record)
+            return await asyncio.to_thread(lambda: self._quantized(notes, grid).to_json())
+
+        return await self._cached(record, f"notes{_suffix(grid)}.json", build)
+
+    async def program_midi(self, record: ProcessingRecord, program: int, grid: Optional[int] = None) -> Optional[bytes]:
+        """单个音色的 MIDI，没有该音色时返回 None"""
+        notes = await self.notes(record)
+        if program not in notes.programs():
+            return None
+
+        async def build() -> bytes:
+            return await asyncio.to_thread(lambda: self._quantized(notes.select_program(program), grid).to_midi())
+
+        return await self._cached(record, f"program-{program}{_suffix(grid)}.mid", build)
+
+    async def quantized_midi(self, record: ProcessingRecord, grid: int) -> bytes:
+        async def build() -> bytes:
+            notes = await self.notes(record)
+            return await asyncio.to_thread(lambda: notes.quantize(grid).to_midi())
+
+        return await self._cached(record, f"quantized{_suffix(grid)}.mid", build)
+
+    @staticmethod
+    def _quantized(notes: NoteArray, grid: Optional[int]) -> NoteArray:
+        return notes.quantize(grid) if grid else notes
+
+    async def _cached(
+        self,
+        record: ProcessingRecord,
+        name: str,
+        build: Callable[[], Awaitable],
+        decode: Callable[[bytes], object] = bytes,
+        encode: Callable[[object], bytes] = bytes
+    ):
+        key = (record.id, name)
+        value = self._cache.get(key)
+        if value is not None:
+            return value
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await self._load(record, name, build, decode, encode)
+            self._cache.set(key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _load(self, record: ProcessingRecord, name: str, build, decode, encode):
+        """S3 中已有时直接读取，否则生成并上传"""
+        s3_key = f"midi/{record.id}/{name}"
+        data = await self.s3.read_object(s3_key)
+        if data is not None:
+            return decode(data)
+        value = await build()
+        extension = name.rsplit(".", 1)[-1]
+        await self.s3.upload_file(
+            file_content=encode(value),
+            folder="midi",
+            extension=extension,
+            content_type=CONTENT_TYPES[extension],
+            file_hash=record.file_hash,
+            s3_key=s3_key,
+            cache_control=IMMUTABLE_CACHE_CONTROL
+        )
+        logger.info("生成 MIDI 派生格式: 记录ID %s, %s", record.id, name)
+        return value
+
+    async def _parse_source(self, record: ProcessingRecord) -> NoteArray:
+        content, = await self.s3.download_urls([record.output_s3_url])
+        return await asyncio.to_thread(NoteArray.from_midi, content)
+
+
+@lru_cache
+def get_midi_views() -> MidiViews:
+    return MidiViews(get_s3_service(), max_entries=get_settings().midi_view_cache_entries)
@@ -0,0 +1,714 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import List, Optional, Dict, Any
+import httpx
+from app.admission import current_tenant
+from app.config import get_settings
+from app.database import session_scope, read_session_scope, get_read_engine
+from app.lifecycle import is_draining, wait_for_drain
+from app.models import ProcessingRecord
+from app.services.cache_warmer import WARM_TENANT, CacheWarmer, get_cache_warmer
+from app.services.audio_normalizer import AudioNormalizer, NormalizeProfile, get_audio_normalizer
+from app.services.chunking import AudioChunker, Segment, SegmentOutput, get_audio_chunker, merge_midi
+from app.services.delivery import OutputDelivery, get_output_delivery
+from app.services.runpod_service import (
+    INFLIGHT_STATUSES, PERMANENT_FAILURE, TRANSIENT_FAILURE, RunPodJobError, RunPodService, failure_kind
+)
+from app.services.s3_service import S3Service, get_s3_service
+from app.services.stems import StemStore, get_stem_store
+from app.services.usage import UsageRecorder, get_usage_recorder
+from app.timing import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# 超过该大小的文件在线程池中计算哈希，避免阻塞事件循环
+HASH_IN_THREAD_THRESHOLD = 1024 * 1024
+
+
+class JobFailedError(Exception):
+    """
+    RunPod 任务提交、执行或结果保存失败 (记录已标记为 failed)，或同一请求之前因输入无法处理而失败。
+    failure_kind 为 permanent 时重试同一文件也不会成功，路由返回 422。
+    """
+
+    def __init__(self, message: str, failure_kind: str = TRANSIENT_FAILURE):
+        super().__init__(message)
+        self.failure_kind = failure_kind
+
+    @property
+    def permanent(self) -> bool:
+        return self.failure_kind == PERMANENT_FAILURE
+
+
+@dataclass
+class PipelineContext:
+    """一次处理请求在各阶段之间传递的状态"""
+    service: RunPodService
+    file_content: bytes
+    filename: str
+    content_type: str
+    params: Dict[str, Any] = field(default_factory=dict)
+    # 长音频的一个分段 (不再分段，也无需规整)
+    segment: bool = False
+    # 结果由已有的音轨混合得到 (未调用 RunPod)
+    derived: bool = False
+    # 用量统计: 租户、上传文件大小、音频时长 (已检测时)
+    tenant: Optional[str] = None
+    input_bytes: Optional[int] = None
+    input_duration: Optional[float] = None
+    # 已重新提交的次数，以及 worker 返回 FAILED (不含运行环境问题) 的次数
+    attempt: int = 0
+    worker_failures: int = 0
+    file_hash: Optional[str] = None
+    upload_key: Optional[str] = None
+    input_s3_url: Optional[str] = None
+    record: Optional[ProcessingRecord] = None
+    job_id: Optional[str] = None
+    runpod_result: Optional[Dict[str, Any]] = None
+    result: Optional["PipelineResult"] = None
+
+    @property
+    def file_extension(self) -> str:
+        return self.filename.split(".")[-1] if "." in self.filename else "mp3"
+
+
+@dataclass
+class PipelineResult:
+    """处理结果，路由据此构造各自的响应"""
+    output_url: Optional[str]
+    output_data: Optional[Dict[str, Any]]
+    job_id: Optional[str]
+    from_cache: bool
+    record_id: Optional[int] = None
+    # 进程关闭时任务已转交后台继续处理，结果稍后通过 /api/jobs/{token} 查询
+    handed_off: bool = False
+
+
+class ProcessingPipeline:
+    """
+    统一的处理流程: hash → cache → derive → chunk → normalize → upload → submit → await → persist
+
+    每个阶段对应一个 _stage_<name> 方法，按 stages 顺序执行，耗时记入 Server-Timing。
+    任一阶段设置 ctx.result 后流程结束 (如缓存命中)。模型差异由 RunPodService 子类的配置与钩子承担。
+    各阶段只在读写数据库时通过 session_scope() 借出连接，等待 RunPod 期间不占用连接池。
+
+    进程优雅关闭时 (app.lifecycle)，await 阶段不再等待 RunPod，而是把 job_id 写入记录并标记为 handed_off，
+    由 JobResumer 通过 resume() 从 await 阶段接着执行。
+
+    音轨类服务 (Spleeter) 的结果按音轨登记，缓存未命中时先尝试由同一文件更多音轨的结果派生 (derive 阶段)。
+    长音频 (配置了 chunker 时) 在 chunk 阶段切成相互重叠的分段，每段作为独立请求走完整流程后再合并结果。
+
+    提交或执行失败时按 runpod_service.failure_kind() 分类: transient 的失败按指数退避重试，最多 retry_attempts 次。
+    只有任务已结束 (FAILED 等) 时才重新提交；等待超时或查询状态出错时继续等待同一个任务，最终放弃时取消该任务
+    (每次都被 worker 以与运行环境无关的错误拒绝时视为 permanent)；permanent 的失败在 negative_cache_ttl 内，
+    同一请求 (文件哈希, 服务, 参数) 在 cache 阶段直接拒绝，不再上传和调用 RunPod。
+
+    短音频 (时长不超过 runsync_max_duration，未检测时长时按上传大小 runsync_max_bytes 判断) 在 submit 阶段
+    通过 RunPod /runsync 提交并等待最多 runsync_wait 秒，完成时跳过 await 阶段；未完成时按返回的 job_id 继续轮询。
+
+    配置了 single_flight_ttl 时，upload 阶段在 advisory lock 下查重并创建记录: 同一请求已有进行中的记录
+    (single_flight_ttl 内有更新) 时不再提交 RunPod 任务，而是每 single_flight_poll 秒查询该记录，
+    完成后按缓存命中返回；它因 transient 原因失败或长时间没有更新时，由本请求重新创建记录并提交。
+    """
+
+    stages = ("hash", "cache", "derive", "chunk", "normalize", "upload", "submit", "await", "persist")
+
+    def __init__(
+        self,
+        s3: S3Service,
+        normalizer: Optional[AudioNormalizer] = None,
+        normalize_codec: str = "flac",
+        normalize_min_bytes: int = 0,
+        chunker: Optional[AudioChunker] = None,
+        stems: Optional[StemStore] = None,
+        delivery: Optional[OutputDelivery] = None,
+        usage: Optional[UsageRecorder] = None,
+        warmer: Optional[CacheWarmer] = None,
+        retry_attempts: int = 0,
+        retry_backoff: float = 2.0,
+        negative_cache_ttl: int = 0,
+        runsync_wait: float = 0,
+        runsync_max_duration: float = 0,
+        runsync_max_bytes: int = 0,
+        single_flight_ttl: float = 0,
+        single_flight_poll: float = 2.0
+    ):
+        self.s3 = s3
+        self.normalizer = normalizer
+        self.chunker = chunker
+        self.stems = stems
+        self.delivery = delivery
+        self.usage = usage
+        self.warmer = warmer
+        self.retry_attempts = retry_attempts
+        self.retry_backoff = retry_backoff
+        self.negative_cache_ttl = negative_cache_ttl
+        self.runsync_wait = runsync_wait
+        self.runsync_max_duration = runsync_max_duration
+        self.runsync_max_bytes = runsync_max_bytes
+        self.single_flight_ttl = single_flight_ttl
+        self.single_flight_poll = single_flight_poll
+        self.normalize_codec = normalize_codec
+        self.normalize_min_bytes = normalize_min_bytes
+
+    async def run(
+        self,
+        service: RunPodService,
+        file_content: bytes,
+        filename: str,
+        content_type: Optional[str] = None,
+        segment: bool = False,
+        input_duration: Optional[float] = None,
+        tenant: Optional[str] = None,
+        **params
+    ) -> PipelineResult:
+        ctx = PipelineContext(
+            service=service,
+            file_content=file_content,
+            filename=filename,
+            content_type=content_type or "audio/mpeg",
+            params=params,
+            segment=segment,
+            tenant=tenant or current_tenant(),
+            input_bytes=len(file_content),
+            input_duration=input_duration
+        )
+        return await self._run_stages(ctx, self.stages)
+
+    async def resume(self, service: RunPodService, record: ProcessingRecord) -> PipelineResult:
+        """从 await 阶段继续处理一条已提交到 RunPod 的记录 (如被转交后台的任务)"""
+        ctx = PipelineContext(
+            service=service,
+            file_content=b"",
+            filename=record.original_filename,
+            content_type="",
+            file_hash=record.file_hash,
+            input_s3_url=record.input_s3_url,
+            record=record,
+            job_id=record.runpod_job_id,
+            # 续跑的记录没有完整的请求参数，失败时不重新提交
+            attempt=self.retry_attempts
+        )
+        return await self._run_stages(ctx, self.stages[self.stages.index("await"):])
+
+    async def _run_stages(self, ctx: PipelineContext, stages) -> PipelineResult:
+        for stage in stages:
+            with stage_timer(stage):
+                await getattr(self, f"_stage_{stage}")(ctx)
+            if ctx.result is not None:
+                return ctx.result
+        raise RuntimeError("处理流程结束但没有产生结果")
+
+    async def _stage_hash(self, ctx: PipelineContext):
+        if len(ctx.file_content) > HASH_IN_THREAD_THRESHOLD:
+            ctx.file_hash = await asyncio.to_thread(self.s3.calculate_file_hash, ctx.file_content)
+        else:
+            ctx.file_hash = self.s3.calculate_file_hash(ctx.file_content)
+        logger.debug("文件哈希: %s", ctx.file_hash)
+
+    async def _stage_cache(self, ctx: PipelineContext):
+        # 先查只读副本；未命中时再查主库，避免副本延迟导致刚完成的结果被重复处理
+        async with read_session_scope() as db:
+            record = await ctx.service.check_existing_record(db, ctx.file_hash, **ctx.params)
+        if record is None and get_read_engine() is not None:
+            async with session_scope() as db:
+                record = await ctx.service.check_existing_record(db, ctx.file_hash, **ctx.params)
+        if record and record.output_s3_url:
+            logger.info("✅ 找到缓存记录，直接返回结果: %s", ctx.file_hash)
+            self._cache_hit(ctx, record)
+            return
+        if self.negative_cache_ttl:
+            await self._check_known_failure(ctx)
+        # 只统计缓存未命中的请求 (此时 file_content 仍是原始文件)
+        if self.warmer is not None and not ctx.segment and ctx.tenant != WARM_TENANT:
+            await self.warmer.observe(
+                ctx.service.service_type, ctx.params, ctx.file_hash, ctx.filename, ctx.content_type, ctx.file_content
+            )
+
+    def _cache_hit(self, ctx: PipelineContext, record: ProcessingRecord):
+        if self.usage is not None:
+            self.usage.record_cache_hit(ctx.service.service_type, ctx.tenant, record)
+        ctx.result = PipelineResult(
+            output_url=record.output_s3_url,
+            output_data=record.output_data,
+            job_id=record.runpod_job_id,
+            from_cache=True,
+            record_id=record.id
+        )
+
+    async def _check_known_failure(self, ctx: PipelineContext):
+        """同一请求在 negative_cache_ttl 内因输入无法处理而失败过时直接拒绝"""
+        since = datetime.utcnow() - timedelta(seconds=self.negative_cache_ttl)
+        async with read_session_scope() as db:
+            failed = await ctx.service.check_failed_record(db, ctx.file_hash, since, **ctx.params)
+        if failed is not None:
+            logger.info("⛔ 该文件之前处理失败 (记录ID: %s)，直接拒绝: %s", failed.id, ctx.file_hash)
+            raise JobFailedError(f"该文件无法处理: {failed.error_message}", PERMANENT_FAILURE)
+
+    async def _stage_derive(self, ctx: PipelineContext):
+        """
+        由同一文件已有的音轨在 CPU 上得到请求的结果，失败时继续调用 RunPod:
+        只有编码不同时转换格式 / 比特率，布局不同时由更多音轨的结果混合 (如 4 轨 → 2 轨)
+        """
+        service = ctx.service
+        if self.stems is None or not self.stems.can_derive or service.stem_layout_param is None:
+            return
+        layout = ctx.params.get(service.stem_layout_param)
+        format, bitrate = service.stem_encoding(**ctx.params)
+        found = await self.stems.find_source(ctx.file_hash, layout, format, bitrate)
+        if found is None:
+            return
+        source, artifacts = found
+
+        started = time.perf_counter()
+        try:
+            output = await self.stems.derive(ctx.file_hash, layout, source, artifacts, format, bitrate)
+        except Exception as e:
+            logger.warning("音轨派生失败，改为调用 RunPod: %s", e)
+            return
+        # 派生记录的输入为源音轨所在的结果
+        ctx.input_s3_url = next(iter(artifacts.values())).s3_url
+        ctx.derived = True
+        await self._create_record(ctx)
+        ctx.runpod_result = {
+            "id": None,
+            "status": "COMPLETED",
+            "output": output,
+            "executionTime": (time.perf_counter() - started) * 1000
+        }
+        await self._stage_persist(ctx)
+
+    async def _stage_chunk(self, ctx: PipelineContext):
+        """
+        超过时长阈值的音频切成相互重叠的分段，并发提交到 RunPod，再把各段结果合并为一个结果。
+        每个分段按自身哈希缓存，同一首长音频重新处理时已完成的分段直接复用。
+        """
+        service = ctx.service
+        if self.chunker is None or ctx.segment or service.chunk_merge is None:
+            return
+        duration = await self.chunker.duration_to_chunk(ctx.file_content)
+        if duration is None:
+            return
+
+        started = time.perf_counter()
+        # 分段已转换为模型的原生格式，不再单独规整
+        segments = await self.chunker.split(
+            ctx.file_content,
+            duration,
+            sample_rate=service.normalize_sample_rate,
+            channels=service.normalize_channels if service.normalize_sample_rate else None
+        )
+        logger.info("长音频分段处理: %.1fs → %s 段, 文件哈希: %s", duration, len(segments), ctx.file_hash)
+        ctx.input_duration = duration
+
+        # 父记录的输入指向分段清单
+        manifest_key = f"chunked/{ctx.file_hash}/{self._chunk_name(ctx)}.json"
+        ctx.input_s3_url = self.s3.get_file_url(manifest_key)
+        await self._create_record(ctx)
+
+        results = await self._run_segments(ctx, segments)
+        try:
+            output = await self._merge_segments(ctx, segments, results)
+            await self.s3.upload_file(
+                file_content=json.dumps({
+                    "source": ctx.filename,
+                    "duration": duration,
+                    "overlap": self.chunker.overlap,
+                    "segments": [
+                        {
+                            "index": segment.index,
+                            "start": segment.start,
+                            "duration": segment.duration,
+                            "record_id": result.record_id,
+                            "output_url": result.output_url
+                        }
+                        for segment, result in zip(segments, results)
+                    ]
+                }, ensure_ascii=False).encode(),
+                folder="chunked",
+                extension="json",
+                content_type="application/json",
+                file_hash=ctx.file_hash,
+                s3_key=manifest_key
+            )
+        except Exception as e:
+            await self._fail(ctx, f"分段结果合并失败: {str(e)}", exc=e)
+
+        # 以 RunPod 结果的格式保存，处理时间为整个分段流程的耗时
+        ctx.runpod_result = {
+            "id": None,
+            "status": "COMPLETED",
+            "output": output,
+            "executionTime": (time.perf_counter() - started) * 1000
+        }
+        await self._stage_persist(ctx)
+
+    async def _run_segments(self, ctx: PipelineContext, segments: List[Segment]) -> List[PipelineResult]:
+        semaphore = asyncio.Semaphore(self.chunker.segment_concurrency)
+        stem = ctx.filename.rsplit(".", 1)[0]
+
+        async def process(segment: Segment) -> PipelineResult:
+            async with semaphore:
+                return await self.run(
+                    ctx.service,
+                    segment.content,
+                    filename=f"{stem}.part{segment.index:03d}.flac",
+                    content_type="audio/flac",
+                    segment=True,
+                    input_duration=segment.duration,
+                    **ctx.params
+                )
+
+        results = await asyncio.gather(*(process(segment) for segment in segments), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            await self._fail(ctx, f"分段处理失败 ({len(errors)}/{len(segments)}): {str(errors[0])}", exc=errors[0])
+        if any(result.handed_off for result in results):
+            # 分段各自由 JobResumer 继续处理，客户端重试时命中各分段的缓存后再合并
+            await self._fail(ctx, "服务正在重启，分段任务已转交后台继续处理，请稍后重试")
+        return results
+
+    async def _merge_segments(
+        self,
+        ctx: PipelineContext,
+        segments: List[Segment],
+        results: List[PipelineResult]
+    ) -> Dict[str, Any]:
+        """下载各分段结果并合并上传，返回 RunPod output 格式的结果"""
+        service = ctx.service
+        contents = await self.s3.download_urls([result.output_url for result in results])
+        parts = [SegmentOutput(start=segment.start, content=content) for segment, content in zip(segments, contents)]
+        key = f"chunked/{ctx.file_hash}/{self._chunk_name(ctx)}"
+
+        if service.chunk_merge == "midi":
+            merged = await asyncio.to_thread(merge_midi, parts, self.chunker.overlap)
+            url, _ = await self.s3.upload_file(
+                file_content=merged,
+                folder="chunked",
+                extension="mid",
+                content_type="audio/midi",
+                file_hash=ctx.file_hash,
+                s3_key=f"{key}.mid"
+            )
+            return {service.output_url_key: url}
+
+        first = results[0].output_data or {}
+        merged, files = await self.chunker.merge_stems(parts, bitrate=ctx.params.get("bitrate"))
+        url, _ = await self.s3.upload_file(
+            file_content=merged,
+            folder="chunked",
+            extension="zip",
+            content_type="application/zip",
+            file_hash=ctx.file_hash,
+            s3_key=f"{key}.zip"
+        )
+        return {
+            service.output_url_key: url,
+            "files": files,
+            "size_mb": round(len(merged) / 1024 / 1024, 2),
+            "bitrate": first.get("bitrate"),
+            "format": first.get("format")
+        }
+
+    @staticmethod
+    def _chunk_name(ctx: PipelineContext) -> str:
+        """合并结果的文件名: 服务类型加缓存参数，如 spleeter-stems4"""
+        return "-".join([ctx.service.service_type, *(f"{name}{ctx.params[name]}" for name in ctx.service.cache_params)])
+
+    async def _stage_normalize(self, ctx: PipelineContext):
+        """
+        把输入转换为模型的原生格式 (采样率 / 声道 / FLAC 或 Opus) 以缩小上传和 RunPod 下载的数据量。
+        结果按源文件哈希存放，其他服务需要相同格式时直接复用；转换后反而更大时仍上传原文件。
+        """
+        service = ctx.service
+        if (
+            self.normalizer is None
+            or ctx.segment
+            or service.normalize_sample_rate is None
+            or len(ctx.file_content) < self.normalize_min_bytes
+        ):
+            return
+        profile = NormalizeProfile(service.normalize_sample_rate, service.normalize_channels, self.normalize_codec)
+        key = profile.s3_key(ctx.file_hash)
+        if await self.s3.check_file_exists(key):
+            logger.info("复用已规整的音频: %s", key)
+            ctx.input_s3_url = self.s3.get_file_url(key)
+            return
+
+        normalized = await self.normalizer.normalize(ctx.file_content, profile)
+        if normalized is None:
+            return
+        if len(normalized) >= len(ctx.file_content):
+            logger.debug("规整后文件未变小 (%s → %s bytes)，上传原文件", len(ctx.file_content), len(normalized))
+            return
+        logger.info(
+            "音频规整完成: %s → %s bytes (%s Hz, %s 声道, %s)",
+            len(ctx.file_content), len(normalized), profile.sample_rate, profile.channels, profile.codec
+        )
+        ctx.file_content = normalized
+        ctx.content_type = profile.content_type
+        ctx.upload_key = key
+
+    async def _stage_upload(self, ctx: PipelineContext):
+        if ctx.input_s3_url is None:
+            logger.info("开始上传文件到S3，文件大小: %s bytes, 文件名：%s", len(ctx.file_content), ctx.filename)
+            ctx.input_s3_url, _ = await self.s3.upload_file(
+                file_content=ctx.file_content,
+                folder="url2mp3",
+                extension=ctx.file_extension,
+                content_type=ctx.content_type,
+                file_hash=ctx.file_hash,
+                s3_key=ctx.upload_key
+            )
+        while True:
+            other = await self._create_record(ctx, single_flight=bool(self.single_flight_ttl))
+            if other is None:
+                return
+            if other.status in INFLIGHT_STATUSES:
+                other = await self._wait_for_inflight(ctx, other)
+            if other is not None and other.status == "completed" and other.output_s3_url:
+                logger.info("✅ 同一请求已由记录 %s 处理完成，直接返回结果: %s", other.id, ctx.file_hash)
+                self._cache_hit(ctx, other)
+                return
+            if other is not None and other.status == "failed" and other.failure_kind == PERMANENT_FAILURE:
+                raise JobFailedError(f"该文件无法处理: {other.error_message}", PERMANENT_FAILURE)
+            # 其他请求的任务可重试地失败、已中断或记录已被清理，由本请求重新创建记录并提交
+
+    async def _create_record(self, ctx: PipelineContext, single_flight: bool = False) -> Optional[ProcessingRecord]:
+        """
+        创建处理记录并提交事务。single_flight 时先在同一请求的 advisory lock 下查重:
+        已有完成或进行中的记录时返回该记录，不再创建
+        """
+        async with session_scope() as db:
+            if single_flight:
+                await ctx.service.lock_request(db, ctx.file_hash, **ctx.params)
+                other = await ctx.service.check_existing_record(db, ctx.file_hash, **ctx.params)
+                if other is None:
+                    since = datetime.utcnow() - timedelta(seconds=self.single_flight_ttl)
+                    other = await ctx.service.check_inflight_record(db, ctx.file_hash, since, **ctx.params)
+                if other is not None:
+                    return other
+            ctx.record = await ctx.service.create_record(
+                db=db,
+                file_hash=ctx.file_hash,
+                original_filename=ctx.filename,
+                input_s3_url=ctx.input_s3_url,
+                tenant=ctx.tenant,
+                input_bytes=ctx.input_bytes,
+                input_duration=ctx.input_duration,
+                **ctx.params
+            )
+            # 调用 RunPod 之前提交事务 (同时释放 advisory lock)
+            await db.commit()
+        return None
+
+    async def _wait_for_inflight(self, ctx: PipelineContext, record: ProcessingRecord) -> Optional[ProcessingRecord]:
+        """等待同一请求的进行中记录结束；记录超过 single_flight_ttl 没有更新 (已中断) 时返回它当前的状态"""
+        logger.info("同一请求正在由记录 %s 处理，等待其结果: %s", record.id, ctx.file_hash)
+        while record is not None and record.status in INFLIGHT_STATUSES:
+            if record.updated_at < datetime.utcnow() - timedelta(seconds=self.single_flight_ttl):
+                logger.warning("⚠️ 记录 %s 超过 %s 秒没有更新，重新提交: %s", record.id, self.single_flight_ttl, ctx.file_hash)
+                break
+            if is_draining():
+                # 本请求还没有记录，不能转交后台
+                raise JobFailedError("服务正在重启，请稍后重试")
+            await asyncio.sleep(self.single_flight_poll)
+            async with session_scope() as db:
+                record = await db.get(ProcessingRecord, record.id)
+        return record
+
+    def _use_runsync(self, ctx: PipelineContext) -> bool:
+        if not self.runsync_wait:
+            return False
+        if ctx.input_duration is not None:
+            return ctx.input_duration <= self.runsync_max_duration
+        return ctx.input_bytes is not None and ctx.input_bytes <= self.runsync_max_bytes
+
+    async def _stage_submit(self, ctx: PipelineContext):
+        if self._use_runsync(ctx):
+            try:
+                result = await ctx.service.run_sync(ctx.input_s3_url, self.runsync_wait, **ctx.params)
+            except RunPodJobError as e:
+                # 任务失败: 按失败分类重试 (改为异步提交) 或标记失败
+                await self._retry_or_fail(ctx, f"RunPod API调用失败: {str(e)}", e)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.HTTPStatusError) as e:
+                # 请求没有发出 (连接失败) 或 RunPod 明确拒绝 (HTTP 错误状态): 没有创建任务，改为异步提交
+                logger.warning("runsync 调用失败，改为异步提交: %s", e)
+            except Exception as e:
+                # 读取超时、连接中断等: RunPod 可能已经接受请求并在运行任务，但不知道 job_id，
+                # 重新提交会产生第二个计费任务，记为可重试的失败 (由客户端稍后重试)
+                await self._fail(
+                    ctx, f"RunPod API调用失败 (runsync 请求已发出，结果未知): {str(e)}", e, kind=TRANSIENT_FAILURE
+                )
+            else:
+                ctx.job_id = result.get("id")
+                if result.get("status") == "COMPLETED":
+                    ctx.runpod_result = result
+                else:
+                    logger.info("runsync %ss 内未完成，继续轮询 Job ID: %s", self.runsync_wait, ctx.job_id)
+                return
+        while True:
+            try:
+                ctx.job_id = await ctx.service.submit_job(ctx.input_s3_url, **ctx.params)
+                return
+            except Exception as e:
+                await self._retry_or_fail(ctx, f"RunPod API调用失败: {str(e)}", e)
+
+    async def _stage_await(self, ctx: PipelineContext):
+        if ctx.runpod_result is not None:
+            # runsync 已返回结果
+            return
+        if is_draining():
+            await self._hand_off(ctx)
+            return
+        waiter = asyncio.ensure_future(ctx.service.wait_for_completion(ctx.job_id))
+        drain = asyncio.ensure_future(wait_for_drain())
+        try:
+            done, _ = await asyncio.wait({waiter, drain}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            drain.cancel()
+            if not waiter.done():
+                waiter.cancel()
+        if waiter not in done:
+            await self._hand_off(ctx)
+            return
+        try:
+            ctx.runpod_result = waiter.result()
+            return
+        except Exception as e:
+            # 等待超时或查询状态出错时任务仍在 RunPod 上: 继续等待同一个任务，不重复提交
+            job_alive = not (isinstance(e, RunPodJobError) and e.job_finished)
+            if job_alive and is_draining():
+                await self._hand_off(ctx)
+                return
+            try:
+                await self._retry_or_fail(ctx, f"RunPod API调用失败: {str(e)}", e)
+            except JobFailedError:
+                if job_alive:
+                    await self._cancel_job(ctx)
+                raise
+        if not job_alive:
+            await self._stage_submit(ctx)
+        await self._stage_await(ctx)
+
+    async def _cancel_job(self, ctx: PipelineContext):
+        """放弃等待时取消仍在运行的任务，不再为没人使用的结果付费"""
+        try:
+            await ctx.service.cancel_job(ctx.job_id)
+        except Exception as e:
+            logger.warning("取消 RunPod 任务失败 (Job ID: %s): %s", ctx.job_id, e)
+
+    async def _retry_or_fail(self, ctx: PipelineContext, error_msg: str, exc: Exception):
+        """
+        transient 的失败在还有重试次数时等待退避时间后返回 (由调用方重新提交，或任务仍在运行时继续等待)，
+        否则把记录标记为失败。environment 的失败 (如 401 / 403) 不重试。
+        """
+        kind = failure_kind(exc)
+        if isinstance(exc, RunPodJobError) and exc.worker_rejected:
+            ctx.worker_failures += 1
+        if kind == TRANSIENT_FAILURE and ctx.attempt < self.retry_attempts and not is_draining():
+            # 指数退避加随机抖动，避免同时失败的请求一起重试
+            delay = self.retry_backoff * 2 ** ctx.attempt * random.uniform(0.5, 1.5)
+            ctx.attempt += 1
+            logger.warning("%s，%.1fs 后重试 (%s/%s)", error_msg, delay, ctx.attempt, self.retry_attempts)
+            await asyncio.sleep(delay)
+            return
+        if kind == TRANSIENT_FAILURE and self.retry_attempts and ctx.worker_failures > self.retry_attempts:
+            # 每次提交都被 worker 以与运行环境无关的错误拒绝，视为输入无法处理
+            kind = PERMANENT_FAILURE
+        await self._fail(ctx, error_msg, exc=exc, kind=kind)
+
+    async def _hand_off(self, ctx: PipelineContext):
+        """进程正在关闭: 保存 job_id 并把记录交给其他 worker 继续轮询"""
+        logger.info("进程正在关闭，任务转交后台继续处理，记录ID: %s, Job ID: %s", ctx.record.id, ctx.job_id)
+        async with session_scope() as db:
+            await ctx.service.update_record_handed_off(db, ctx.record, ctx.job_id)
+        ctx.result = PipelineResult(
+            output_url=None,
+            output_data=None,
+            job_id=ctx.job_id,
+            from_cache=False,
+            record_id=ctx.record.id,
+            handed_off=True
+        )
+
+    async def _stage_persist(self, ctx: PipelineContext):
+        result = ctx.runpod_result
+        if result.get("status") != "COMPLETED":
+            await self._fail(ctx, f"RunPod任务状态异常: {result.get('status')}")
+
+        # 分段结果只用于合并，不复制
+        if self.delivery is not None and self.delivery.copy_outputs and not ctx.segment:
+            result = await self._deliver(ctx, result)
+        async with session_scope() as db:
+            await ctx.service.update_record_success(db, ctx.record, result)
+        if self.stems is not None and ctx.service.stem_layout_param is not None:
+            try:
+                await self.stems.register(ctx.record, derived=ctx.derived)
+            except Exception as e:
+                logger.warning("登记音轨失败 (记录ID: %s): %s", ctx.record.id, e)
+        ctx.result = PipelineResult(
+            output_url=ctx.record.output_s3_url,
+            output_data=ctx.record.output_data,
+            job_id=result.get("id"),
+            from_cache=False,
+            record_id=ctx.record.id
+        )
+
+    async def _deliver(self, ctx: PipelineContext, result: Dict[str, Any]) -> Dict[str, Any]:
+        """结果复制到内容寻址的 key；失败时保留原 URL，不影响本次结果"""
+        output = result.get("output") or {}
+        url = output.get(ctx.service.output_url_key)
+        if not url:
+            return result
+        try:
+            stored = await self.delivery.store(url)
+        except Exception as e:
+            logger.warning("复制结果失败 (记录ID: %s)，保留原 URL: %s", ctx.record.id, e)
+            return result
+        return {**result, "output": {**output, ctx.service.output_url_key: stored}}
+
+    async def _fail(
+        self,
+        ctx: PipelineContext,
+        error_msg: str,
+        exc: Optional[Exception] = None,
+        kind: Optional[str] = None
+    ):
+        kind = kind or (failure_kind(exc) if exc is not None else TRANSIENT_FAILURE)
+        logger.error("❌ %s", error_msg, exc_info=exc)
+        async with session_scope() as db:
+            await ctx.service.update_record_failure(
+                db, ctx.record, error_msg, result=getattr(exc, "result", None), kind=kind
+            )
+        raise JobFailedError(error_msg, kind)
+
+
+@lru_cache
+def get_processing_pipeline() -> ProcessingPipeline:
+    settings = get_settings()
+    return ProcessingPipeline(
+        get_s3_service(),
+        normalizer=get_audio_normalizer() if settings.audio_normalize_enabled else None,
+        normalize_codec=settings.audio_normalize_codec,
+        normalize_min_bytes=settings.audio_normalize_min_bytes,
+        chunker=get_audio_chunker() if settings.chunking_enabled else None,
+        stems=get_stem_store(),
+        delivery=get_output_delivery(),
+        usage=get_usage_recorder(),
+        warmer=get_cache_warmer() if settings.cache_warm_enabled else None,
+        retry_attempts=settings.job_retry_attempts,
+        retry_backoff=settings.job_retry_backoff_s,
+        negative_cache_ttl=settings.negative_cache_ttl_s,
+        runsync_wait=settings.runsync_wait_s if settings.runsync_enabled else 0,
+        runsync_max_duration=settings.runsync_max_duration_s,
+        runsync_max_bytes=settings.runsync_max_bytes,
+        single_flight_ttl=settings.single_flight_ttl_s,
+        single_flight_poll=settings.single_flight_poll_s
+    )
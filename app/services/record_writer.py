@@ -0,0 +1,173 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import Integer, cast, column, update, values
+from app.config import get_settings
+from app.database import session_scope
+from app.models import ProcessingRecord
+
+logger = logging.getLogger(__name__)
+
+_COLUMNS = ProcessingRecord.__table__.c
+
+
+@dataclass
+class _PendingUpdate:
+    values: Dict[str, Any]
+    waiters: List[asyncio.Future] = field(default_factory=list)
+
+
+class RecordWriteBuffer:
+    """
+    ProcessingRecord 状态更新的写后缓冲 (write-behind)
+
+    每隔 flush_interval 把积累的更新合并成批量语句:
+        UPDATE processing_records SET ... FROM (VALUES ...) AS v WHERE id = v.id RETURNING ...
+    同一记录的多次更新在一个周期内合并为一次，RETURNING 的结果代替逐条 refresh。
+
+    持久性约定:
+    - update(wait=True) (默认): 调用方等待所在批次提交后才返回，与逐条 commit 一样持久，
+      只多出最多 flush_interval 的延迟；批次失败时逐条重试，只有出错的那条把异常抛给调用方
+    - update(wait=False): 入队后立即返回，适合可丢失的中间状态；进程崩溃时最多丢失一个周期内的更新，
+      正常关闭 (stop) 时会先写完所有积压的更新
+    - 缓冲未启动时 (如脚本、工具) 直接逐条写库
+    """
+
+    def __init__(self, flush_interval: float = 0.05, max_batch: int = 500):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._pending: Dict[int, _PendingUpdate] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        logger.info("记录写后缓冲已启动，刷新间隔: %ss, 最大批量: %s", self.flush_interval, self.max_batch)
+
+    async def stop(self):
+        """停止并写完所有积压的更新"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+    async def update(self, record_id: int, record_values: Dict[str, Any], wait: bool = True) -> Optional[Dict[str, Any]]:
+        """登记一条更新；wait=True 时返回提交后数据库中的值 (RETURNING)"""
+        if not self.running:
+            return await self._write_one(record_id, record_values)
+
+        pending = self._pending.get(record_id)
+        if pending is None:
+            pending = self._pending[record_id] = _PendingUpdate(values={})
+        pending.values.update(record_values)
+        future = None
+        if wait:
+            future = asyncio.get_running_loop().create_future()
+            pending.waiters.append(future)
+        self._wakeup.set()
+        if future is not None:
+            return await future
+        return None
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            if not self._stopping:
+                # 等一个周期，把这段时间内的更新攒成一批
+                await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            while self._pending:
+                batch = dict(list(self._pending.items())[:self.max_batch])
+                for record_id in batch:
+                    del self._pending[record_id]
+                await self._flush(batch)
+            if self._stopping:
+                return
+
+    async def _flush(self, batch: Dict[int, _PendingUpdate]):
+        # 列集合相同的更新才能放进同一条 VALUES 语句
+        groups: Dict[Tuple[str, ...], Dict[int, _PendingUpdate]] = {}
+        for record_id, pending in batch.items():
+            groups.setdefault(tuple(sorted(pending.values)), {})[record_id] = pending
+
+        for columns, group in groups.items():
+            try:
+                rows = await self._write_batch(columns, group)
+            except Exception as e:
+                logger.warning("批量更新失败，逐条重试: %s", e)
+                for record_id, pending in group.items():
+                    try:
+                        row = await self._write_one(record_id, pending.values)
+                    except Exception as row_error:
+                        self._resolve(pending, error=row_error)
+                    else:
+                        self._resolve(pending, row=row)
+                continue
+            for record_id, pending in group.items():
+                self._resolve(pending, row=rows.get(record_id))
+            logger.debug("批量更新 %s 条记录，列: %s", len(group), columns)
+
+    async def _write_batch(self, columns: Tuple[str, ...], group: Dict[int, _PendingUpdate]) -> Dict[int, Dict[str, Any]]:
+        source = values(
+            column("id", Integer),
+            *(column(name, _COLUMNS[name].type) for name in columns),
+            name="v"
+        ).data([
+            (record_id, *(pending.values[name] for name in columns))
+            for record_id, pending in group.items()
+        ])
+        stmt = (
+            update(ProcessingRecord)
+            .where(ProcessingRecord.id == source.c.id)
+            # 显式转换类型: 首行为 NULL 时 VALUES 列会被推断为 text
+            .values({name: cast(source.c[name], _COLUMNS[name].type) for name in columns})
+            .returning(ProcessingRecord.id, ProcessingRecord.updated_at, *(_COLUMNS[name] for name in columns))
+        )
+        async with session_scope() as db:
+            result = await db.execute(stmt)
+            rows = {row.id: dict(row._mapping) for row in result}
+            await db.commit()
+        return rows
+
+    async def _write_one(self, record_id: int, record_values: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        stmt = (
+            update(ProcessingRecord)
+            .where(ProcessingRecord.id == record_id)
+            .values(**record_values)
+            .returning(ProcessingRecord.id, ProcessingRecord.updated_at, *(_COLUMNS[name] for name in record_values))
+        )
+        async with session_scope() as db:
+            row = (await db.execute(stmt)).first()
+            await db.commit()
+        return dict(row._mapping) if row is not None else None
+
+    @staticmethod
+    def _resolve(pending: _PendingUpdate, row: Optional[Dict[str, Any]] = None, error: Optional[Exception] = None):
+        for future in pending.waiters:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(row)
+
+
+@lru_cache
+def get_record_writer() -> RecordWriteBuffer:
+    """写后缓冲 (由应用生命周期启动 / 停止)"""
+    settings = get_settings()
+    return RecordWriteBuffer(
+        flush_interval=settings.write_behind_interval_ms / 1000,
+        max_batch=settings.write_behind_max_batch
+    )
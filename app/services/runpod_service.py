@@ -0,0 +1,488 @@
+import httpx
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select, update
+from app.config import get_settings
+from app.logging_config import SAMPLED
+from app.models import ProcessingRecord
+from app.services.record_writer import get_record_writer
+from app.timing import record_stage
+import logging
+import asyncio
+
+logger = logging.getLogger(__name__)
+
+
+# 失败类型:
+# - permanent: 输入本身无法处理 (在一段时间内直接拒绝同样的请求)
+# - transient: 可重试的失败
+# - environment: 配置或权限问题 (如 RunPod 返回 401 / 403 / 400)，重试无用，但与输入无关，不缓存
+PERMANENT_FAILURE = "permanent"
+TRANSIENT_FAILURE = "transient"
+ENVIRONMENT_FAILURE = "environment"
+
+# 处理记录仍在进行中的状态: 同一请求的其他请求等待它的结果
+INFLIGHT_STATUSES = ("processing", "handed_off")
+
+# RunPod 任务的终止状态: 任务已不在 GPU 上运行，可以重新提交
+TERMINAL_STATUSES = ("COMPLETED", "FAILED", "CANCELLED", "TIMED_OUT")
+
+# RunPod worker 错误信息中表示输入文件无法处理的关键字 (小写)
+PERMANENT_ERROR_MARKERS = (
+    "invalid data", "could not decode", "failed to decode", "error decoding", "corrupt",
+    "unsupported format", "format not recognised", "format not recognized",
+    "no audio", "empty audio", "invalid audio", "audio is too short",
+)
+# 表示运行环境问题 (与输入无关) 的关键字，这类失败重试多少次都不视为输入无法处理
+ENVIRONMENT_ERROR_MARKERS = ("out of memory", "cuda", "timeout", "timed out", "connection", "no space left")
+
+
+class RunPodJobError(Exception):
+    """RunPod 任务失败或等待超时；result 为最后一次查询到的任务状态 (含 pollCount)，用于记录用量"""
+
+    def __init__(self, message: str, result: Optional[Dict[str, Any]] = None):
+        super().__init__(message)
+        self.result = result or {}
+
+    @property
+    def job_finished(self) -> bool:
+        """任务已结束 (FAILED / CANCELLED / TIMED_OUT)；等待超时或查询出错时任务可能仍在运行"""
+        return self.result.get("status") in TERMINAL_STATUSES
+
+    @property
+    def worker_failed(self) -> bool:
+        """任务在 worker 上运行后返回 FAILED (而不是超时或网络错误)"""
+        return self.result.get("status") == "FAILED"
+
+    @property
+    def worker_rejected(self) -> bool:
+        """worker 返回 FAILED，且错误不是显存不足、超时等运行环境问题"""
+        error = str(self.result.get("error") or "").lower()
+        return self.worker_failed and not any(marker in error for marker in ENVIRONMENT_ERROR_MARKERS)
+
+
+def failure_kind(exc: BaseException) -> str:
+    """
+    失败分类: worker 返回 FAILED 且错误信息表明输入无法解码等为 permanent；
+    RunPod 接口返回 429 以外的 4xx 为 environment；超时、网络错误、5xx 和其他 worker 错误 (如显存不足) 为 transient。
+    已分类的异常 (带 failure_kind 属性，如处理流程的 JobFailedError) 沿用其分类。
+    """
+    kind = getattr(exc, "failure_kind", None)
+    if kind is not None:
+        return kind
+    if isinstance(exc, RunPodJobError) and exc.worker_failed:
+        error = str(exc.result.get("error") or "").lower()
+        if any(marker in error for marker in PERMANENT_ERROR_MARKERS):
+            return PERMANENT_FAILURE
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        if 400 <= status < 500 and status != 429:
+            return ENVIRONMENT_FAILURE
+    return TRANSIENT_FAILURE
+
+
+def job_accounting(result: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    从 RunPod 任务状态中提取用量列。只有真正提交到 RunPod 的任务 (有 id) 才记录排队 / 执行时间，
+    派生、合并等本地生成的结果不计入 GPU 时间。
+    """
+    values: Dict[str, Any] = {"finished_at": datetime.utcnow()}
+    if not result:
+        return values
+    if result.get("id"):
+        values["queue_seconds"] = result.get("delayTime", 0) / 1000.0
+        values["exec_seconds"] = result.get("executionTime", 0) / 1000.0
+    if "pollCount" in result:
+        values["poll_count"] = result["pollCount"]
+    return values
+
+
+class RunPodService:
+    """
+    RunPod 模型服务基类
+
+    子类只需声明模型相关的配置，必要时覆盖钩子方法:
+    - service_type: 写入 ProcessingRecord.service_type 的服务类型
+    - endpoint_setting: Settings 中 RunPod 端点的字段名
+    - output_url_key: RunPod output 中结果 URL 的字段名
+    - input_params: 透传给 RunPod input 的请求参数
+    - default_params: 请求参数的默认值，路由的表单默认值与缓存预热都从这里读取，保证预热结果能被请求命中
+    - cache_params: 参与缓存匹配的请求参数 (需是 ProcessingRecord 的列)
+    - fingerprint_params: 只影响结果编码的请求参数，规范化后写入 ProcessingRecord.params_fingerprint 参与缓存匹配
+    - normalize_sample_rate / normalize_channels: 模型的原生输入格式，开启音频规整时上传前转换，None 表示不转换
+    - chunk_merge: 长音频分段处理后的结果合并方式 ("midi" / "stems")，None 表示不分段
+    - stem_layout_param: 表示音轨布局的请求参数，设置后结果按音轨登记，并可由更多音轨或其他编码的结果派生
+    - stem_encoding(): 请求的音轨编码 (格式, 比特率)
+    - build_output_data(): 从 RunPod output 中提取需要额外保存的数据
+    """
+
+    service_type: str = ""
+    endpoint_setting: str = ""
+    output_url_key: str = "midi_url"
+    input_params: Tuple[str, ...] = ()
+    default_params: Dict[str, Any] = {}
+    cache_params: Tuple[str, ...] = ()
+    fingerprint_params: Tuple[str, ...] = ()
+    normalize_sample_rate: Optional[int] = None
+    normalize_channels: int = 1
+    chunk_merge: Optional[str] = None
+    stem_layout_param: Optional[str] = None
+
+    def __init__(self):
+        settings = get_settings()
+        self.api_key = settings.runpod_api_key
+        self.endpoint = getattr(settings, self.endpoint_setting)
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        logger.info("%s 初始化完成，端点: %s", type(self).__name__, self.endpoint)
+
+    def fingerprint_values(self, **params) -> Dict[str, str]:
+        """规范化 fingerprint_params 的取值，子类可覆盖 (如无损格式忽略比特率)"""
+        return {name: str(params.get(name) or "").strip().lower() for name in self.fingerprint_params}
+
+    def params_fingerprint(self, **params) -> Optional[str]:
+        """如 format=wav;bitrate=，没有 fingerprint_params 时为 None"""
+        if not self.fingerprint_params:
+            return None
+        return ";".join(f"{name}={value}" for name, value in self.fingerprint_values(**params).items())
+
+    def stem_encoding(self, **params) -> Tuple[Optional[str], Optional[str]]:
+        return None, None
+
+    def _match_request(self, file_hash: str, **params) -> List[Any]:
+        """与本次请求结果相同的记录: 文件哈希、服务类型、cache_params 与参数指纹均一致"""
+        conditions = [
+            ProcessingRecord.file_hash == file_hash,
+            ProcessingRecord.service_type == self.service_type,
+            *(getattr(ProcessingRecord, name) == params[name] for name in self.cache_params)
+        ]
+        if self.fingerprint_params:
+            conditions.append(ProcessingRecord.params_fingerprint == self.params_fingerprint(**params))
+        return conditions
+
+    async def check_existing_record(
+        self,
+        db: AsyncSession,
+        file_hash: str,
+        **params
+    ) -> Optional[ProcessingRecord]:
+        """检查是否已有处理记录(需要匹配 cache_params 中的参数与参数指纹)"""
+        logger.debug("检查是否存在缓存记录，service: %s, file_hash: %s, params: %s", self.service_type, file_hash, params)
+        query = select(ProcessingRecord).where(
+            ProcessingRecord.status == "completed",
+            *self._match_request(file_hash, **params)
+        ).limit(1)
+        # file_hash 不再唯一 (同一文件可以有多条失败/重试记录)，命中 ix_processing_records_cache_lookup 部分索引
+        result = await db.execute(query)
+        record = result.scalars().first()
+
+        if record:
+            logger.info("✅ 找到缓存记录，ID: %s, 结果 URL: %s", record.id, record.output_s3_url)
+        else:
+            logger.debug("未找到缓存记录")
+
+        return record
+
+    async def check_failed_record(
+        self,
+        db: AsyncSession,
+        file_hash: str,
+        since: datetime,
+        **params
+    ) -> Optional[ProcessingRecord]:
+        """since 之后同一请求因输入无法处理 (permanent) 而失败的记录，命中 ix_processing_records_failure_lookup 部分索引"""
+        query = select(ProcessingRecord).where(
+            ProcessingRecord.status == "failed",
+            ProcessingRecord.failure_kind == PERMANENT_FAILURE,
+            ProcessingRecord.finished_at >= since,
+            *self._match_request(file_hash, **params)
+        ).order_by(ProcessingRecord.finished_at.desc()).limit(1)
+        return (await db.execute(query)).scalars().first()
+
+    async def check_inflight_record(
+        self,
+        db: AsyncSession,
+        file_hash: str,
+        since: datetime,
+        **params
+    ) -> Optional[ProcessingRecord]:
+        """since 之后仍有更新、正在处理同一请求的记录，命中 ix_processing_records_inflight_lookup 部分索引"""
+        query = select(ProcessingRecord).where(
+            ProcessingRecord.status.in_(INFLIGHT_STATUSES),
+            ProcessingRecord.updated_at >= since,
+            *self._match_request(file_hash, **params)
+        ).order_by(ProcessingRecord.id).limit(1)
+        return (await db.execute(query)).scalars().first()
+
+    async def lock_request(self, db: AsyncSession, file_hash: str, **params):
+        """
+        事务级 advisory lock (只在 PostgreSQL 上): 同一请求的查重与创建记录串行执行，
+        并发上传同一文件时只有一个请求创建记录并提交 RunPod 任务。事务结束时自动释放。
+        """
+        if db.bind.dialect.name != "postgresql":
+            return
+        key = ":".join([
+            self.service_type,
+            file_hash,
+            *(str(params[name]) for name in self.cache_params),
+            self.params_fingerprint(**params) or ""
+        ])
+        await db.execute(select(func.pg_advisory_xact_lock(func.hashtext(key))))
+
+    async def create_record(
+        self,
+        db: AsyncSession,
+        file_hash: str,
+        original_filename: str,
+        input_s3_url: str,
+        tenant: Optional[str] = None,
+        input_bytes: Optional[int] = None,
+        input_duration: Optional[float] = None,
+        **params
+    ) -> ProcessingRecord:
+        """创建新的处理记录"""
+        logger.info("创建数据库记录: service=%s, file_hash=%s, filename=%s", self.service_type, file_hash, original_filename)
+        try:
+            record = ProcessingRecord(
+                file_hash=file_hash,
+                original_filename=original_filename,
+                service_type=self.service_type,
+                input_s3_url=input_s3_url,
+                status="processing",
+                params_fingerprint=self.params_fingerprint(**params),
+                tenant=tenant,
+                input_bytes=input_bytes,
+                input_duration=input_duration,
+                **{name: params[name] for name in self.cache_params}
+            )
+            db.add(record)
+            # flush 的 INSERT 带 RETURNING id，created_at 等默认值在 Python 端生成，无需再 refresh
+            await db.flush()
+            logger.info("✅ 数据库记录创建成功，ID: %s", record.id)
+            return record
+        except Exception as e:
+            logger.error("❌ 创建数据库记录失败: %s", e, exc_info=True)
+            await db.rollback()
+            raise Exception(f"创建记录失败: {e}")
+
+    def build_input(self, audio_url: str, **params) -> Dict[str, Any]:
+        """构造 RunPod input"""
+        return {
+            "audio_url": audio_url,
+            **{name: params[name] for name in self.input_params if name in params}
+        }
+
+    async def submit_job(self, audio_url: str, **params) -> str:
+        """提交任务到 RunPod，返回 job_id"""
+        payload = {"input": self.build_input(audio_url, **params)}
+
+        logger.info("提交任务到 RunPod API: %s", self.endpoint)
+        logger.debug("请求参数: %s", payload)
+
+        async with httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=10.0)) as client:
+            try:
+                response = await client.post(
+                    self.endpoint,
+                    headers=self.headers,
+                    json=payload
+                )
+                logger.debug("RunPod API 响应状态码: %s", response.status_code)
+                response.raise_for_status()
+                result = response.json()
+                job_id = result.get("id")
+                status = result.get("status")
+                logger.info("✅ 任务提交成功，Job ID: %s, 状态: %s", job_id, status)
+                return job_id
+            except Exception as e:
+                logger.error("❌ 提交任务失败: %s", e, exc_info=True)
+                raise
+
+    async def run_sync(self, audio_url: str, wait: float, **params) -> Dict[str, Any]:
+        """
+        通过 /runsync 提交并在 RunPod 端等待最多 wait 秒，省去 /run 之后的轮询间隔。
+        完成时返回最终状态 (同 wait_for_completion)；未完成时返回的状态只有 id 与 IN_QUEUE / IN_PROGRESS，
+        由调用方按 job_id 继续轮询。任务失败时抛出 RunPodJobError。
+        """
+        payload = {"input": self.build_input(audio_url, **params)}
+        runsync_url = f"{self.endpoint.rsplit('/', 1)[0]}/runsync"
+        logger.info("同步提交任务到 RunPod API: %s, 最多等待 %ss", runsync_url, wait)
+
+        async with httpx.AsyncClient(timeout=httpx.Timeout(wait + 30.0, connect=10.0)) as client:
+            response = await client.post(
+                runsync_url,
+                headers=self.headers,
+                params={"wait": int(wait * 1000)},
+                json=payload
+            )
+            response.raise_for_status()
+            result = response.json()
+
+        result["pollCount"] = 0
+        status = result.get("status")
+        if status == "COMPLETED":
+            logger.info("✅ 任务同步完成！Job ID: %s", result.get("id"))
+            record_stage("queue", result.get("delayTime", 0))
+            record_stage("exec", result.get("executionTime", 0))
+        elif status == "FAILED":
+            error_msg = result.get("error", "未知错误")
+            logger.error("❌ 任务失败: %s", error_msg)
+            raise RunPodJobError(f"RunPod 任务失败: {error_msg}", result)
+        return result
+
+    async def check_job_status(self, job_id: str) -> Dict[str, Any]:
+        """检查任务状态"""
+        status_url = f"{self.endpoint.rsplit('/', 1)[0]}/status/{job_id}"
+
+        async with httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=10.0)) as client:
+            try:
+                response = await client.get(
+                    status_url,
+                    headers=self.headers
+                )
+                response.raise_for_status()
+                result = response.json()
+                return result
+            except Exception as e:
+                logger.error("❌ 查询任务状态失败: %s", e)
+                raise
+
+    async def wait_for_completion(
+        self,
+        job_id: str,
+        max_wait_time: int = 300,
+        poll_interval: int = 10
+    ) -> Dict[str, Any]:
+        """等待任务完成，轮询检查状态"""
+        logger.info("开始等待任务完成，Job ID: %s, 最大等待时间: %ss", job_id, max_wait_time)
+
+        elapsed_time = 0
+        polls = 0
+        while elapsed_time < max_wait_time:
+            result = await self.check_job_status(job_id)
+            polls += 1
+            result["pollCount"] = polls
+            status = result.get("status")
+
+            logger.info("任务状态: %s, 已等待: %ss", status, elapsed_time, extra=SAMPLED)
+
+            if status == "COMPLETED":
+                logger.info("✅ 任务完成！Job ID: %s", job_id)
+                record_stage("queue", result.get("delayTime", 0))
+                record_stage("exec", result.get("executionTime", 0))
+                return result
+            elif status == "FAILED":
+                error_msg = result.get("error", "未知错误")
+                logger.error("❌ 任务失败: %s", error_msg)
+                raise RunPodJobError(f"RunPod 任务失败: {error_msg}", result)
+            elif status in TERMINAL_STATUSES:
+                # CANCELLED / TIMED_OUT: 任务已结束，不再轮询
+                logger.error("❌ 任务已终止: %s", status)
+                raise RunPodJobError(f"RunPod 任务已终止: {status}", result)
+            elif status in ["IN_QUEUE", "IN_PROGRESS"]:
+                logger.debug("⏳ 任务处理中，%s秒后重试...", poll_interval, extra=SAMPLED)
+                await asyncio.sleep(poll_interval)
+                elapsed_time += poll_interval
+            else:
+                logger.warning("⚠️ 未知状态: %s", status)
+                await asyncio.sleep(poll_interval)
+                elapsed_time += poll_interval
+
+        raise RunPodJobError(f"任务超时：等待 {max_wait_time} 秒后仍未完成", {"pollCount": polls})
+
+    async def cancel_job(self, job_id: str):
+        """取消仍在排队或运行的任务，停止占用 GPU"""
+        cancel_url = f"{self.endpoint.rsplit('/', 1)[0]}/cancel/{job_id}"
+        async with httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=10.0)) as client:
+            response = await client.post(cancel_url, headers=self.headers)
+            response.raise_for_status()
+        logger.info("已取消 RunPod 任务: %s", job_id)
+
+    async def process_audio(self, audio_url: str, **params) -> Dict[str, Any]:
+        """提交任务并等待完成"""
+        job_id = await self.submit_job(audio_url, **params)
+        result = await self.wait_for_completion(job_id)
+        return result
+
+    def build_output_data(self, output: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """从 RunPod output 中提取额外保存到 output_data 的数据，默认不保存"""
+        return None
+
+    async def update_record_success(
+        self,
+        db: AsyncSession,
+        record: ProcessingRecord,
+        result: Dict[str, Any]
+    ):
+        """更新记录为成功状态"""
+        logger.debug("更新记录为成功状态，记录ID: %s", record.id)
+        output = result.get("output", {})
+        await self._update_record(db, record, {
+            "status": "completed",
+            "output_s3_url": output.get(self.output_url_key),
+            "output_data": self.build_output_data(output),
+            "runpod_job_id": result.get("id"),
+            "processing_time": (
+                result.get("executionTime", 0) + result.get("delayTime", 0)
+            ) / 1000.0,
+            **job_accounting(result)
+        })
+        logger.info("✅ 记录更新成功，结果 URL: %s, 处理时间: %ss", record.output_s3_url, record.processing_time)
+
+    async def update_record_failure(
+        self,
+        db: AsyncSession,
+        record: ProcessingRecord,
+        error_message: str,
+        result: Optional[Dict[str, Any]] = None,
+        kind: str = TRANSIENT_FAILURE
+    ):
+        """更新记录为失败状态；result 为失败任务最后的状态时一并记录用量"""
+        logger.warning("更新记录为失败状态，记录ID: %s, 错误: %s (%s)", record.id, error_message, kind)
+        await self._update_record(db, record, {
+            "status": "failed",
+            "error_message": error_message,
+            "failure_kind": kind,
+            **job_accounting(result)
+        })
+        logger.debug("记录失败状态已保存")
+
+    async def update_record_handed_off(
+        self,
+        db: AsyncSession,
+        record: ProcessingRecord,
+        job_id: str
+    ):
+        """进程关闭前把仍在 RunPod 上运行的任务交给后台 (JobResumer) 继续轮询"""
+        await self._update_record(db, record, {
+            "status": "handed_off",
+            "runpod_job_id": job_id
+        })
+
+    async def _update_record(
+        self,
+        db: AsyncSession,
+        record: ProcessingRecord,
+        values: Dict[str, Any]
+    ):
+        """
+        按主键更新记录。record 可以来自已关闭的会话 (处理流程各阶段使用各自的短会话)。
+        写后缓冲运行时交给缓冲批量写入并等待提交，否则直接在 db 上更新并提交；
+        更新后的值 (含 RETURNING 的 updated_at) 同步回 record 对象，无需再 refresh。
+        """
+        record_writer = get_record_writer()
+        if record_writer.running:
+            row = await record_writer.update(record.id, values)
+        else:
+            result = await db.execute(
+                update(ProcessingRecord)
+                .where(ProcessingRecord.id == record.id)
+                .values(**values)
+                .returning(ProcessingRecord.updated_at)
+            )
+            row = dict(result.one()._mapping)
+            await db.commit()
+        for key, value in {**values, **(row or {})}.items():
+            setattr(record, key, value)
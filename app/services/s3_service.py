@@ -1,19 +1,27 @@
-import aioboto3
 from botocore.exceptions import ClientError
 import hashlib
 import uuid
 import asyncio
+from functools import lru_cache
 from math import ceil
 import logging
+from typing import AsyncIterator, List, Optional
+import httpx
 from app.config import get_settings
-
-settings = get_settings()
+from app.services.disk_cache import get_disk_cache
 
 logger = logging.getLogger(__name__)
 
+# 按内容 (文件哈希) 寻址或只写一次的 key 前缀: 对象内容不会变化，按 URL 下载时可以放心缓存
+CONTENT_ADDRESSED_PREFIXES = ("outputs/", "stems/", "derived/", "chunked/", "normalized/", "sources/")
+
 
 class S3Service:
     def __init__(self):
+        # aioboto3 (连带 aiobotocore / aiohttp) 导入较慢，推迟到创建实例时
+        import aioboto3
+
+        settings = get_settings()
         # 初始化 AWS Session
         self.session = aioboto3.Session(
             aws_access_key_id=settings.aws_access_key_id,
@@ -21,6 +29,13 @@ class S3Service:
             region_name=settings.aws_region
         )
         self.bucket_name = settings.s3_bucket_name
+        self.endpoint_url = settings.s3_endpoint_url
+        self.region = settings.aws_region
+        # 节点本地的磁盘缓存 (未开启时为 None)，读写对象与下载结果时都经过它
+        self.cache = get_disk_cache()
+
+    def _client(self):
+        return self.session.client("s3", endpoint_url=self.endpoint_url)
 
     def calculate_file_hash(self, file_content: bytes) -> str:
         """计算文件 MD5，用于去重 / 快速比对"""
@@ -33,26 +48,44 @@ class S3Service:
 
     def get_file_url(self, s3_key: str) -> str:
         """根据 key 返回文件 URL（保持原行为）"""
-        return f"https://{self.bucket_name}.s3.{settings.aws_region}.amazonaws.com/{s3_key}"
+        if self.endpoint_url:
+            return f"{self.endpoint_url.rstrip('/')}/{self.bucket_name}/{s3_key}"
+        return f"https://{self.bucket_name}.s3.{self.region}.amazonaws.com/{s3_key}"
+
+    def key_from_url(self, url: str) -> Optional[str]:
+        """get_file_url() 的逆操作；不是本存储桶的 URL 时返回 None"""
+        prefix = self.get_file_url("")
+        if url and url.startswith(prefix):
+            return url[len(prefix):].split("?", 1)[0] or None
+        return None
+
+    def content_key(self, url: str) -> Optional[str]:
+        """URL 指向本存储桶中按内容寻址的对象时返回其 key，否则 (如 RunPod 输出、url2mp3/ 输入) 返回 None"""
+        key = self.key_from_url(url)
+        if key is not None and key.startswith(CONTENT_ADDRESSED_PREFIXES):
+            return key
+        return None
 
     async def check_file_exists(self, s3_key: str) -> bool:
         """
         异步检查文件是否存在于 S3。
         用 head_object 是官方推荐方式，不会产生下载流量。
         """
+        if self.cache is not None and await asyncio.to_thread(self.cache.path, s3_key):
+            return True
         try:
-            async with self.session.client("s3") as s3:
+            async with self._client() as s3:
                 await s3.head_object(Bucket=self.bucket_name, Key=s3_key)
-                logger.info(f"[S3] 文件存在: {s3_key}")
+                logger.debug("[S3] 文件存在: %s", s3_key)
                 return True
         except ClientError as e:
             if e.response["Error"]["Code"] == "404":
-                logger.warning(f"[S3] 文件不存在: {s3_key}")
+                logger.debug("[S3] 文件不存在: %s", s3_key)
                 return False
-            logger.error(f"[S3] 无法检查文件是否存在: {e}")
+            logger.error("[S3] 无法检查文件是否存在: %s", e)
             return False
 
-    async def _multipart_upload(self, file_content: bytes, key: str, content_type: str):
+    async def _multipart_upload(self, file_content: bytes, key: str, content_type: str, extra_args: dict):
         """
         多分块并发上传（大文件 10~20倍加速）
         分块大小默认 5MB。
@@ -60,15 +93,16 @@ class S3Service:
         part_size = 5 * 1024 * 1024
         total_parts = ceil(len(file_content) / part_size)
 
-        logger.info(f"[S3] 开始 multipart 上传: key={key}, 大小={len(file_content)/1024/1024:.2f}MB, 分块={total_parts}")
+        logger.info("[S3] 开始 multipart 上传: key=%s, 大小=%.2fMB, 分块=%s", key, len(file_content) / 1024 / 1024, total_parts)
 
-        async with self.session.client("s3") as s3:
+        async with self._client() as s3:
 
             # 创建一个 multipart upload session
             mpu = await s3.create_multipart_upload(
                 Bucket=self.bucket_name,
                 Key=key,
-                ContentType=content_type
+                ContentType=content_type,
+                **extra_args
             )
             upload_id = mpu["UploadId"]
 
@@ -82,7 +116,7 @@ class S3Service:
                     UploadId=upload_id,
                     Body=chunk
                 )
-                logger.debug(f"[S3] part {part_number}/{total_parts} 上传完成")
+                logger.debug("[S3] part %s/%s 上传完成", part_number, total_parts)
                 return {"PartNumber": part_number, "ETag": resp["ETag"]}
 
             # 控制并发（最多 10 个）
@@ -108,47 +142,188 @@ class S3Service:
                 MultipartUpload={"Parts": sorted(parts, key=lambda x: x["PartNumber"])}
             )
 
-        logger.info(f"[S3] multipart 上传完成: key={key}")
+        logger.info("[S3] multipart 上传完成: key=%s", key)
 
     async def upload_file(
         self,
         file_content: bytes,
         folder: str,
         extension: str,
-        content_type: str = "audio/mpeg"
+        content_type: str = "audio/mpeg",
+        file_hash: Optional[str] = None,
+        s3_key: Optional[str] = None,
+        cache_control: Optional[str] = None,
+        write_through: bool = False
     ) -> tuple[str, str]:
         """
         上传文件到 S3（自动优化小文件 & 大文件加速）
+        调用方已算过哈希时可通过 file_hash 传入，避免重复计算；
+        指定 s3_key 时使用固定 key (如按内容寻址的文件)，否则在 folder 下生成唯一 key；
+        cache_control 写入对象的 Cache-Control (内容不会变化的文件可设为 immutable，供 CDN / 浏览器长期缓存)；
+        write_through 时同时写入磁盘缓存，只用于按内容寻址、之后还会由本服务读取的对象 (音轨、派生压缩包、outputs/)，
+        只交给 RunPod 读取的输入文件不写入，避免挤掉热点内容
         """
 
-        file_hash = self.calculate_file_hash(file_content)
-        s3_key = self.generate_s3_key(folder, extension)
+        if file_hash is None:
+            file_hash = self.calculate_file_hash(file_content)
+        if s3_key is None:
+            s3_key = self.generate_s3_key(folder, extension)
 
-        logger.info(f"[S3] 开始上传: key={s3_key}, 大小={len(file_content)} bytes")
+        logger.info("[S3] 开始上传: key=%s, 大小=%s bytes", s3_key, len(file_content))
+        extra_args = {"CacheControl": cache_control} if cache_control else {}
 
         try:
             # 小文件 <5MB → put_object（更快）
             if len(file_content) < 5 * 1024 * 1024:
-                async with self.session.client('s3') as s3:
+                async with self._client() as s3:
                     await s3.put_object(
                         Bucket=self.bucket_name,
                         Key=s3_key,
                         Body=file_content,
-                        ContentType=content_type
+                        ContentType=content_type,
+                        **extra_args
                     )
-                logger.info(f"[S3] 小文件上传完成: {s3_key}")
+                logger.info("[S3] 小文件上传完成: %s", s3_key)
 
             else:
                 # 大文件 → multipart upload
-                await self._multipart_upload(file_content, s3_key, content_type)
+                await self._multipart_upload(file_content, s3_key, content_type, extra_args)
 
+            if write_through and self.cache is not None:
+                await asyncio.to_thread(self.cache.put, s3_key, file_content)
             s3_url = self.get_file_url(s3_key)
             return s3_url, file_hash
 
         except ClientError as e:
-            logger.error(f"[S3] 上传失败: {e}")
+            logger.error("[S3] 上传失败: %s", e)
             raise Exception(f"S3 上传失败: {str(e)}")
 
 
-# 全局实例
-s3_service = S3Service()
+    async def presign_url(self, s3_key: str, expires_in: int = 3600) -> str:
+        """生成临时下载链接 (不产生请求，只在本地签名)"""
+        async with self._client() as s3:
+            return await s3.generate_presigned_url(
+                "get_object",
+                Params={"Bucket": self.bucket_name, "Key": s3_key},
+                ExpiresIn=expires_in
+            )
+
+    async def read_object(self, s3_key: str) -> Optional[bytes]:
+        """读取整个对象，不存在时返回 None"""
+        if self.cache is not None:
+            content = await asyncio.to_thread(self.cache.read, s3_key)
+            if content is not None:
+                return content
+        try:
+            async with self._client() as s3:
+                response = await s3.get_object(Bucket=self.bucket_name, Key=s3_key)
+                async with response["Body"] as body:
+                    content = await body.read()
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put, s3_key, content)
+        return content
+
+    async def iter_object(self, s3_key: str, chunk_size: int = 8 * 1024 * 1024) -> AsyncIterator[bytes]:
+        """按 Range 分块读取对象，内存中最多只有一个分块；开启磁盘缓存时读取本地文件，未命中时边读边写入缓存"""
+        if self.cache is None:
+            async for chunk in self._iter_s3_object(s3_key, chunk_size):
+                yield chunk
+            return
+
+        cached = await asyncio.to_thread(self.cache.open, s3_key)
+        if cached is not None:
+            try:
+                for offset in range(0, cached.size, chunk_size):
+                    yield await asyncio.to_thread(cached.read, offset, chunk_size)
+            finally:
+                cached.close()
+            return
+
+        pending = await asyncio.to_thread(self.cache.writer, s3_key)
+        try:
+            async for chunk in self._iter_s3_object(s3_key, chunk_size):
+                await asyncio.to_thread(pending.write, chunk)
+                yield chunk
+        except BaseException:
+            # 读取中断 (包括客户端断开导致生成器关闭) 时丢弃写了一半的文件
+            await asyncio.to_thread(pending.abort)
+            raise
+        await asyncio.to_thread(pending.commit)
+
+    async def local_path(self, s3_key: str) -> Optional[str]:
+        """对象在磁盘缓存中的路径 (未命中时先下载)，未开启磁盘缓存时返回 None"""
+        if self.cache is None:
+            return None
+        path = await asyncio.to_thread(self.cache.path, s3_key)
+        if path is None:
+            async for _ in self.iter_object(s3_key):
+                pass
+            path = await asyncio.to_thread(self.cache.path, s3_key)
+        return path
+
+    async def _iter_s3_object(self, s3_key: str, chunk_size: int) -> AsyncIterator[bytes]:
+        async with self._client() as s3:
+            offset = 0
+            total = None
+            while total is None or offset < total:
+                response = await s3.get_object(
+                    Bucket=self.bucket_name,
+                    Key=s3_key,
+                    Range=f"bytes={offset}-{offset + chunk_size - 1}"
+                )
+                # Content-Range: bytes 0-8388607/123456789
+                total = int(response["ContentRange"].rsplit("/", 1)[-1])
+                async with response["Body"] as body:
+                    chunk = await body.read()
+                if not chunk:
+                    break
+                offset += len(chunk)
+                yield chunk
+
+    async def download_to_file(self, url: str, path: str, chunk_size: int = 8 * 1024 * 1024):
+        """
+        把 URL 指向的文件分块写入本地文件，内存中最多只有一个分块。
+        本存储桶中按内容寻址的对象经 iter_object 读取 (使用磁盘缓存)，其他 URL 直接流式下载
+        """
+        key = self.content_key(url)
+        f = await asyncio.to_thread(open, path, "wb")
+        try:
+            if key is not None:
+                async for chunk in self.iter_object(key, chunk_size):
+                    await asyncio.to_thread(f.write, chunk)
+                return
+            async with httpx.AsyncClient(timeout=httpx.Timeout(120.0, connect=10.0)) as client:
+                async with client.stream("GET", url) as response:
+                    response.raise_for_status()
+                    async for chunk in response.aiter_bytes(chunk_size):
+                        await asyncio.to_thread(f.write, chunk)
+        finally:
+            await asyncio.to_thread(f.close)
+
+    async def download_urls(self, urls: List[str]) -> List[bytes]:
+        """并发下载一组结果文件 (RunPod 输出与本服务上传的对象都可以按 URL 直接访问)"""
+        async with httpx.AsyncClient(timeout=httpx.Timeout(120.0, connect=10.0)) as client:
+            async def download(url: str) -> bytes:
+                # 只有按内容寻址的对象 (按 S3 key) 读写缓存；其他 URL 的内容可能变化或只用一次，每次都下载
+                cache_key = self.content_key(url) if self.cache is not None else None
+                if cache_key is not None:
+                    content = await asyncio.to_thread(self.cache.read, cache_key)
+                    if content is not None:
+                        return content
+                response = await client.get(url)
+                response.raise_for_status()
+                if cache_key is not None:
+                    await asyncio.to_thread(self.cache.put, cache_key, response.content)
+                return response.content
+
+            return list(await asyncio.gather(*(download(url) for url in urls)))
+
+
+@lru_cache
+def get_s3_service() -> S3Service:
+    """S3 服务 (首次调用时创建，可通过 FastAPI 依赖注入替换)"""
+    return S3Service()
@@ -0,0 +1,408 @@
+import asyncio
+import io
+import logging
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from sqlalchemy import select
+from app.config import get_settings
+from app.database import read_session_scope, session_scope
+from app.models import ProcessingRecord, StemArtifact
+from app.services.audio_normalizer import run_process
+from app.services.delivery import IMMUTABLE_CACHE_CONTROL
+from app.services.s3_service import S3Service, get_s3_service
+
+logger = logging.getLogger(__name__)
+
+# Spleeter 各布局 (stems 参数) 输出的音轨
+STEM_LAYOUTS: Dict[int, Tuple[str, ...]] = {
+    2: ("vocals", "accompaniment"),
+    4: ("vocals", "drums", "bass", "other"),
+    5: ("vocals", "drums", "bass", "piano", "other"),
+}
+
+# (目标布局, 源布局) → {目标音轨: 由哪些源音轨相加得到}
+# Spleeter 各音轨的掩码之和为 1，同一次分离的非人声音轨相加即为伴奏
+STEM_MIXES: Dict[Tuple[int, int], Dict[str, Tuple[str, ...]]] = {
+    (2, 4): {"vocals": ("vocals",), "accompaniment": ("drums", "bass", "other")},
+    (2, 5): {"vocals": ("vocals",), "accompaniment": ("drums", "bass", "piano", "other")},
+    (4, 5): {"vocals": ("vocals",), "drums": ("drums",), "bass": ("bass",), "other": ("piano", "other")},
+}
+
+# 单轨下载支持的格式 → (Content-Type, 是否使用比特率)
+STEM_FORMATS: Dict[str, Tuple[str, bool]] = {
+    "mp3": ("audio/mpeg", True),
+    "ogg": ("audio/ogg", True),
+    "wav": ("audio/wav", False),
+    "flac": ("audio/flac", False),
+}
+
+# 有损格式的比特率，如 128k / 192k / 320k
+BITRATE_PATTERN = re.compile(r"^\d{2,3}k$")
+
+
+def stem_mix(layout: int, source: int) -> Optional[Dict[str, Tuple[str, ...]]]:
+    """由 source 布局得到 layout 布局的混合方式；布局相同时各音轨原样使用 (只转换编码)"""
+    if layout == source:
+        return {stem: (stem,) for stem in STEM_LAYOUTS[layout]}
+    return STEM_MIXES.get((layout, source))
+
+
+def stem_name(path: str) -> str:
+    """由文件路径得到音轨名，如 output/vocals.mp3 → vocals"""
+    return posixpath.splitext(posixpath.basename(path))[0].lower()
+
+
+def variant_bitrate(format: Optional[str], bitrate: Optional[str]) -> Optional[str]:
+    """无损格式不区分比特率"""
+    if format in STEM_FORMATS and not STEM_FORMATS[format][1]:
+        return None
+    return bitrate
+
+
+def record_artifacts(record: ProcessingRecord, derived: bool = False) -> List[StemArtifact]:
+    """记录结果 ZIP 中各音轨对应的 StemArtifact (未保存)，结果不是有效的音轨布局时为空"""
+    output_data = record.output_data or {}
+    if not record.output_s3_url or record.stems not in STEM_LAYOUTS:
+        return []
+    format = output_data.get("format")
+    artifacts = []
+    for entry in output_data.get("files") or []:
+        # Spleeter 的文件列表元素为 {"name": ..., "size_kb": ...} 或文件名
+        member = entry.get("name") if isinstance(entry, dict) else entry
+        if not member or stem_name(member) not in STEM_LAYOUTS[record.stems]:
+            continue
+        artifacts.append(StemArtifact(
+            file_hash=record.file_hash,
+            layout=record.stems,
+            stem=stem_name(member),
+            format=format,
+            bitrate=variant_bitrate(format, output_data.get("bitrate")),
+            s3_url=record.output_s3_url,
+            archive_member=member,
+            size_kb=entry.get("size_kb") if isinstance(entry, dict) else None,
+            record_id=record.id,
+            derived=derived
+        ))
+    return artifacts
+
+
+def stem_object_key(file_hash: str, layout: int, stem: str, format: str, bitrate: Optional[str]) -> str:
+    """单轨文件按源文件哈希、布局与编码存放，不同格式 / 比特率互不覆盖"""
+    return f"stems/{file_hash}/{layout}/{stem}-{bitrate or 'lossless'}.{format}"
+
+
+class StemStore:
+    """
+    Spleeter 音轨级缓存
+
+    - register(): 把一条已完成记录的各音轨 (output_data["files"]) 登记为 StemArtifact
+    - derive(): 由同一文件已有的其他编码或更多音轨的结果 (如 4 轨 MP3) 在 CPU 上用 ffmpeg
+      转换 / 混合出请求的编码与布局 (如 2 轨 WAV)，打包为 ZIP，不调用 RunPod
+    - stem_files(): 把结果拆成单独存放的音轨文件 (按格式 / 比特率各存一份)，供单轨下载和按需打包
+    """
+
+    def __init__(
+        self,
+        s3: S3Service,
+        ffmpeg_path: str = "ffmpeg",
+        derive_enabled: bool = True,
+        max_concurrency: int = 0,
+        timeout: float = 300
+    ):
+        self.s3 = s3
+        self.ffmpeg_path = shutil.which(ffmpeg_path)
+        self.derive_enabled = derive_enabled
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency or os.cpu_count() or 1)
+        if self.ffmpeg_path is None:
+            logger.warning("⚠️ 未找到 ffmpeg (%s)，音轨派生与格式转换不可用", ffmpeg_path)
+
+    @property
+    def can_derive(self) -> bool:
+        return self.derive_enabled and self.ffmpeg_path is not None
+
+    async def register(self, record: ProcessingRecord, derived: bool = False):
+        """登记记录结果 ZIP 中的各音轨"""
+        artifacts = record_artifacts(record, derived)
+        if not artifacts:
+            return
+        async with session_scope() as db:
+            db.add_all(artifacts)
+            await db.commit()
+        logger.debug("登记音轨: 记录ID %s, %s", record.id, [artifact.stem for artifact in artifacts])
+
+    async def _artifacts(self, file_hash: str, layouts: List[int]) -> List[StemArtifact]:
+        """最新登记的在前"""
+        async with read_session_scope() as db:
+            return list((await db.scalars(
+                select(StemArtifact)
+                .where(StemArtifact.file_hash == file_hash, StemArtifact.layout.in_(layouts))
+                .order_by(StemArtifact.id.desc())
+            )).all())
+
+    async def find_source(
+        self,
+        file_hash: str,
+        layout: int,
+        format: Optional[str] = None,
+        bitrate: Optional[str] = None
+    ) -> Optional[Tuple[int, Dict[str, StemArtifact]]]:
+        """
+        查找可以派生出 layout 布局的已有音轨，返回 (源布局, {音轨名: StemArtifact})。
+        优先选择相同布局 (只需转换编码)，其次音轨少的布局；同一组音轨的编码一致，优先与请求的编码相同。
+        """
+        if layout not in STEM_LAYOUTS:
+            return None
+        sources = [layout] + sorted(source for target, source in STEM_MIXES if target == layout)
+        artifacts = await self._artifacts(file_hash, sources)
+        for source in sources:
+            groups: Dict[Tuple[Optional[str], Optional[str]], Dict[str, StemArtifact]] = {}
+            for artifact in artifacts:
+                if artifact.layout == source:
+                    groups.setdefault((artifact.format, artifact.bitrate), {}).setdefault(artifact.stem, artifact)
+            complete = [
+                (encoding, found) for encoding, found in groups.items()
+                if all(stem in found for stem in STEM_LAYOUTS[source])
+            ]
+            complete.sort(key=lambda item: item[0] != (format, bitrate))
+            if complete:
+                return source, complete[0][1]
+        return None
+
+    async def derive(
+        self,
+        file_hash: str,
+        layout: int,
+        source: int,
+        artifacts: Dict[str, StemArtifact],
+        format: Optional[str] = None,
+        bitrate: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        转换 / 混合出 layout 布局的音轨并上传 ZIP，返回 Spleeter output 格式的结果。
+        format 为空时沿用源音轨的编码。
+        """
+        started = time.perf_counter()
+        stems = await self._read_stems(artifacts)
+        first = next(iter(artifacts.values()))
+        source_format = first.format or posixpath.splitext(first.archive_member or first.s3_url)[1].lstrip(".") or "wav"
+        if format is None:
+            format, bitrate = source_format, first.bitrate
+        same_encoding = (source_format, first.bitrate) == (format, bitrate)
+        folder = posixpath.dirname(first.archive_member or "")
+
+        async def build(target: str, inputs: Tuple[str, ...]) -> Tuple[str, bytes]:
+            name = posixpath.join(folder, f"{target}.{format}")
+            if len(inputs) == 1 and same_encoding:
+                return name, stems[inputs[0]]
+            # 多条音轨按原电平相加 (不做归一化)
+            return name, await self._encode([stems[stem] for stem in inputs], format, bitrate)
+
+        merged = await asyncio.gather(*(
+            build(target, inputs) for target, inputs in stem_mix(layout, source).items()
+        ))
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+            for name, content in merged:
+                archive.writestr(name, content)
+        content = buffer.getvalue()
+        url, _ = await self.s3.upload_file(
+            file_content=content,
+            folder="derived",
+            extension="zip",
+            content_type="application/zip",
+            file_hash=file_hash,
+            s3_key=f"derived/{file_hash}/spleeter-stems{layout}-{bitrate or 'lossless'}.{format}.zip",
+            cache_control=IMMUTABLE_CACHE_CONTROL,
+            write_through=True
+        )
+        logger.info(
+            "✅ 由 %s 轨 %s 结果派生 %s 轨 %s: %s, 耗时 %.2fs",
+            source, first.format, layout, format, file_hash, time.perf_counter() - started
+        )
+        return {
+            "download_url": url,
+            "files": [{"name": name, "size_kb": round(len(data) / 1024, 2)} for name, data in merged],
+            "size_mb": round(len(content) / 1024 / 1024, 2),
+            "bitrate": bitrate,
+            "format": format
+        }
+
+    async def stem_files(
+        self,
+        record: ProcessingRecord,
+        format: Optional[str] = None,
+        bitrate: Optional[str] = None
+    ) -> List[StemArtifact]:
+        """
+        返回记录各音轨单独存放的文件 (按布局中的顺序)。format / bitrate 默认与分离结果相同。
+        第一次请求某个格式时从结果 ZIP (或已拆分的其他格式) 中取出音轨，需要时用 ffmpeg 转换，再逐个上传。
+        """
+        output_data = record.output_data or {}
+        format = (format or output_data.get("format") or "mp3").lower()
+        if format not in STEM_FORMATS:
+            raise ValueError(f"不支持的格式: {format}，可选: {', '.join(STEM_FORMATS)}")
+        if bitrate and not BITRATE_PATTERN.match(bitrate.lower()):
+            raise ValueError(f"比特率格式无效: {bitrate}，如 192k")
+        bitrate = variant_bitrate(format, bitrate or output_data.get("bitrate"))
+        layout = STEM_LAYOUTS[record.stems]
+
+        artifacts = await self._artifacts(record.file_hash, [record.stems])
+        if not artifacts:
+            # 音轨级缓存上线之前完成的记录
+            await self.register(record)
+            artifacts = await self._artifacts(record.file_hash, [record.stems])
+
+        chosen: Dict[str, StemArtifact] = {}
+        sources: Dict[str, StemArtifact] = {}
+        for artifact in artifacts:
+            if artifact.s3_key and artifact.format == format and artifact.bitrate == bitrate:
+                chosen.setdefault(artifact.stem, artifact)
+            # 转换的来源优先使用分离时的原始编码
+            current = sources.get(artifact.stem)
+            if current is None or (current.format != output_data.get("format") and artifact.format == output_data.get("format")):
+                sources[artifact.stem] = artifact
+        missing = [stem for stem in layout if stem not in chosen]
+        unavailable = [stem for stem in missing if stem not in sources]
+        if unavailable:
+            raise LookupError(f"结果中缺少音轨: {', '.join(unavailable)}")
+
+        if missing:
+            contents = await self._read_stems({stem: sources[stem] for stem in missing})
+            created = await asyncio.gather(*(
+                self._store_stem(record, sources[stem], contents[stem], format, bitrate) for stem in missing
+            ))
+            async with session_scope() as db:
+                db.add_all(created)
+                await db.commit()
+            chosen.update({artifact.stem: artifact for artifact in created})
+            logger.info("拆分音轨: 记录ID %s, %s, %s %s", record.id, missing, format, bitrate or "")
+        return [chosen[stem] for stem in layout]
+
+    async def _store_stem(
+        self,
+        record: ProcessingRecord,
+        source: StemArtifact,
+        content: bytes,
+        format: str,
+        bitrate: Optional[str]
+    ) -> StemArtifact:
+        if (source.format, source.bitrate) != (format, bitrate):
+            if self.ffmpeg_path is None:
+                raise RuntimeError("未找到 ffmpeg，无法转换音轨格式")
+            content = await self._encode([content], format, bitrate)
+        key = stem_object_key(record.file_hash, record.stems, source.stem, format, bitrate)
+        url, _ = await self.s3.upload_file(
+            file_content=content,
+            folder="stems",
+            extension=format,
+            content_type=STEM_FORMATS[format][0],
+            file_hash=record.file_hash,
+            s3_key=key,
+            cache_control=IMMUTABLE_CACHE_CONTROL,
+            write_through=True
+        )
+        return StemArtifact(
+            file_hash=record.file_hash,
+            layout=record.stems,
+            stem=source.stem,
+            format=format,
+            bitrate=bitrate,
+            s3_url=url,
+            s3_key=key,
+            size_kb=round(len(content) / 1024, 2),
+            record_id=record.id,
+            derived=source.derived
+        )
+
+    def zip_entries(self, artifacts: List[StemArtifact]) -> List[Tuple[str, AsyncIterator[bytes]]]:
+        """按需打包用的 (文件名, 分块读取的内容)"""
+        return [(f"{artifact.stem}.{artifact.format}", self.s3.iter_object(artifact.s3_key)) for artifact in artifacts]
+
+    async def _read_stems(self, artifacts: Dict[str, StemArtifact]) -> Dict[str, bytes]:
+        """
+        读取源音轨: 单独存放的文件直接读取；ZIP 先分块下载到临时文件 (同一个 ZIP 只下载一次)，
+        再逐个解压需要的音轨，内存中不保留整个 ZIP
+        """
+        urls = sorted({artifact.s3_url for artifact in artifacts.values() if not artifact.s3_key})
+        workdir = await asyncio.to_thread(tempfile.mkdtemp, prefix="stems-")
+        try:
+            archives = {url: os.path.join(workdir, f"{index}.zip") for index, url in enumerate(urls)}
+            await asyncio.gather(*(self.s3.download_to_file(url, path) for url, path in archives.items()))
+            contents: Dict[str, bytes] = {}
+            for stem, artifact in artifacts.items():
+                if artifact.s3_key:
+                    contents[stem] = b"".join([chunk async for chunk in self.s3.iter_object(artifact.s3_key)])
+                else:
+                    path = archives[artifact.s3_url]
+                    contents[stem] = await asyncio.to_thread(self._read_member, path, artifact.archive_member)
+        finally:
+            await asyncio.to_thread(shutil.rmtree, workdir, True)
+        return contents
+
+    @staticmethod
+    def _read_member(path: str, member: Optional[str]) -> bytes:
+        """读取 ZIP 中的一个文件；member 为空时文件本身就是音轨"""
+        if not member:
+            with open(path, "rb") as f:
+                return f.read()
+        with zipfile.ZipFile(path) as archive:
+            return archive.read(member)
+
+    async def _encode(self, inputs: List[bytes], extension: str, bitrate: Optional[str]) -> bytes:
+        """用 ffmpeg 编码为指定格式；多个输入时先相加"""
+        workdir = await asyncio.to_thread(tempfile.mkdtemp, prefix="stems-")
+        try:
+            args = [self.ffmpeg_path, "-hide_banner", "-loglevel", "error", "-nostdin"]
+            for index, content in enumerate(inputs):
+                path = os.path.join(workdir, str(index))
+                await asyncio.to_thread(self._write_file, path, content)
+                args += ["-i", path]
+            if len(inputs) > 1:
+                # amix 按输入数平均 (normalize=0 需要较新的 ffmpeg，发行版自带的版本没有)，再用 volume 乘回原电平
+                args += [
+                    "-filter_complex",
+                    f"amix=inputs={len(inputs)}:duration=longest:dropout_transition=0,volume={len(inputs)}"
+                ]
+            args += ["-vn", "-map_metadata", "-1"]
+            if bitrate and variant_bitrate(extension, bitrate):
+                args += ["-b:a", bitrate]
+            # 输出到文件而不是管道: 管道不可寻址，WAV 头中的长度 (以及 FLAC 的总采样数) 无法回填
+            output_path = os.path.join(workdir, f"output.{extension}")
+            args += ["-f", extension, output_path]
+            async with self._semaphore:
+                returncode, _, error = await run_process(args, timeout=self.timeout)
+            output = await asyncio.to_thread(self._read_file, output_path) if returncode == 0 else b""
+        finally:
+            await asyncio.to_thread(shutil.rmtree, workdir, True)
+        if returncode != 0 or not output:
+            raise RuntimeError(f"音轨编码失败: {error.decode(errors='replace').strip()[-300:]}")
+        return output
+
+    @staticmethod
+    def _write_file(path: str, content: bytes):
+        with open(path, "wb") as f:
+            f.write(content)
+
+    @staticmethod
+    def _read_file(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+
+@lru_cache
+def get_stem_store() -> StemStore:
+    settings = get_settings()
+    return StemStore(
+        get_s3_service(),
+        ffmpeg_path=settings.ffmpeg_path,
+        derive_enabled=settings.stem_derive_enabled,
+        max_concurrency=settings.audio_normalize_concurrency
+    )
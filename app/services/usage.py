@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import Integer, case, func, literal, literal_column, select
+from sqlalchemy.dialects.postgresql import insert
+from app.config import get_settings
+from app.database import read_session_scope, session_scope
+from app.models import ProcessingRecord, UsageRollup
+
+logger = logging.getLogger(__name__)
+
+# 报表可用的分组列
+GROUP_COLUMNS = ("bucket", "service_type", "tenant")
+SUM_COLUMNS = (
+    "jobs", "completed", "failed", "queue_seconds", "exec_seconds",
+    "input_bytes", "input_seconds", "poll_count", "cache_hits", "saved_seconds"
+)
+# 重新计算时多往前算的小时数: 跨整点提交的记录 (写后缓冲有延迟) 也能计入所属的小时
+ROLLUP_OVERLAP = timedelta(hours=1)
+# 汇总用的事务级咨询锁: 多个 worker / 定时任务同时汇总时只有一个执行
+ROLLUP_LOCK_KEY = 0x75736167
+
+
+def hour_bucket(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def saved_seconds(record: ProcessingRecord) -> float:
+    """命中该记录节省的 GPU 时间: 之前没有单独记录执行时间的记录按总处理时间估算"""
+    if record.exec_seconds is not None:
+        return record.exec_seconds
+    if record.runpod_job_id and record.processing_time:
+        return record.processing_time
+    return 0.0
+
+
+class UsageRecorder:
+    """
+    缓存命中的用量计数
+
+    命中时只在进程内累加 (不访问数据库)，每隔 flush_interval 按 (小时, 服务, 租户) 合并成一条
+    INSERT ... ON CONFLICT DO UPDATE 加到 usage_rollups。正常关闭 (stop) 时写完积压的计数，进程崩溃时最多丢失一个周期。
+    rollup_interval 大于 0 时同一个后台任务每隔 rollup_interval 执行一次 rollup_usage()，报表接口只读不写。
+    """
+
+    def __init__(self, flush_interval: float = 60, rollup_interval: float = 0):
+        self.flush_interval = flush_interval
+        self.rollup_interval = rollup_interval
+        self._hits: Dict[Tuple[datetime, str, str], List[float]] = defaultdict(lambda: [0, 0.0])
+        self._task: Optional[asyncio.Task] = None
+
+    def record_cache_hit(self, service_type: str, tenant: Optional[str], record: ProcessingRecord):
+        counts = self._hits[(hour_bucket(datetime.utcnow()), service_type, tenant or "")]
+        counts[0] += 1
+        counts[1] += saved_seconds(record)
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        logger.info("用量统计已启动，写入间隔: %ss, 汇总间隔: %ss", self.flush_interval, self.rollup_interval)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+
+    async def _run(self):
+        last_rollup = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning("写入缓存命中统计失败，下个周期重试: %s", e)
+            if self.rollup_interval > 0 and time.monotonic() - last_rollup >= self.rollup_interval:
+                last_rollup = time.monotonic()
+                try:
+                    await rollup_usage()
+                except Exception as e:
+                    logger.warning("用量汇总失败，下个周期重试: %s", e)
+
+    async def flush(self):
+        if not self._hits:
+            return
+        hits, self._hits = self._hits, defaultdict(lambda: [0, 0.0])
+        rows = [
+            {"bucket": bucket, "service_type": service_type, "tenant": tenant, "cache_hits": count, "saved_seconds": saved}
+            for (bucket, service_type, tenant), (count, saved) in hits.items()
+        ]
+        stmt = insert(UsageRollup).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[UsageRollup.bucket, UsageRollup.service_type, UsageRollup.tenant],
+            set_={
+                "cache_hits": UsageRollup.cache_hits + stmt.excluded.cache_hits,
+                "saved_seconds": UsageRollup.saved_seconds + stmt.excluded.saved_seconds,
+            }
+        )
+        try:
+            async with session_scope() as db:
+                await db.execute(stmt)
+                await db.commit()
+        except Exception:
+            # 放回去，下个周期再写
+            for key, (count, saved) in hits.items():
+                self._hits[key][0] += count
+                self._hits[key][1] += saved
+            raise
+        logger.debug("写入缓存命中统计: %s 组", len(rows))
+
+
+async def rollup_usage(now: Optional[datetime] = None) -> int:
+    """
+    增量汇总 processing_records 中已结束的任务: 从上次汇总到的小时 (往前多算 ROLLUP_OVERLAP) 开始，
+    按 finished_at 索引范围扫描，分组后覆盖 usage_rollups 的任务列 (缓存命中列不变)。可重复执行，返回写入的组数。
+    其他进程正在汇总时直接返回 0。
+    """
+    now = now or datetime.utcnow()
+    async with session_scope() as db:
+        if not await db.scalar(select(func.pg_try_advisory_xact_lock(ROLLUP_LOCK_KEY))):
+            logger.info("其他进程正在汇总用量，跳过")
+            return 0
+        last = await db.scalar(select(func.max(UsageRollup.bucket)).where(UsageRollup.rolled_at.is_not(None)))
+        start = last - ROLLUP_OVERLAP if last is not None else None
+
+        # 分组表达式中的常量直接写入 SQL: 作为绑定参数时 SELECT 与 GROUP BY 中的表达式会被视为不同
+        bucket = func.date_trunc(literal_column("'hour'"), ProcessingRecord.finished_at)
+        tenant = func.coalesce(ProcessingRecord.tenant, literal_column("''"))
+        query = (
+            select(
+                bucket.label("bucket"),
+                ProcessingRecord.service_type,
+                tenant.label("tenant"),
+                func.count().label("jobs"),
+                func.sum(case((ProcessingRecord.status == "completed", 1), else_=0)).cast(Integer).label("completed"),
+                func.sum(case((ProcessingRecord.status == "failed", 1), else_=0)).cast(Integer).label("failed"),
+                func.coalesce(func.sum(ProcessingRecord.queue_seconds), 0.0).label("queue_seconds"),
+                func.coalesce(func.sum(ProcessingRecord.exec_seconds), 0.0).label("exec_seconds"),
+                func.coalesce(func.sum(ProcessingRecord.input_bytes), 0).label("input_bytes"),
+                func.coalesce(func.sum(ProcessingRecord.input_duration), 0.0).label("input_seconds"),
+                func.coalesce(func.sum(ProcessingRecord.poll_count), 0).cast(Integer).label("poll_count"),
+                literal(now).label("rolled_at"),
+            )
+            .where(ProcessingRecord.finished_at.is_not(None), ProcessingRecord.finished_at < now)
+            .group_by(bucket, ProcessingRecord.service_type, tenant)
+        )
+        if start is not None:
+            query = query.where(ProcessingRecord.finished_at >= start)
+
+        job_columns = [
+            "bucket", "service_type", "tenant", "jobs", "completed", "failed", "queue_seconds",
+            "exec_seconds", "input_bytes", "input_seconds", "poll_count", "rolled_at"
+        ]
+        stmt = insert(UsageRollup).from_select(job_columns, query)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[UsageRollup.bucket, UsageRollup.service_type, UsageRollup.tenant],
+            set_={name: stmt.excluded[name] for name in job_columns[3:]}
+        )
+        result = await db.execute(stmt)
+        await db.commit()
+    logger.info("用量汇总完成: 从 %s 起, %s 组", start or "最早的记录", result.rowcount)
+    return result.rowcount
+
+
+async def usage_report(
+    start: datetime,
+    end: Optional[datetime] = None,
+    group_by: Sequence[str] = ("service_type",)
+) -> List[Dict[str, Any]]:
+    """按 group_by 汇总 [start, end) 内的用量，只读取 usage_rollups"""
+    unknown = [name for name in group_by if name not in GROUP_COLUMNS]
+    if unknown:
+        raise ValueError(f"不支持的分组: {', '.join(unknown)}")
+    groups = [UsageRollup.__table__.c[name] for name in group_by]
+    query = (
+        select(*groups, *(func.sum(UsageRollup.__table__.c[name]).label(name) for name in SUM_COLUMNS))
+        .where(UsageRollup.bucket >= hour_bucket(start))
+        .group_by(*groups)
+        .order_by(*groups)
+    )
+    if end is not None:
+        query = query.where(UsageRollup.bucket < end)
+    async with read_session_scope() as db:
+        rows = (await db.execute(query)).all()
+
+    report = []
+    for row in rows:
+        item = dict(row._mapping)
+        for name in SUM_COLUMNS:
+            item[name] = item[name] or 0
+        item["avg_queue_seconds"] = round(item["queue_seconds"] / item["jobs"], 3) if item["jobs"] else None
+        item["avg_exec_seconds"] = round(item["exec_seconds"] / item["jobs"], 3) if item["jobs"] else None
+        requests = item["jobs"] + item["cache_hits"]
+        item["cache_hit_rate"] = round(item["cache_hits"] / requests, 4) if requests else None
+        report.append(item)
+    return report
+
+
+@lru_cache
+def get_usage_recorder() -> UsageRecorder:
+    """缓存命中统计 (由应用生命周期启动 / 停止)"""
+    settings = get_settings()
+    return UsageRecorder(
+        flush_interval=settings.usage_flush_interval_s,
+        rollup_interval=settings.usage_rollup_interval_s
+    )
@@ -0,0 +1,58 @@
+import struct
+import time
+import zlib
+from typing import AsyncIterator, List, Tuple
+
+# 单个文件与整个包都不超过 4GB (不使用 ZIP64)，音轨文件远小于该限制
+ZIP_LIMIT = 0xFFFFFFFF
+# 通用标志: bit 3 = 大小与 CRC 写在数据之后 (data descriptor)，bit 11 = 文件名为 UTF-8
+FLAGS = 0x0808
+
+
+def _dos_datetime(timestamp: float) -> Tuple[int, int]:
+    t = time.localtime(timestamp)
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+async def stream_zip(entries: List[Tuple[str, AsyncIterator[bytes]]]) -> AsyncIterator[bytes]:
+    """
+    边读边生成 ZIP (不压缩)，不在内存中缓存整个包。
+    每个文件先写不含大小的本地文件头，数据流完后在 data descriptor 中补上 CRC 与大小，最后写中央目录。
+    """
+    dos_time, dos_date = _dos_datetime(time.time())
+    central = []
+    offset = 0
+    for name, chunks in entries:
+        encoded = name.encode("utf-8")
+        header = struct.pack(
+            "<IHHHHHIIIHH",
+            0x04034B50, 20, FLAGS, 0, dos_time, dos_date, 0, 0, 0, len(encoded), 0
+        ) + encoded
+        yield header
+
+        crc = 0
+        size = 0
+        async for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            yield chunk
+        if size > ZIP_LIMIT:
+            raise ValueError(f"文件过大，无法打包: {name}")
+        yield struct.pack("<IIII", 0x08074B50, crc, size, size)
+
+        central.append((encoded, crc, size, offset))
+        offset += len(header) + size + 16
+        if offset > ZIP_LIMIT:
+            raise ValueError("ZIP 包超过 4GB")
+
+    directory = b"".join(
+        struct.pack(
+            "<IHHHHHHIIIHHHHHII",
+            0x02014B50, 20, 20, FLAGS, 0, dos_time, dos_date, crc, size, size, len(encoded), 0, 0, 0, 0, 0, local_offset
+        ) + encoded
+        for encoded, crc, size, local_offset in central
+    )
+    yield directory
+    yield struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, len(central), len(central), len(directory), offset, 0)
@@ -0,0 +1,195 @@
+"""
+上传检查: 在读完请求体之前拒绝过大或不是音频的上传
+
+UploadGuardMiddleware 只检查处理接口 (POST /api/{服务}/...):
+- Content-Length 超过上限时直接返回 413，不读取请求体；没有 Content-Length (分块传输) 时边读边计数，超过即中止
+- 先读取请求体开头 (最多 PREFIX_BYTES)，按 multipart 格式找到文件部分，根据开头几个字节识别音频格式，不是音频时返回 415
+- 位于文件之前的表单字段 (如 stems) 在此时校验，客户端把参数放在文件之前即可在上传音频前得到 400
+"""
+import logging
+from typing import Dict, List, Optional, Tuple
+from starlette.exceptions import HTTPException
+from app.admission import processing_service, send_error
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# 为识别格式与校验表单字段最多预读的字节数
+PREFIX_BYTES = 64 * 1024
+SNIFF_BYTES = 12
+
+# 各接口在文件之前即可校验的表单字段: {路径: {字段: (允许的值, 错误信息)}}
+FIELD_RULES: Dict[str, Dict[str, Tuple[Tuple[str, ...], str]]] = {
+    "/api/spleeter/separate": {"stems": (("2", "4", "5"), "stems参数必须是 2, 4 或 5")},
+}
+
+
+def sniff_audio(head: bytes) -> Optional[str]:
+    """根据文件开头识别音频容器格式，无法识别时返回 None"""
+    if head.startswith(b"ID3"):
+        return "mp3"
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+    if head[4:8] == b"ftyp":
+        return "m4a"
+    if head.startswith(b"fLaC"):
+        return "flac"
+    if head.startswith(b"OggS"):
+        return "ogg"
+    if head[:4] == b"FORM" and head[8:12] in (b"AIFF", b"AIFC"):
+        return "aiff"
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "webm"
+    # MPEG 音频帧同步 (无 ID3 标签的 MP3) 与 ADTS AAC
+    if len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0:
+        return "mp3" if head[1] & 0x06 else "aac"
+    return None
+
+
+class UploadTooLarge(HTTPException):
+    def __init__(self, max_bytes: int):
+        super().__init__(status_code=413, detail=f"文件过大，最大 {max_bytes / 1024 / 1024:g} MB")
+
+
+def _boundary(content_type: str) -> Optional[bytes]:
+    media_type, _, params = content_type.partition(";")
+    if media_type.strip().lower() != "multipart/form-data":
+        return None
+    for param in params.split(";"):
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "boundary" and value:
+            return value.strip('"').encode("latin-1")
+    return None
+
+
+def _disposition(headers: bytes) -> Dict[str, str]:
+    """Content-Disposition 中的 name / filename"""
+    result = {}
+    for line in headers.split(b"\r\n"):
+        name, _, value = line.partition(b":")
+        if name.strip().lower() != b"content-disposition":
+            continue
+        for param in value.decode("utf-8", "replace").split(";")[1:]:
+            key, _, param_value = param.strip().partition("=")
+            result[key.lower()] = param_value.strip('"')
+    return result
+
+
+def scan_prefix(body: bytes, boundary: bytes) -> Tuple[List[Tuple[str, str]], Optional[bytes], bool]:
+    """
+    解析 multipart 请求体的开头: 返回 (文件之前已完整的表单字段, 文件开头的字节, 是否已找到文件)。
+    找到文件但数据还不够 SNIFF_BYTES 时文件开头为 None。
+    """
+    delimiter = b"--" + boundary
+    fields = []
+    position = body.find(delimiter)
+    while position != -1:
+        start = position + len(delimiter) + 2
+        header_end = body.find(b"\r\n\r\n", start)
+        if header_end == -1:
+            break
+        disposition = _disposition(body[start:header_end])
+        content_start = header_end + 4
+        if "filename" in disposition:
+            head = body[content_start:content_start + SNIFF_BYTES]
+            return fields, head if len(head) == SNIFF_BYTES else None, True
+        position = body.find(b"\r\n" + delimiter, content_start)
+        if position == -1:
+            break
+        fields.append((disposition.get("name", ""), body[content_start:position].decode("utf-8", "replace")))
+        position += 2
+    return fields, None, False
+
+
+class UploadGuardMiddleware:
+    """纯 ASGI 中间件，预读的数据会原样交给后面的应用"""
+
+    def __init__(self, app, max_bytes: Optional[int] = None, sniff: Optional[bool] = None):
+        settings = get_settings()
+        self.app = app
+        self.max_bytes = max_bytes if max_bytes is not None else settings.upload_max_bytes
+        self.sniff = sniff if sniff is not None else settings.upload_sniff_enabled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or processing_service(scope) is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            await self._reject(send, UploadTooLarge(self.max_bytes))
+            return
+
+        received = 0
+
+        async def counted_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise UploadTooLarge(self.max_bytes)
+            return message
+
+        buffered: List[dict] = []
+        boundary = _boundary(headers.get(b"content-type", b"").decode("latin-1"))
+        if self.sniff and boundary is not None:
+            try:
+                error = await self._check_prefix(scope["path"], boundary, counted_receive, buffered)
+            except HTTPException as e:
+                error = e
+            if error is not None:
+                await self._reject(send, error)
+                return
+
+        async def replay_receive():
+            if buffered:
+                return buffered.pop(0)
+            return await counted_receive()
+
+        response_started = False
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, tracking_send)
+        except UploadTooLarge as e:
+            if response_started:
+                raise
+            await self._reject(send, e)
+
+    async def _check_prefix(self, path: str, boundary: bytes, receive, buffered: List[dict]) -> Optional[HTTPException]:
+        """预读请求体开头并检查，消息存入 buffered 供应用重新读取；返回需要拒绝的错误"""
+        prefix = b""
+        rules = FIELD_RULES.get(path, {})
+        while len(prefix) < PREFIX_BYTES:
+            message = await receive()
+            buffered.append(message)
+            if message["type"] != "http.request":
+                return None
+            prefix += message.get("body", b"")
+            fields, head, found = scan_prefix(prefix, boundary)
+            for name, value in fields:
+                rule = rules.get(name)
+                if rule is not None and value.strip() not in rule[0]:
+                    return HTTPException(status_code=400, detail=rule[1])
+            if head is not None:
+                if sniff_audio(head) is None:
+                    logger.info("拒绝无法识别的上传: %s, 开头 %s", path, head.hex())
+                    return HTTPException(status_code=415, detail="无法识别的音频格式，支持 MP3 / WAV / M4A / FLAC / OGG")
+                return None
+            if found and not message.get("more_body", False):
+                # 文件不足 SNIFF_BYTES
+                return HTTPException(status_code=415, detail="音频文件为空或不完整")
+            if not message.get("more_body", False):
+                return None
+        return None
+
+    @staticmethod
+    async def _reject(send, error: HTTPException):
+        await send_error(send, error.status_code, error.detail)
@@ -0,0 +1,11 @@
+"""
+gunicorn worker (配合 gunicorn.conf.py 使用)
+
+在 uvicorn.workers.UvicornWorker 的基础上固定使用 uvloop 事件循环与 httptools 解析器。
+收到退出信号时的优雅关闭 (转交等待 RunPod 的任务) 由应用自己处理，见 app.lifecycle.install_signal_handlers()。
+"""
+from uvicorn.workers import UvicornWorker
+
+
+class UvloopUvicornWorker(UvicornWorker):
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools"}
@@ -0,0 +1,117 @@
+"""
+处理记录状态更新吞吐对比: 逐条 commit + refresh vs 写后缓冲批量 UPDATE
+
+直接连接 benchmarks/docker-compose.yml 中的 Postgres，不经过 HTTP。
+
+    python -m benchmarks.bench_write_behind --records 5000 --concurrency 200
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from benchmarks.run_bench import build_parser as build_bench_parser, bench_env
+
+
+def build_values(i: int) -> dict:
+    return {
+        "status": "completed",
+        "output_s3_url": f"https://bench.local/{i}.mid",
+        "runpod_job_id": f"bench-{i}",
+        "processing_time": 1.5,
+    }
+
+
+async def reset(count: int):
+    from sqlalchemy import insert
+    from app.database import get_engine
+    from app.models import Base, ProcessingRecord
+
+    async with get_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(ProcessingRecord), [
+            {
+                "file_hash": f"bench-{i}",
+                "original_filename": "bench.mp3",
+                "service_type": "piano",
+                "input_s3_url": "https://bench.local/in.mp3",
+                "status": "processing",
+            }
+            for i in range(count)
+        ])
+        ids = (await conn.exec_driver_sql("SELECT id FROM processing_records ORDER BY id")).scalars().all()
+    return ids
+
+
+async def run_concurrently(ids, concurrency: int, update_one):
+    queue = iter(ids)
+
+    async def worker():
+        for record_id in queue:
+            await update_one(record_id)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start
+
+
+async def per_row(ids, concurrency: int) -> float:
+    """原实现: 每次更新 commit 后再 refresh，两次往返"""
+    from app.database import session_scope
+    from app.models import ProcessingRecord
+
+    async def update_one(record_id):
+        async with session_scope() as db:
+            record = await db.get(ProcessingRecord, record_id)
+            for key, value in build_values(record_id).items():
+                setattr(record, key, value)
+            await db.commit()
+            await db.refresh(record)
+
+    return await run_concurrently(ids, concurrency, update_one)
+
+
+async def write_behind(ids, concurrency: int) -> float:
+    from app.services.record_writer import get_record_writer
+
+    record_writer = get_record_writer()
+    record_writer.start()
+    try:
+        return await run_concurrently(
+            ids, concurrency, lambda record_id: record_writer.update(record_id, build_values(record_id))
+        )
+    finally:
+        await record_writer.stop()
+
+
+async def main_async(args):
+    from app.database import dispose_engines
+
+    results = {}
+    for name, runner in (("逐条 commit + refresh", per_row), ("写后缓冲", write_behind)):
+        ids = await reset(args.records)
+        elapsed = await runner(ids, args.concurrency)
+        results[name] = elapsed
+        print(f"{name:<20} {len(ids)} 条  耗时 {elapsed:.2f}s  吞吐 {len(ids) / elapsed:.0f} 次/秒")
+    await dispose_engines()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="处理记录状态更新吞吐对比",
+        parents=[build_bench_parser()],
+        conflict_handler="resolve",
+        add_help=False,
+    )
+    parser.add_argument("--records", type=int, default=5000)
+    args = parser.parse_args()
+    # 必须在导入 app 模块之前设置环境变量
+    os.environ.update(bench_env(args))
+    os.environ.setdefault("DB_POOL_SIZE", str(min(args.concurrency, 50)))
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
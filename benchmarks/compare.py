@@ -0,0 +1,82 @@
+"""
+对比两个提交的压测结果
+
+为每个提交创建临时 git worktree，用相同的压测参数分别运行 run_bench，输出指标对比。
+替身依赖与压测客户端始终使用当前检出目录中的版本，保证两次运行条件一致。
+
+    python -m benchmarks.compare baseline HEAD --concurrency 100 --requests 1000 --output results/compare.json
+"""
+import argparse
+import json
+import subprocess
+import tempfile
+from pathlib import Path
+
+from benchmarks.run_bench import REPO_ROOT, build_parser as build_bench_parser, run
+
+METRICS = [
+    ("吞吐 (req/s)", lambda r: r["throughput_rps"], True),
+    ("p50 (ms)", lambda r: r["overall"]["p50_ms"], False),
+    ("p95 (ms)", lambda r: r["overall"]["p95_ms"], False),
+    ("p99 (ms)", lambda r: r["overall"]["p99_ms"], False),
+    ("错误数", lambda r: r["overall"]["errors"], False),
+    ("RSS 峰值 (MB)", lambda r: r["rss_mb_peak"], False),
+    ("循环延迟 p99 (ms)", lambda r: r["loop_lag_ms_p99"], False),
+    ("DB 连接峰值", lambda r: r["db_connections_peak"], False),
+    ("连接池借出峰值", lambda r: r.get("pool_checked_out_peak"), False),
+]
+
+
+def run_at_ref(ref: str, args) -> dict:
+    with tempfile.TemporaryDirectory(prefix="bench-") as tmp:
+        worktree = Path(tmp) / "tree"
+        subprocess.run(["git", "worktree", "add", "--detach", str(worktree), ref], cwd=REPO_ROOT, check=True)
+        try:
+            args.app_dir = str(worktree)
+            result = run(args)
+            result["ref"] = ref
+            return result
+        finally:
+            subprocess.run(["git", "worktree", "remove", "--force", str(worktree)], cwd=REPO_ROOT, check=False)
+
+
+def format_comparison(base: dict, head: dict) -> str:
+    lines = [f"{'指标':<20} {base['ref']:>14} {head['ref']:>14} {'变化':>10}"]
+    for name, getter, higher_is_better in METRICS:
+        a, b = getter(base), getter(head)
+        if a is None or b is None:
+            delta = "-"
+        elif a == 0:
+            delta = "0.0%" if b == 0 else "n/a"
+        else:
+            change = (b - a) / a * 100
+            better = change > 0 if higher_is_better else change < 0
+            delta = f"{change:+.1f}%{' ✓' if better and abs(change) >= 1 else ''}"
+        fa = "-" if a is None else f"{a:.1f}"
+        fb = "-" if b is None else f"{b:.1f}"
+        lines.append(f"{name:<20} {fa:>14} {fb:>14} {delta:>10}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="对比两个提交的压测结果",
+        parents=[build_bench_parser()],
+        conflict_handler="resolve",
+        add_help=False,
+    )
+    parser.add_argument("base_ref")
+    parser.add_argument("head_ref")
+    args = parser.parse_args()
+
+    base = run_at_ref(args.base_ref, args)
+    head = run_at_ref(args.head_ref, args)
+    print(format_comparison(base, head))
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump({"base": base, "head": head}, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
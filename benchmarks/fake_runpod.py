@@ -0,0 +1,177 @@
+"""
+RunPod 本地替身
+
+模拟 RunPod serverless 的 /run、/runsync、/status 与 /cancel 接口，排队时间、执行时间、失败率均可配置，
+用于压测时替代真实 GPU 端点。端点名中包含 spleeter 的返回 ZIP 结果，其余返回 MIDI 结果。
+
+    python -m benchmarks.fake_runpod --port 8100 --queue-delay 0.5 --exec-delay 2 --fail-rate 0.01
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict
+
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import JSONResponse
+
+
+@dataclass
+class FakeConfig:
+    queue_delay: float = 0.5        # 平均排队时间 (秒)
+    exec_delay: float = 2.0         # 平均执行时间 (秒)
+    jitter: float = 0.2             # 时间抖动比例
+    fail_rate: float = 0.0          # 任务失败比例
+    submit_error_rate: float = 0.0  # /run 直接返回 500 的比例
+
+
+@dataclass
+class FakeJob:
+    id: str
+    endpoint: str
+    input: dict
+    created_at: float
+    queue_delay: float
+    exec_delay: float
+    will_fail: bool
+    cancelled: bool = False
+
+
+def _jittered(value: float, jitter: float) -> float:
+    return max(0.0, value * random.uniform(1 - jitter, 1 + jitter))
+
+
+def _job_output(job: FakeJob) -> dict:
+    if "spleeter" in job.endpoint:
+        stems = int(job.input.get("stems", 2))
+        fmt = job.input.get("format", "mp3")
+        names = {
+            2: ["vocals", "accompaniment"],
+            4: ["vocals", "drums", "bass", "other"],
+            5: ["vocals", "drums", "bass", "piano", "other"],
+        }.get(stems, ["vocals", "accompaniment"])
+        return {
+            "download_url": f"https://fake-runpod.local/{job.endpoint}/{job.id}.zip",
+            "files": [{"name": f"{name}.{fmt}", "size_kb": 1024.0} for name in names],
+            "size_mb": round(len(names) * 1024.0 / 1024, 2),
+            "bitrate": job.input.get("bitrate"),
+            "format": fmt,
+        }
+    return {"midi_url": f"https://fake-runpod.local/{job.endpoint}/{job.id}.mid"}
+
+
+def _job_state(job: FakeJob, now: float) -> Dict:
+    elapsed = now - job.created_at
+    state = {"id": job.id}
+    if job.cancelled:
+        state["status"] = "CANCELLED"
+        return state
+    if elapsed < job.queue_delay:
+        state["status"] = "IN_QUEUE"
+    elif elapsed < job.queue_delay + job.exec_delay:
+        state["status"] = "IN_PROGRESS"
+        state["delayTime"] = int(job.queue_delay * 1000)
+    else:
+        state["delayTime"] = int(job.queue_delay * 1000)
+        state["executionTime"] = int(job.exec_delay * 1000)
+        if job.will_fail:
+            state["status"] = "FAILED"
+            state["error"] = "fake runpod: simulated failure"
+        else:
+            state["status"] = "COMPLETED"
+            state["output"] = _job_output(job)
+    return state
+
+
+def create_app(config: FakeConfig) -> FastAPI:
+    app = FastAPI(title="Fake RunPod")
+    jobs: Dict[str, FakeJob] = {}
+    stats = {"submitted": 0, "runsync": 0, "status_polls": 0, "submit_errors": 0, "cancelled": 0}
+
+    def submit(endpoint: str, body: dict) -> FakeJob:
+        job = FakeJob(
+            id=f"{uuid.uuid4()}-fake",
+            endpoint=endpoint,
+            input=body.get("input", {}),
+            created_at=time.monotonic(),
+            queue_delay=_jittered(config.queue_delay, config.jitter),
+            exec_delay=_jittered(config.exec_delay, config.jitter),
+            will_fail=random.random() < config.fail_rate,
+        )
+        jobs[job.id] = job
+        stats["submitted"] += 1
+        return job
+
+    def submit_error():
+        stats["submit_errors"] += 1
+        return JSONResponse(status_code=500, content={"error": "fake runpod: submit error"})
+
+    @app.post("/v2/{endpoint}/run")
+    async def run(endpoint: str, body: dict):
+        if random.random() < config.submit_error_rate:
+            return submit_error()
+        job = submit(endpoint, body)
+        return {"id": job.id, "status": "IN_QUEUE"}
+
+    @app.post("/v2/{endpoint}/runsync")
+    async def runsync(endpoint: str, body: dict, wait: int = Query(default=90000)):
+        """等待任务结束，最多 wait 毫秒；未结束时与 RunPod 一样返回 id 与当前状态"""
+        if random.random() < config.submit_error_rate:
+            return submit_error()
+        job = submit(endpoint, body)
+        stats["runsync"] += 1
+        remaining = job.queue_delay + job.exec_delay
+        await asyncio.sleep(min(remaining, wait / 1000))
+        return _job_state(job, time.monotonic())
+
+    @app.get("/v2/{endpoint}/status/{job_id}")
+    async def status(endpoint: str, job_id: str):
+        job = jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="job not found")
+        stats["status_polls"] += 1
+        return _job_state(job, time.monotonic())
+
+    @app.post("/v2/{endpoint}/cancel/{job_id}")
+    async def cancel(endpoint: str, job_id: str):
+        job = jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="job not found")
+        job.cancelled = True
+        stats["cancelled"] += 1
+        return {"id": job.id, "status": "CANCELLED"}
+
+    @app.get("/stats")
+    async def get_stats():
+        return {**stats, "jobs": len(jobs)}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RunPod 本地替身")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--queue-delay", type=float, default=0.5)
+    parser.add_argument("--exec-delay", type=float, default=2.0)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--submit-error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    import uvicorn
+    config = FakeConfig(
+        queue_delay=args.queue_delay,
+        exec_delay=args.exec_delay,
+        jitter=args.jitter,
+        fail_rate=args.fail_rate,
+        submit_error_rate=args.submit_error_rate,
+    )
+    # workers=1: 否则 uvicorn 会读取被测服务使用的 WEB_CONCURRENCY 环境变量
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning", workers=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+导入耗时预算
+
+用 python -X importtime 在独立进程中测量各模块的累计导入耗时 (取多次中的最小值)，超出预算时以非零状态退出，
+可放进 CI 防止有人在模块顶层重新引入昂贵的初始化。
+
+所有模块 (包括应用入口 app.main，应用由 create_app() 创建) 都在清空配置环境变量的进程中导入，
+确认命令行工具、测试收集不需要任何配置。
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --repeat 10 --top 15 --module app.main
+"""
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+
+from benchmarks.run_bench import build_parser as build_bench_parser, bench_env
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# 各模块的累计导入耗时预算 (毫秒)
+BUDGETS_MS: Dict[str, float] = {
+    "app.config": 300,
+    "app.models": 500,
+    "app.database": 800,
+    "app.maintenance": 900,
+    "app.services": 1100,
+    "app.main": 1600,
+}
+
+# 需要完整配置才能导入的模块 (应用入口在 create_app() 中才读取配置，导入时不需要)
+NEEDS_SETTINGS: Set[str] = set()
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """解析 -X importtime 输出，返回 (模块名, 自身耗时 us, 累计耗时 us)"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def measure(module: str, env: dict) -> List[Tuple[str, int, int]]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{result.stderr.splitlines()[-1]}")
+    return parse_importtime(result.stderr)
+
+
+def config_free_env(env: dict) -> dict:
+    """去掉 Settings 会读取的环境变量"""
+    from app.config import Settings
+
+    fields = {name.upper() for name in Settings.model_fields}
+    return {key: value for key, value in env.items() if key.upper() not in fields}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="模块导入耗时预算",
+        parents=[build_bench_parser()],
+        conflict_handler="resolve",
+        add_help=False,
+    )
+    parser.add_argument("--module", action="append", help="只测量指定模块 (可重复)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=0, help="列出累计耗时最高的 N 个依赖")
+    args = parser.parse_args()
+
+    full_env = bench_env(args)
+    bare_env = config_free_env(full_env)
+    over_budget = False
+    for module in args.module or list(BUDGETS_MS):
+        env = full_env if module in NEEDS_SETTINGS else bare_env
+        runs = [measure(module, env) for _ in range(args.repeat)]
+        best = min(runs, key=lambda rows: rows[-1][2])
+        total_ms = best[-1][2] / 1000
+        budget = BUDGETS_MS.get(module)
+        status = "OK"
+        if budget is not None and total_ms > budget:
+            status = "超出预算"
+            over_budget = True
+        print(f"{module:<20} {total_ms:8.1f} ms  预算 {budget or '-':>6}  {status}")
+        for name, _, cumulative_us in sorted(best, key=lambda row: -row[2])[1:args.top + 1]:
+            print(f"    {cumulative_us / 1000:8.1f} ms  {name}")
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+一键压测
+
+启动 RunPod 替身与被测服务 (指向 benchmarks/docker-compose.yml 中的 Postgres 与 MinIO)，
+重建数据表后运行压测客户端，结果输出为 JSON。
+
+    docker compose -f benchmarks/docker-compose.yml up -d
+    python -m benchmarks.run_bench --concurrency 50 --requests 500 --output results/head.json
+
+--app-dir 可以指向另一个检出目录 (如 git worktree)，用于对比不同提交，参见 compare.py。
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+from benchmarks.loadgen import build_parser as build_loadgen_parser, format_report, run_load
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+RESET_DB_SCRIPT = """
+import asyncio
+from app.database import get_engine, dispose_engines
+from app.models import Base
+
+async def main():
+    async with get_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    await dispose_engines()
+
+asyncio.run(main())
+"""
+
+
+def bench_env(args) -> dict:
+    fake = f"http://127.0.0.1:{args.fake_port}/v2"
+    env = dict(os.environ)
+    env.update({
+        "AWS_ACCESS_KEY_ID": "bench",
+        "AWS_SECRET_ACCESS_KEY": "benchbench",
+        "S3_BUCKET_NAME": "bench",
+        "S3_ENDPOINT_URL": args.s3_endpoint,
+        "DB_HOST": args.pg_host,
+        "DB_PORT": str(args.pg_port),
+        "DB_NAME": "postgres",
+        "DB_USER": "postgres",
+        "DB_PASSWORD": "postgres",
+        "RUNPOD_API_KEY": "bench",
+        "RUNPOD_PIANO_ENDPOINT": f"{fake}/piano/run",
+        "RUNPOD_SPLEETER_ENDPOINT": f"{fake}/spleeter/run",
+        "RUNPOD_YOURMT3_ENDPOINT": f"{fake}/yourmt3/run",
+        "LOG_LEVEL": args.log_level,
+    })
+    if args.read_replica_host:
+        env["DB_READ_HOST"] = args.read_replica_host
+        env["DB_READ_PORT"] = str(args.read_replica_port or args.pg_port)
+    return env
+
+
+async def wait_until_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2.0) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"服务未在 {timeout}s 内就绪: {url}")
+
+
+def stop(process: subprocess.Popen):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def run(args) -> dict:
+    app_dir = Path(args.app_dir).resolve()
+    env = bench_env(args)
+
+    fake = subprocess.Popen(
+        [
+            sys.executable, "-m", "benchmarks.fake_runpod",
+            "--port", str(args.fake_port),
+            "--queue-delay", str(args.queue_delay),
+            "--exec-delay", str(args.exec_delay),
+            "--fail-rate", str(args.fail_rate),
+            "--submit-error-rate", str(args.submit_error_rate),
+        ],
+        cwd=REPO_ROOT,
+    )
+    server = None
+    try:
+        subprocess.run([sys.executable, "-c", RESET_DB_SCRIPT], cwd=app_dir, env=env, check=True)
+
+        server_cmd = args.server_cmd or (
+            f"{sys.executable} -m uvicorn app.main:create_app --factory --host 127.0.0.1 --port {args.port}"
+        )
+        server = subprocess.Popen(server_cmd.split(), cwd=app_dir, env=env)
+
+        asyncio.run(wait_until_ready(f"http://127.0.0.1:{args.fake_port}/stats"))
+        asyncio.run(wait_until_ready(f"http://127.0.0.1:{args.port}/health"))
+
+        args.base_url = f"http://127.0.0.1:{args.port}"
+        args.server_pid = server.pid
+        args.pg_dsn = f"postgresql://postgres:postgres@{args.pg_host}:{args.pg_port}/postgres"
+        result = asyncio.run(run_load(args))
+        result["app_dir"] = str(app_dir)
+        result["fake_runpod"] = httpx.get(f"http://127.0.0.1:{args.fake_port}/stats").json()
+        return result
+    finally:
+        if server is not None:
+            stop(server)
+        stop(fake)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = build_loadgen_parser()
+    parser.description = "启动替身依赖与被测服务并运行压测"
+    parser.add_argument("--app-dir", default=str(REPO_ROOT), help="被测代码目录")
+    parser.add_argument("--server-cmd", help="自定义服务启动命令 (默认单进程 uvicorn)")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--fake-port", type=int, default=8100)
+    parser.add_argument("--queue-delay", type=float, default=0.5)
+    parser.add_argument("--exec-delay", type=float, default=2.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--submit-error-rate", type=float, default=0.0)
+    parser.add_argument("--pg-host", default="127.0.0.1")
+    parser.add_argument("--pg-port", type=int, default=55432)
+    parser.add_argument("--s3-endpoint", default="http://127.0.0.1:59000")
+    parser.add_argument("--read-replica-host", help="只读副本主机 (可与主库相同，用两个 DSN 指向同一实例)")
+    parser.add_argument("--read-replica-port", type=int)
+    parser.add_argument("--log-level", default="WARNING")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    result = run(args)
+    print(format_report(result))
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
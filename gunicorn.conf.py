@@ -0,0 +1,42 @@
+"""
+生产环境启动配置
+
+    gunicorn -c gunicorn.conf.py "app.main:create_app()"
+
+- worker 数默认等于 CPU 核数 (WEB_CONCURRENCY 可覆盖)，哈希、JSON 序列化等 CPU 工作分摊到多个进程
+- worker 使用 uvloop + httptools (app.worker.UvloopUvicornWorker)
+- 预加载应用: 导入在 fork 之前完成一次，worker 启动更快；数据库引擎与服务实例在 worker 中首次使用时才创建
+- 数据库结构: 启动 worker 之前在主进程执行 ensure-schema (SCHEMA_AUTO_UPDATE=false 时跳过，
+  由部署流程执行)，失败时不启动；worker 启动时检查结构，仍不一致时拒绝启动
+- 优雅关闭: 收到 SIGTERM 后等待 RunPod 的请求把任务转交后台 (handed_off) 并返回 202，
+  GRACEFUL_TIMEOUT 秒后仍未退出的 worker 会被强制结束
+"""
+import asyncio
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+workers = int(os.environ.get("WEB_CONCURRENCY") or multiprocessing.cpu_count())
+# 数据库连接预算检查 (app.database.check_connection_budget) 按实际 worker 数计算
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+worker_class = "app.worker.UvloopUvicornWorker"
+preload_app = True
+
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.environ.get("WORKER_TIMEOUT", "60"))
+keepalive = int(os.environ.get("KEEPALIVE", "5"))
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.environ.get("LOG_LEVEL", "info").lower()
+
+
+def on_starting(server):
+    from app.config import get_settings
+    from app.maintenance import build_parser, main_async
+
+    if get_settings().schema_auto_update:
+        # 主进程中创建的引擎在 main_async 结束时关闭，不会带入 fork 出的 worker
+        asyncio.run(main_async(build_parser().parse_args(["ensure-schema"])))
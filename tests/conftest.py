@@ -0,0 +1,54 @@
+import asyncio
+import pytest
+from app.config import get_settings
+
+# Settings 的必填项，测试不连接任何外部服务
+REQUIRED_ENV = {
+    "AWS_ACCESS_KEY_ID": "test",
+    "AWS_SECRET_ACCESS_KEY": "test",
+    "DB_HOST": "localhost",
+    "DB_NAME": "test",
+    "DB_USER": "test",
+    "DB_PASSWORD": "test",
+    "RUNPOD_API_KEY": "test",
+    "RUNPOD_PIANO_ENDPOINT": "http://runpod.test/v2/piano/run",
+    "RUNPOD_SPLEETER_ENDPOINT": "http://runpod.test/v2/spleeter/run",
+    "RUNPOD_YOURMT3_ENDPOINT": "http://runpod.test/v2/yourmt3/run",
+}
+
+
+@pytest.fixture
+def settings_env(monkeypatch):
+    """需要 get_settings() 的测试使用: 设置必填的环境变量，前后清空配置缓存"""
+    for name, value in REQUIRED_ENV.items():
+        monkeypatch.setenv(name, value)
+    get_settings.cache_clear()
+    yield get_settings()
+    get_settings.cache_clear()
+
+
+
+@pytest.fixture
+def sqlite_db(settings_env, monkeypatch, tmp_path):
+    """
+    需要数据库的测试使用 (需要 aiosqlite): 主库换成临时的 SQLite 文件。
+    返回 run(coro)，在新的事件循环中建表后执行协程，结束时关闭引擎。
+    """
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from app import database
+    from app.models import Base
+
+    monkeypatch.setattr(database, "build_engine", lambda url: create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/test.db"))
+
+    def run(coro):
+        async def main():
+            async with database.get_engine().begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            try:
+                return await coro
+            finally:
+                await database.dispose_engines()
+        return asyncio.run(main())
+
+    return run
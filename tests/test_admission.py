@@ -0,0 +1,85 @@
+import asyncio
+import pytest
+import app.admission as admission
+from app.admission import AdmissionController, MemoryBuckets, parse_api_keys
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+
+def take(buckets, client):
+    return asyncio.run(buckets.take(client))
+
+
+def test_burst_then_wait_for_next_token(clock):
+    buckets = MemoryBuckets(rate=1.0, burst=3)
+    assert [take(buckets, "a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert take(buckets, "a") == pytest.approx(1.0)
+    clock.now += 0.5
+    assert take(buckets, "a") == pytest.approx(0.5)
+    clock.now += 0.5
+    assert take(buckets, "a") == 0.0
+
+
+def test_tokens_refill_up_to_burst(clock):
+    buckets = MemoryBuckets(rate=2.0, burst=2)
+    take(buckets, "a"), take(buckets, "a")
+    clock.now += 60
+    assert [take(buckets, "a") for _ in range(2)] == [0.0, 0.0]
+    assert take(buckets, "a") > 0
+
+
+def test_clients_have_separate_buckets(clock):
+    buckets = MemoryBuckets(rate=1.0, burst=1)
+    assert take(buckets, "a") == 0.0
+    assert take(buckets, "a") > 0
+    assert take(buckets, "b") == 0.0
+
+
+def scope(api_key=None, client=("10.0.0.1", 5000), forwarded=None):
+    headers = []
+    if api_key is not None:
+        headers.append((b"x-api-key", api_key))
+    if forwarded is not None:
+        headers.append((b"x-forwarded-for", forwarded))
+    return {"type": "http", "method": "POST", "path": "/api/piano/transcribe", "client": client, "headers": headers}
+
+
+def test_only_known_api_keys_get_their_own_bucket():
+    controller = AdmissionController(rate_per_minute=60, burst=1, api_keys=parse_api_keys("key-a, key-b"))
+    assert controller.client_id(scope(b"key-a")).startswith("key:")
+    assert controller.client_id(scope(b"key-a")) != controller.client_id(scope(b"key-b"))
+    assert controller.client_id(scope(b"random")) == "ip:10.0.0.1"
+    assert controller.client_id(scope()) == "ip:10.0.0.1"
+
+
+def test_random_api_keys_share_the_ip_bucket():
+    controller = AdmissionController(rate_per_minute=60, burst=2)
+    statuses = [asyncio.run(controller.admit(scope(f"key-{i}".encode())))[0] for i in range(4)]
+    assert statuses == [None, None, 429, 429]
+
+
+def test_forwarded_for_only_when_trusted():
+    forwarded = scope(forwarded=b"203.0.113.9, 10.0.0.2")
+    assert AdmissionController(rate_per_minute=60).client_id(forwarded) == "ip:10.0.0.1"
+    assert AdmissionController(rate_per_minute=60, trust_forwarded=True).client_id(forwarded) == "ip:203.0.113.9"
+
+
+def test_inflight_limit_returns_503_until_released():
+    controller = AdmissionController(rate_per_minute=0, inflight_limits={"piano": 1}, inflight_retry_after=7)
+    assert asyncio.run(controller.admit(scope())) == (None, None, "piano")
+    assert asyncio.run(controller.admit(scope())) == (503, 7, None)
+    controller.release("piano")
+    assert asyncio.run(controller.admit(scope()))[0] is None
@@ -0,0 +1,133 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from types import SimpleNamespace
+import pytest
+from app.services import cache_warmer as cache_warmer_module
+from app.services.cache_warmer import WARM_TENANT, CacheWarmer, WarmEntry, parse_hours, parse_targets
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    async def check_file_exists(self, key):
+        return key in self.objects
+
+    async def upload_file(self, file_content, s3_key, **kwargs):
+        self.objects[s3_key] = file_content
+        return f"https://bucket.test/{s3_key}", "abc"
+
+    async def read_object(self, key):
+        return self.objects.get(key)
+
+
+class FakeService:
+    def __init__(self, service_type, cached=False):
+        self.service_type = service_type
+        self.cached = cached
+
+    async def check_existing_record(self, db, file_hash, **params):
+        return object() if self.cached else None
+
+
+class FakePipeline:
+    def __init__(self):
+        self.runs = []
+
+    async def run(self, service, file_content, filename, content_type, tenant, **params):
+        self.runs.append((service.service_type, params, tenant))
+
+
+@asynccontextmanager
+async def no_session():
+    yield None
+
+
+def make_warmer(inflight=0, **options) -> CacheWarmer:
+    admission = SimpleNamespace(inflight={"piano": inflight})
+    targets = [("piano", {}), ("spleeter", {"stems": 2}), ("yourmt3", {})]
+    return CacheWarmer(FakeS3(), admission, targets, **{"min_hits": 2, **options})
+
+
+def observe(warmer: CacheWarmer, times: int, file_hash: str = "abc"):
+    async def main():
+        for _ in range(times):
+            await warmer.observe("piano", {}, file_hash, "song.mp3", "audio/mpeg", b"audio")
+    asyncio.run(main())
+
+
+def has_capacity(warmer: CacheWarmer) -> bool:
+    async def main():
+        return warmer.has_capacity()
+    return asyncio.run(main())
+
+
+def test_parse_targets_and_hours():
+    assert parse_targets("yourmt3, spleeter:stems=4") == [
+        ("yourmt3", {}), ("spleeter", {"stems": 4, "format": "mp3", "bitrate": "192k"})
+    ]
+    assert parse_hours("0-2,23") == {0, 1, 2, 23}
+    assert parse_hours("") is None
+    with pytest.raises(ValueError):
+        parse_targets("unknown")
+
+
+def test_hot_file_is_saved_once_and_queued():
+    warmer = make_warmer()
+    observe(warmer, 1)
+    assert warmer.s3.objects == {} and not warmer._queue
+    observe(warmer, 3)
+    assert warmer.s3.objects == {"sources/abc.mp3": b"audio"}
+    assert [(entry.file_hash, entry.source_key) for entry in warmer._queue] == [("abc", "sources/abc.mp3")]
+    assert warmer.stats["queued"] == 1
+
+
+def test_hits_outside_the_window_start_over():
+    warmer = make_warmer(window=60)
+    observe(warmer, 1)
+    warmer._seen.set("abc", (time.monotonic() - 120, 1))
+    observe(warmer, 1)
+    assert not warmer._queue
+
+
+def test_capacity_requires_idle_worker_budget_and_hours():
+    assert has_capacity(make_warmer())
+    assert not has_capacity(make_warmer(inflight=3, max_inflight=2))
+    assert not has_capacity(make_warmer(hours={(datetime.utcnow().hour + 1) % 24}))
+
+    warmer = make_warmer(budget_per_hour=2)
+    warmer._submitted.extend([time.monotonic(), time.monotonic()])
+    assert not has_capacity(warmer)
+    # 一小时前的提交不再占用预算
+    warmer._submitted[0] -= 4000
+    assert has_capacity(warmer)
+
+
+def test_warm_skips_origin_and_cached_targets(monkeypatch):
+    monkeypatch.setattr(cache_warmer_module, "read_session_scope", no_session)
+    services = {"piano": FakeService("piano"), "spleeter": FakeService("spleeter", cached=True), "yourmt3": FakeService("yourmt3")}
+    monkeypatch.setattr(cache_warmer_module, "SERVICE_FACTORIES", {name: (lambda s=s: s) for name, s in services.items()})
+    warmer = make_warmer()
+    warmer.s3.objects["sources/abc.mp3"] = b"audio"
+    warmer.pipeline = FakePipeline()
+
+    asyncio.run(warmer.warm(WarmEntry("abc", "song.mp3", "audio/mpeg", "sources/abc.mp3", ("piano", {}))))
+    assert warmer.pipeline.runs == [("yourmt3", {}, WARM_TENANT)]
+    assert warmer.stats == {"queued": 0, "warmed": 1, "skipped": 1, "failed": 0}
+
+
+def test_warm_requeues_the_entry_when_the_budget_runs_out(monkeypatch):
+    monkeypatch.setattr(cache_warmer_module, "read_session_scope", no_session)
+    monkeypatch.setattr(cache_warmer_module, "SERVICE_FACTORIES", {
+        name: (lambda name=name: FakeService(name)) for name in ("piano", "spleeter", "yourmt3")
+    })
+    warmer = make_warmer(budget_per_hour=1)
+    warmer.s3.objects["sources/abc.mp3"] = b"audio"
+    warmer.pipeline = FakePipeline()
+    entry = WarmEntry("abc", "song.mp3", "audio/mpeg", "sources/abc.mp3", ("piano", {}))
+
+    asyncio.run(warmer.warm(entry))
+    assert [run[0] for run in warmer.pipeline.runs] == ["spleeter"]
+    assert list(warmer._queue) == [entry]
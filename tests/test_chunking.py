@@ -0,0 +1,78 @@
+import io
+import mido
+import pytest
+from app.services.chunking import SegmentOutput, merge_midi, segment_bounds
+
+TICKS_PER_BEAT = 480
+TEMPO = 500000
+
+
+def test_short_audio_is_one_segment():
+    assert segment_bounds(100, 300, 10) == [(0.0, 100)]
+
+
+def test_segments_overlap_the_next_one():
+    assert segment_bounds(700, 300, 10) == [(0.0, 310.0), (300.0, 310.0), (600.0, 100.0)]
+
+
+def test_short_tail_is_merged_into_previous_segment():
+    # 最后 5 秒不足 overlap，并入第二段
+    assert segment_bounds(605, 300, 10) == [(0.0, 310.0), (300.0, 305.0)]
+
+
+@pytest.mark.parametrize("total", [1, 299.5, 300, 310, 615, 1000, 3601])
+def test_segments_cover_the_whole_audio(total):
+    bounds = segment_bounds(total, 300, 10)
+    assert bounds[0][0] == 0
+    assert bounds[-1][0] + bounds[-1][1] == pytest.approx(total)
+    for (start, duration), (next_start, _) in zip(bounds, bounds[1:]):
+        assert next_start < start + duration
+
+
+def midi(tracks) -> bytes:
+    """tracks: {音轨名: [(起始秒, 结束秒, 音高)]}，120 BPM"""
+    output = mido.MidiFile(type=1, ticks_per_beat=TICKS_PER_BEAT)
+    for name, notes in tracks.items():
+        events = []
+        for start, end, pitch in notes:
+            events.append((round(mido.second2tick(start, TICKS_PER_BEAT, TEMPO)), 1, mido.Message("note_on", note=pitch, velocity=90)))
+            events.append((round(mido.second2tick(end, TICKS_PER_BEAT, TEMPO)), 0, mido.Message("note_off", note=pitch, velocity=0)))
+        track = mido.MidiTrack([mido.MetaMessage("track_name", name=name, time=0)])
+        last = 0
+        for tick, _, message in sorted(events, key=lambda event: (event[0], event[1])):
+            track.append(message.copy(time=tick - last))
+            last = tick
+        output.tracks.append(track)
+    buffer = io.BytesIO()
+    output.save(file=buffer)
+    return buffer.getvalue()
+
+
+def onsets(content: bytes):
+    """{音轨名: [(起始秒, 音高)]}"""
+    parsed = mido.MidiFile(file=io.BytesIO(content))
+    result = {}
+    for track in parsed.tracks:
+        name = next((message.name for message in track if message.type == "track_name"), None)
+        ticks = 0
+        for message in track:
+            ticks += message.time
+            if message.type == "note_on" and message.velocity > 0:
+                seconds = mido.tick2second(ticks, parsed.ticks_per_beat, TEMPO)
+                result.setdefault(name, []).append((round(seconds, 3), message.note))
+    return result
+
+
+def test_merge_midi_shifts_notes_and_drops_duplicates_in_overlap():
+    # 第一段负责 [0, 305)，第二段 (起点 300) 负责 [305, ∞)
+    first = midi({"piano": [(1.0, 1.5, 60), (302.0, 302.5, 62), (306.0, 306.5, 64)]})
+    second = midi({"piano": [(2.0, 2.5, 62), (6.0, 6.5, 64), (10.0, 10.5, 65)]})
+    merged = merge_midi([SegmentOutput(0.0, first), SegmentOutput(300.0, second)], overlap=10)
+    assert onsets(merged) == {"piano": [(1.0, 60), (302.0, 62), (306.0, 64), (310.0, 65)]}
+
+
+def test_merge_midi_matches_tracks_by_name():
+    first = midi({"Piano": [(1.0, 2.0, 60)]})
+    second = midi({"Piano": [(20.0, 21.0, 61)], "Bass": [(20.0, 21.0, 40)]})
+    merged = merge_midi([SegmentOutput(0.0, first), SegmentOutput(300.0, second)], overlap=10)
+    assert onsets(merged) == {"Piano": [(1.0, 60), (320.0, 61)], "Bass": [(320.0, 40)]}
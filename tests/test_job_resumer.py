@@ -0,0 +1,87 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from sqlalchemy import select, update
+from app.database import session_scope
+from app.models import ProcessingRecord
+from app.services import job_resumer as job_resumer_module
+from app.services.job_resumer import JobResumer
+from app.services.pipeline import PipelineResult
+
+
+async def add_records(*rows):
+    """rows: (status, claimed_at)，返回记录ID"""
+    async with session_scope() as db:
+        records = [
+            ProcessingRecord(
+                file_hash="abc", original_filename="song.mp3", service_type="piano",
+                input_s3_url="https://bucket.test/url2mp3/abc.mp3", status=status, claimed_at=claimed_at
+            )
+            for status, claimed_at in rows
+        ]
+        db.add_all(records)
+        await db.commit()
+        return [record.id for record in records]
+
+
+async def age_leases(seconds: float):
+    async with session_scope() as db:
+        await db.execute(update(ProcessingRecord).values(claimed_at=datetime.utcnow() - timedelta(seconds=seconds)))
+        await db.commit()
+
+
+def test_claims_handed_off_and_expired_records(sqlite_db):
+    async def main():
+        now = datetime.utcnow()
+        handed_off, in_flight, expired, leased = await add_records(
+            ("handed_off", None),
+            # 普通请求 (没有租约) 不会被认领
+            ("processing", None),
+            ("processing", now - timedelta(seconds=600)),
+            ("processing", now),
+        )
+        resumer = JobResumer(lease=120)
+        claimed = sorted(record.id for record in await resumer.claim())
+        async with session_scope() as db:
+            statuses = dict((await db.execute(select(ProcessingRecord.id, ProcessingRecord.status))).all())
+        return claimed, [handed_off, expired], resumer._claimed, statuses[handed_off]
+
+    claimed, expected, held, status = sqlite_db(main())
+    assert claimed == expected
+    assert held == set(expected)
+    assert status == "processing"
+
+
+def test_renewed_leases_are_not_reclaimed(sqlite_db):
+    async def main():
+        await add_records(("handed_off", None))
+        owner, other = JobResumer(lease=120), JobResumer(lease=120)
+        claimed = [record.id for record in await owner.claim()]
+        await age_leases(600)
+        await owner.renew()
+        stolen_while_renewed = await other.claim()
+        # 持有者被强制结束 (不再续租)，租约过期后由其他 worker 认领
+        await age_leases(600)
+        reclaimed = [record.id for record in await other.claim()]
+        return claimed, stolen_while_renewed, reclaimed
+
+    claimed, stolen_while_renewed, reclaimed = sqlite_db(main())
+    assert stolen_while_renewed == []
+    assert reclaimed == claimed
+
+
+def test_resume_releases_the_lease(monkeypatch):
+    resumed = []
+
+    class FakePipeline:
+        async def resume(self, service, record):
+            resumed.append((service, record.id))
+            return PipelineResult(output_url="u", output_data=None, job_id="job-1", from_cache=False, record_id=record.id)
+
+    monkeypatch.setattr(job_resumer_module, "get_processing_pipeline", lambda: FakePipeline())
+    monkeypatch.setitem(job_resumer_module.SERVICE_FACTORIES, "piano", lambda: "piano-service")
+    resumer = JobResumer()
+    resumer._claimed.update({1, 2})
+    asyncio.run(resumer._resume(SimpleNamespace(id=1, service_type="piano")))
+    assert resumed == [("piano-service", 1)]
+    assert resumer._claimed == {2}
@@ -0,0 +1,56 @@
+from datetime import datetime
+from types import SimpleNamespace
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.routers import jobs
+from app.services import get_job_service, result_token
+from app.services.job_service import JobService, parse_result_token
+
+
+class FakeJobService(JobService):
+    """只有记录 7"""
+
+    async def get_record(self, record_id, fresh=False):
+        if record_id != 7:
+            return None
+        return SimpleNamespace(
+            id=7, file_hash="abc", original_filename="私人录音.mp3", service_type="piano", tenant="0123456789abcdef",
+            input_s3_url="https://bucket.test/url2mp3/abc.mp3", output_s3_url=None, output_data=None,
+            status="processing", processing_time=None, created_at=datetime.utcnow(), updated_at=datetime.utcnow()
+        )
+
+
+@pytest.fixture
+def client(settings_env):
+    app = FastAPI()
+    app.include_router(jobs.router)
+    app.dependency_overrides[get_job_service] = lambda: FakeJobService()
+    return TestClient(app)
+
+
+def test_token_round_trip(settings_env):
+    assert parse_result_token(result_token(7)) == 7
+
+
+@pytest.mark.parametrize("token", ["7", "8.", "7.abc", "-7.x", ""])
+def test_unsigned_or_tampered_tokens_are_rejected(settings_env, token):
+    assert parse_result_token(token) is None
+
+
+def test_signature_is_bound_to_the_record_id(settings_env):
+    signature = result_token(7).partition(".")[2]
+    assert parse_result_token(f"8.{signature}") is None
+
+
+def test_job_status_requires_the_token(client):
+    assert client.get("/api/jobs/7").status_code == 404
+    assert client.get(f"/api/jobs/{result_token(8)}").status_code == 404
+    response = client.get(f"/api/jobs/{result_token(7)}")
+    assert response.status_code == 200
+    assert response.json()["status"] == "processing"
+
+
+def test_job_status_does_not_expose_input_or_tenant(client):
+    body = client.get(f"/api/jobs/{result_token(7)}").json()
+    assert not {"input_s3_url", "original_filename", "tenant"} & set(body)
@@ -0,0 +1,56 @@
+import asyncio
+import signal
+from app.lifecycle import install_signal_handlers, is_draining, restore_signal_handlers
+
+
+def test_signal_starts_draining_and_still_reaches_the_loop_handler():
+    # uvicorn 用 loop.add_signal_handler 处理退出信号
+    received = []
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, received.append, "server exit")
+        install_signal_handlers()
+        try:
+            assert not is_draining()
+            signal.raise_signal(signal.SIGTERM)
+            await asyncio.sleep(0.05)
+            return is_draining()
+        finally:
+            restore_signal_handlers()
+            loop.remove_signal_handler(signal.SIGTERM)
+
+    assert asyncio.run(main())
+    assert received == ["server exit"]
+
+
+def test_signal_chains_to_a_python_handler():
+    received = []
+    previous = signal.signal(signal.SIGINT, lambda sig, frame: received.append(sig))
+
+    async def main():
+        install_signal_handlers()
+        try:
+            signal.raise_signal(signal.SIGINT)
+            await asyncio.sleep(0.05)
+            return is_draining()
+        finally:
+            restore_signal_handlers()
+
+    try:
+        assert asyncio.run(main())
+        assert received == [signal.SIGINT]
+    finally:
+        signal.signal(signal.SIGINT, previous)
+
+
+def test_restore_puts_back_the_previous_handlers():
+    before = signal.getsignal(signal.SIGTERM)
+
+    async def main():
+        install_signal_handlers()
+        assert signal.getsignal(signal.SIGTERM) is not before
+        restore_signal_handlers()
+
+    asyncio.run(main())
+    assert signal.getsignal(signal.SIGTERM) is before
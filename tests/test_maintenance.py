@@ -0,0 +1,30 @@
+from sqlalchemy import text
+from app.database import get_engine
+from app.maintenance import check_schema, ensure_schema
+
+
+async def downgrade_schema():
+    """模拟升级前的数据库: file_hash 唯一索引，缺少进行中记录的查询索引"""
+    async with get_engine().begin() as conn:
+        await conn.execute(text("DROP INDEX ix_processing_records_inflight_lookup"))
+        await conn.execute(text("DROP INDEX ix_processing_records_file_hash"))
+        await conn.execute(text("CREATE UNIQUE INDEX ix_processing_records_file_hash ON processing_records (file_hash)"))
+
+
+def test_up_to_date_schema_has_no_drift(sqlite_db):
+    assert sqlite_db(check_schema()) == []
+
+
+def test_check_schema_reports_stale_schema_and_ensure_schema_fixes_it(sqlite_db):
+    async def main():
+        await downgrade_schema()
+        drift = await check_schema()
+        await ensure_schema()
+        return drift, await check_schema()
+
+    drift, after = sqlite_db(main())
+    assert sorted(drift) == [
+        "索引定义不一致 ix_processing_records_file_hash",
+        "缺少索引 ix_processing_records_inflight_lookup",
+    ]
+    assert after == []
@@ -0,0 +1,321 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import httpx
+import pytest
+from app.lifecycle import start_draining
+from app.services import pipeline as pipeline_module
+from app.services.pipeline import JobFailedError, ProcessingPipeline
+from app.services.runpod_service import (
+    ENVIRONMENT_FAILURE, PERMANENT_FAILURE, TRANSIENT_FAILURE, RunPodJobError
+)
+
+INPUT_URL = "https://bucket.test/url2mp3/abc.mp3"
+
+
+class FakeSession:
+    """get() 依次返回 records 中的记录 (等待进行中的记录时每次查询的结果)"""
+
+    def __init__(self):
+        self.records = []
+
+    async def get(self, model, record_id):
+        return self.records.pop(0)
+
+    async def commit(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def session(monkeypatch):
+    """处理流程的数据库读写都经过 service 的方法，测试中由 FakeService 记录在内存里"""
+    session = FakeSession()
+
+    @asynccontextmanager
+    async def no_session():
+        yield session
+
+    monkeypatch.setattr(pipeline_module, "session_scope", no_session)
+    monkeypatch.setattr(pipeline_module, "read_session_scope", no_session)
+    monkeypatch.setattr(pipeline_module, "get_read_engine", lambda: None)
+    return session
+
+
+class FakeS3:
+    def calculate_file_hash(self, content: bytes) -> str:
+        return "abc"
+
+    async def upload_file(self, **kwargs):
+        return INPUT_URL, "url2mp3/abc.mp3"
+
+
+class FakeService:
+    """记录 RunPod 调用；run_sync / submit_job / wait_for_completion 的结果按顺序取自对应列表"""
+
+    service_type = "piano"
+    output_url_key = "midi_url"
+    cache_params = ()
+    chunk_merge = None
+    stem_layout_param = None
+    normalize_sample_rate = None
+
+    def __init__(self, run_sync=(), submit=(), wait=()):
+        self.run_sync_results = list(run_sync)
+        self.submit_results = list(submit)
+        self.wait_results = list(wait)
+        self.calls = []
+        self.failure = None
+        self.failed_record = None
+        self.cached_record = None
+        self.inflight_record = None
+        self.created = 0
+
+    @staticmethod
+    def _next(results):
+        result = results.pop(0)
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    async def run_sync(self, input_url, wait, **params):
+        self.calls.append("run_sync")
+        return self._next(self.run_sync_results)
+
+    async def submit_job(self, input_url, **params):
+        self.calls.append("submit_job")
+        return self._next(self.submit_results)
+
+    async def wait_for_completion(self, job_id):
+        self.calls.append(f"wait:{job_id}")
+        return self._next(self.wait_results)
+
+    async def cancel_job(self, job_id):
+        self.calls.append(f"cancel:{job_id}")
+
+    async def check_existing_record(self, db, file_hash, **params):
+        return self.cached_record
+
+    async def check_failed_record(self, db, file_hash, since, **params):
+        return self.failed_record
+
+    async def lock_request(self, db, file_hash, **params):
+        self.calls.append("lock")
+
+    async def check_inflight_record(self, db, file_hash, since, **params):
+        record, self.inflight_record = self.inflight_record, None
+        return record
+
+    async def create_record(self, db, **kwargs):
+        self.created += 1
+        return SimpleNamespace(id=1, output_s3_url=None, output_data=None)
+
+    async def update_record_success(self, db, record, result):
+        record.output_s3_url = result["output"][self.output_url_key]
+        record.output_data = result["output"]
+
+    async def update_record_failure(self, db, record, error_message, result=None, kind=TRANSIENT_FAILURE):
+        self.failure = kind
+
+    async def update_record_handed_off(self, db, record, job_id):
+        self.calls.append(f"hand_off:{job_id}")
+
+
+def completed(job_id: str) -> dict:
+    return {"id": job_id, "status": "COMPLETED", "output": {"midi_url": f"https://runpod.test/{job_id}.mid"}}
+
+
+def http_error(status: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "http://runpod.test/v2/piano/runsync")
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(status, request=request))
+
+
+def run(service: FakeService, **options):
+    options = {"runsync_wait": 5, "runsync_max_bytes": 1024, "retry_backoff": 0, **options}
+    pipeline = ProcessingPipeline(FakeS3(), **options)
+    return asyncio.run(pipeline.run(service, b"audio", "song.mp3", tenant="test"))
+
+
+def test_runsync_result_skips_polling():
+    service = FakeService(run_sync=[completed("job-1")])
+    result = run(service)
+    assert result.output_url == "https://runpod.test/job-1.mid"
+    assert service.calls == ["run_sync"]
+
+
+@pytest.mark.parametrize("error", [httpx.ConnectError("refused"), httpx.ConnectTimeout("timeout"), http_error(503)])
+def test_runsync_falls_back_to_run_when_request_was_not_accepted(error):
+    service = FakeService(run_sync=[error], submit=["job-2"], wait=[completed("job-2")])
+    result = run(service)
+    assert result.job_id == "job-2"
+    assert service.calls == ["run_sync", "submit_job", "wait:job-2"]
+
+
+@pytest.mark.parametrize("error", [httpx.ReadTimeout("timeout"), httpx.RemoteProtocolError("disconnected")])
+def test_runsync_does_not_resubmit_when_outcome_is_unknown(error):
+    # RunPod 可能已经接受请求并在运行任务，重新提交会产生第二个计费任务
+    service = FakeService(run_sync=[error], submit=["job-2"])
+    with pytest.raises(JobFailedError) as excinfo:
+        run(service, retry_attempts=2)
+    assert not excinfo.value.permanent
+    assert service.failure == TRANSIENT_FAILURE
+    assert service.calls == ["run_sync"]
+
+
+def test_transient_submit_errors_are_retried():
+    service = FakeService(submit=[http_error(503), httpx.ConnectError("refused"), "job-3"], wait=[completed("job-3")])
+    result = run(service, runsync_wait=0, retry_attempts=2)
+    assert result.job_id == "job-3"
+    assert service.calls == ["submit_job", "submit_job", "submit_job", "wait:job-3"]
+
+
+def test_client_errors_are_not_retried():
+    service = FakeService(submit=[http_error(401), "job-3"])
+    with pytest.raises(JobFailedError) as excinfo:
+        run(service, runsync_wait=0, retry_attempts=2)
+    assert excinfo.value.failure_kind == ENVIRONMENT_FAILURE
+    assert service.calls == ["submit_job"]
+
+
+def test_poll_timeout_keeps_waiting_for_the_same_job_then_cancels_it():
+    timeout = RunPodJobError("timeout", {"status": "IN_PROGRESS", "pollCount": 10})
+    service = FakeService(submit=["job-4"], wait=[timeout, timeout, timeout])
+    with pytest.raises(JobFailedError):
+        run(service, runsync_wait=0, retry_attempts=2)
+    assert service.calls == ["submit_job", "wait:job-4", "wait:job-4", "wait:job-4", "cancel:job-4"]
+
+
+def test_finished_job_is_resubmitted():
+    failed = RunPodJobError("failed", {"status": "FAILED", "error": "CUDA out of memory"})
+    service = FakeService(submit=["job-5", "job-6"], wait=[failed, completed("job-6")])
+    result = run(service, runsync_wait=0, retry_attempts=2)
+    assert result.job_id == "job-6"
+    assert service.calls == ["submit_job", "wait:job-5", "submit_job", "wait:job-6"]
+
+
+def test_input_errors_are_permanent_and_not_retried():
+    failed = RunPodJobError("failed", {"status": "FAILED", "error": "Invalid data found when processing input"})
+    service = FakeService(submit=["job-7", "job-8"], wait=[failed])
+    with pytest.raises(JobFailedError) as excinfo:
+        run(service, runsync_wait=0, retry_attempts=2)
+    assert excinfo.value.permanent
+    assert service.failure == PERMANENT_FAILURE
+    assert service.calls == ["submit_job", "wait:job-7"]
+
+
+def test_known_failure_is_rejected_before_upload():
+    service = FakeService()
+    service.failed_record = SimpleNamespace(id=9, error_message="无法解码")
+    with pytest.raises(JobFailedError) as excinfo:
+        run(service, negative_cache_ttl=3600)
+    assert excinfo.value.permanent
+    assert service.calls == []
+
+
+def test_draining_hands_the_job_off_instead_of_waiting():
+    service = FakeService(submit=["job-10"])
+
+    async def main():
+        start_draining()
+        pipeline = ProcessingPipeline(FakeS3())
+        return await pipeline.run(service, b"audio", "song.mp3", tenant="test")
+
+    result = asyncio.run(main())
+    assert result.handed_off
+    assert result.job_id == "job-10"
+    assert service.calls == ["submit_job", "hand_off:job-10"]
+
+
+def resumed_record():
+    return SimpleNamespace(
+        id=1, original_filename="song.mp3", file_hash="abc", input_s3_url=INPUT_URL, runpod_job_id="job-11",
+        output_s3_url=None, output_data=None
+    )
+
+
+def test_resume_polls_the_existing_job():
+    service = FakeService(wait=[completed("job-11")])
+    pipeline = ProcessingPipeline(FakeS3(), retry_attempts=2)
+    result = asyncio.run(pipeline.resume(service, resumed_record()))
+    assert result.output_url == "https://runpod.test/job-11.mid"
+    assert service.calls == ["wait:job-11"]
+
+
+def test_resume_does_not_resubmit_failed_jobs():
+    # 续跑的记录没有完整的请求参数，任务失败时只标记失败
+    failed = RunPodJobError("failed", {"status": "FAILED", "error": "CUDA out of memory"})
+    service = FakeService(submit=["job-12"], wait=[failed])
+    pipeline = ProcessingPipeline(FakeS3(), retry_attempts=2)
+    with pytest.raises(JobFailedError):
+        asyncio.run(pipeline.resume(service, resumed_record()))
+    assert service.calls == ["wait:job-11"]
+
+
+class FakeWarmer:
+    def __init__(self):
+        self.observed = []
+
+    async def observe(self, service_type, params, file_hash, filename, content_type, file_content):
+        self.observed.append(file_hash)
+
+
+def test_only_cache_misses_are_counted_for_warming():
+    warmer = FakeWarmer()
+    hit = FakeService()
+    hit.cached_record = SimpleNamespace(id=3, output_s3_url="https://bucket.test/outputs/abc.mid", output_data=None, runpod_job_id="job-1")
+    assert run(hit, warmer=warmer).from_cache
+    assert warmer.observed == []
+
+    run(FakeService(run_sync=[completed("job-13")]), warmer=warmer)
+    assert warmer.observed == ["abc"]
+
+
+def record(status, updated_at=None, **fields):
+    fields = {"output_s3_url": None, "output_data": None, "runpod_job_id": "job-20", "failure_kind": None, **fields}
+    return SimpleNamespace(id=20, status=status, updated_at=updated_at or datetime.utcnow(), **fields)
+
+
+def test_concurrent_request_waits_for_the_inflight_record(session):
+    service = FakeService()
+    service.inflight_record = record("processing")
+    session.records = [record("handed_off"), record("completed", output_s3_url="https://bucket.test/outputs/abc.mid")]
+    result = run(service, single_flight_ttl=60, single_flight_poll=0)
+    assert result.from_cache
+    assert result.record_id == 20
+    assert service.created == 0
+    assert service.calls == ["lock"]
+
+
+def test_request_takes_over_when_the_inflight_record_fails_transiently(session):
+    service = FakeService(run_sync=[completed("job-21")])
+    service.inflight_record = record("processing")
+    session.records = [record("failed", failure_kind=TRANSIENT_FAILURE)]
+    result = run(service, single_flight_ttl=60, single_flight_poll=0)
+    assert result.job_id == "job-21"
+    assert service.created == 1
+    assert service.calls == ["lock", "lock", "run_sync"]
+
+
+def test_permanent_failure_of_the_inflight_record_is_returned(session):
+    service = FakeService(run_sync=[completed("job-22")])
+    service.inflight_record = record("processing")
+    session.records = [record("failed", failure_kind=PERMANENT_FAILURE, error_message="无法解码")]
+    with pytest.raises(JobFailedError) as excinfo:
+        run(service, single_flight_ttl=60, single_flight_poll=0)
+    assert excinfo.value.permanent
+    assert service.created == 0
+
+
+def test_stale_inflight_record_is_not_waited_for(session):
+    service = FakeService(run_sync=[completed("job-23")])
+    service.inflight_record = record("processing", updated_at=datetime.utcnow() - timedelta(seconds=120))
+    result = run(service, single_flight_ttl=60, single_flight_poll=0)
+    assert result.job_id == "job-23"
+    assert service.created == 1
+
+
+def test_single_flight_is_off_by_default():
+    service = FakeService(run_sync=[completed("job-24")])
+    service.inflight_record = record("processing")
+    run(service)
+    assert service.calls == ["run_sync"]
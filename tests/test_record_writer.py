@@ -0,0 +1,94 @@
+import asyncio
+import pytest
+from app.services.record_writer import RecordWriteBuffer
+
+
+class FakeStore(RecordWriteBuffer):
+    """把批量 / 逐条写库替换为内存记录；failing 中的记录逐条写入时出错，批量写入包含它们时整批出错"""
+
+    def __init__(self, failing=(), **kwargs):
+        super().__init__(flush_interval=0.01, **kwargs)
+        self.failing = set(failing)
+        self.batches = []
+        self.rows = []
+
+    async def _write_batch(self, columns, group):
+        if self.failing & set(group):
+            raise RuntimeError("batch failed")
+        self.batches.append({record_id: dict(pending.values) for record_id, pending in group.items()})
+        return {record_id: {"id": record_id, **pending.values} for record_id, pending in group.items()}
+
+    async def _write_one(self, record_id, record_values):
+        if record_id in self.failing:
+            raise RuntimeError(f"row {record_id} failed")
+        self.rows.append((record_id, dict(record_values)))
+        return {"id": record_id, **record_values}
+
+
+def run_buffer(buffer: RecordWriteBuffer, *updates):
+    """启动缓冲，并发登记 updates (record_id, values, wait)，返回各调用的结果或异常"""
+    async def main():
+        buffer.start()
+        try:
+            return await asyncio.gather(
+                *(buffer.update(record_id, values, wait=wait) for record_id, values, wait in updates),
+                return_exceptions=True
+            )
+        finally:
+            await buffer.stop()
+    return asyncio.run(main())
+
+
+def test_updates_in_one_interval_are_merged_into_one_batch():
+    buffer = FakeStore()
+    results = run_buffer(
+        buffer,
+        (1, {"status": "processing"}, True),
+        (2, {"status": "processing"}, True),
+        (1, {"status": "completed"}, True),
+    )
+    assert buffer.batches == [{1: {"status": "completed"}, 2: {"status": "processing"}}]
+    # 同一记录的调用方都拿到合并后提交的值
+    assert results == [{"id": 1, "status": "completed"}, {"id": 2, "status": "processing"}, {"id": 1, "status": "completed"}]
+
+
+def test_different_column_sets_are_written_as_separate_batches():
+    buffer = FakeStore()
+    run_buffer(buffer, (1, {"status": "processing"}, True), (2, {"status": "failed", "error_message": "x"}, True))
+    assert sorted(buffer.batches, key=len) == [{1: {"status": "processing"}}, {2: {"status": "failed", "error_message": "x"}}]
+
+
+def test_max_batch_splits_large_flushes():
+    buffer = FakeStore(max_batch=2)
+    run_buffer(buffer, *((record_id, {"status": "processing"}, True) for record_id in range(5)))
+    assert [len(batch) for batch in buffer.batches] == [2, 2, 1]
+
+
+def test_failed_batch_falls_back_to_rows_and_only_the_bad_row_raises():
+    buffer = FakeStore(failing={2})
+    results = run_buffer(buffer, (1, {"status": "completed"}, True), (2, {"status": "completed"}, True))
+    assert buffer.batches == []
+    assert buffer.rows == [(1, {"status": "completed"})]
+    assert results[0] == {"id": 1, "status": "completed"}
+    assert isinstance(results[1], RuntimeError)
+
+
+def test_stop_flushes_updates_that_were_not_awaited():
+    buffer = FakeStore()
+    results = run_buffer(buffer, (1, {"status": "processing"}, False))
+    assert results == [None]
+    assert buffer.batches == [{1: {"status": "processing"}}]
+
+
+def test_writes_directly_when_not_started():
+    buffer = FakeStore()
+    assert asyncio.run(buffer.update(1, {"status": "completed"})) == {"id": 1, "status": "completed"}
+    assert buffer.rows == [(1, {"status": "completed"})]
+    assert buffer.batches == []
+
+
+@pytest.mark.parametrize("wait", [True, False])
+def test_nothing_is_written_twice(wait):
+    buffer = FakeStore()
+    run_buffer(buffer, (1, {"status": "processing"}, wait))
+    assert len(buffer.batches) + len(buffer.rows) == 1
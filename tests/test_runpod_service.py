@@ -0,0 +1,54 @@
+import httpx
+import pytest
+from app.services.pipeline import JobFailedError
+from app.services.runpod_service import (
+    ENVIRONMENT_FAILURE, PERMANENT_FAILURE, TRANSIENT_FAILURE, RunPodJobError, failure_kind
+)
+
+
+def http_error(status: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "http://runpod.test/v2/piano/run")
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(status, request=request))
+
+
+@pytest.mark.parametrize("error", ["Invalid data found when processing input", "Could not decode audio", "Audio is too short"])
+def test_worker_input_errors_are_permanent(error):
+    assert failure_kind(RunPodJobError("failed", {"status": "FAILED", "error": error})) == PERMANENT_FAILURE
+
+
+@pytest.mark.parametrize("error", ["CUDA out of memory", "worker crashed", None])
+def test_other_worker_errors_are_transient(error):
+    assert failure_kind(RunPodJobError("failed", {"status": "FAILED", "error": error})) == TRANSIENT_FAILURE
+
+
+def test_input_markers_only_count_for_failed_jobs():
+    # 等待超时时任务仍可能在运行，错误信息不代表输入有问题
+    exc = RunPodJobError("timeout", {"status": "IN_PROGRESS", "error": "invalid data"})
+    assert failure_kind(exc) == TRANSIENT_FAILURE
+
+
+@pytest.mark.parametrize("status", [400, 401, 403, 404])
+def test_client_errors_are_environment(status):
+    assert failure_kind(http_error(status)) == ENVIRONMENT_FAILURE
+
+
+@pytest.mark.parametrize("status", [429, 500, 502, 503])
+def test_rate_limit_and_server_errors_are_transient(status):
+    assert failure_kind(http_error(status)) == TRANSIENT_FAILURE
+
+
+@pytest.mark.parametrize("exc", [httpx.ConnectError("refused"), httpx.ReadTimeout("timeout"), RuntimeError("boom")])
+def test_network_and_unknown_errors_are_transient(exc):
+    assert failure_kind(exc) == TRANSIENT_FAILURE
+
+
+def test_classified_errors_keep_their_kind():
+    assert failure_kind(JobFailedError("bad input", PERMANENT_FAILURE)) == PERMANENT_FAILURE
+    assert failure_kind(JobFailedError("forbidden", ENVIRONMENT_FAILURE)) == ENVIRONMENT_FAILURE
+
+
+def test_job_finished_only_for_terminal_statuses():
+    assert RunPodJobError("x", {"status": "FAILED"}).job_finished
+    assert RunPodJobError("x", {"status": "TIMED_OUT"}).job_finished
+    assert not RunPodJobError("x", {"status": "IN_PROGRESS", "pollCount": 3}).job_finished
+    assert not RunPodJobError("x").job_finished
@@ -0,0 +1,86 @@
+import asyncio
+import httpx
+import pytest
+from app.services import s3_service as s3_service_module
+from app.services.s3_service import S3Service
+
+
+class FakeCache:
+    def __init__(self, entries=None):
+        self.entries = dict(entries or {})
+        self.reads = []
+
+    def read(self, key):
+        self.reads.append(key)
+        return self.entries.get(key)
+
+    def put(self, key, content):
+        self.entries[key] = content
+
+
+@pytest.fixture
+def s3(settings_env, monkeypatch):
+    requested = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requested.append(str(request.url))
+        return httpx.Response(200, content=b"downloaded")
+
+    real_client = httpx.AsyncClient
+    monkeypatch.setattr(
+        s3_service_module.httpx, "AsyncClient",
+        lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs)
+    )
+    service = S3Service()
+    service.cache = FakeCache()
+    service.requested = requested
+    return service
+
+
+@pytest.mark.parametrize("key, content_key", [
+    ("outputs/abc.mid", "outputs/abc.mid"),
+    ("stems/abc/4/vocals-192k.mp3?X-Amz-Signature=x", "stems/abc/4/vocals-192k.mp3"),
+    ("url2mp3/5f1c.mp3", None),
+])
+def test_content_key_only_for_content_addressed_objects(s3, key, content_key):
+    assert s3.content_key(s3.get_file_url(key)) == content_key
+    assert s3.content_key(f"https://runpod.test/{key}") is None
+
+
+def test_download_urls_caches_content_addressed_objects(s3):
+    url = s3.get_file_url("derived/abc/spleeter-stems2-192k.mp3.zip")
+    assert asyncio.run(s3.download_urls([url])) == [b"downloaded"]
+    assert s3.cache.entries == {"derived/abc/spleeter-stems2-192k.mp3.zip": b"downloaded"}
+    assert asyncio.run(s3.download_urls([url])) == [b"downloaded"]
+    assert s3.requested == [url]
+
+
+def test_download_urls_does_not_cache_other_urls(s3):
+    urls = ["https://runpod.test/results/abc.zip", s3.get_file_url("url2mp3/5f1c.mp3")]
+    s3.cache.entries = {url: b"stale" for url in urls}
+    assert asyncio.run(s3.download_urls(urls)) == [b"downloaded", b"downloaded"]
+    assert s3.cache.reads == []
+    assert s3.requested == urls
+
+
+def test_download_to_file_streams_other_urls(s3, tmp_path):
+    path = tmp_path / "result.zip"
+    asyncio.run(s3.download_to_file("https://runpod.test/results/abc.zip", str(path)))
+    assert path.read_bytes() == b"downloaded"
+    assert s3.cache.entries == {}
+
+
+def test_download_to_file_reads_content_addressed_objects_through_the_cache(s3, tmp_path, monkeypatch):
+    read = []
+
+    async def iter_object(key, chunk_size):
+        read.append(key)
+        for chunk in (b"part1-", b"part2"):
+            yield chunk
+
+    monkeypatch.setattr(s3, "iter_object", iter_object)
+    path = tmp_path / "stems.zip"
+    asyncio.run(s3.download_to_file(s3.get_file_url("derived/abc/stems.zip"), str(path)))
+    assert path.read_bytes() == b"part1-part2"
+    assert read == ["derived/abc/stems.zip"]
+    assert s3.requested == []
@@ -0,0 +1,62 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.routers import spleeter
+from app.services import get_output_delivery, get_processing_pipeline, get_spleeter_service, result_token
+from app.services.pipeline import PipelineResult
+
+
+class FakePipeline:
+    def __init__(self):
+        self.params = []
+
+    async def run(self, service, file_content, filename, content_type, **params):
+        self.params.append(params)
+        return PipelineResult(output_url="https://bucket.test/out.zip", output_data={}, job_id="job-1", from_cache=False, record_id=1)
+
+
+class FakeDelivery:
+    async def public_url(self, url):
+        return url
+
+
+@pytest.fixture
+def client(settings_env):
+    pipeline = FakePipeline()
+    app = FastAPI()
+    app.include_router(spleeter.router)
+    app.dependency_overrides[get_spleeter_service] = lambda: object()
+    app.dependency_overrides[get_processing_pipeline] = lambda: pipeline
+    app.dependency_overrides[get_output_delivery] = lambda: FakeDelivery()
+    client = TestClient(app)
+    client.pipeline = pipeline
+    return client
+
+
+def separate(client, **form):
+    return client.post("/api/spleeter/separate", files={"file": ("song.mp3", b"ID3audio", "audio/mpeg")}, data=form)
+
+
+@pytest.mark.parametrize("form", [{"format": "wav", "bitrate": "320k"}, {"format": "FLAC"}, {}])
+def test_separate_accepts_supported_encodings(client, form):
+    assert separate(client, **form).status_code == 200
+    assert len(client.pipeline.params) == 1
+
+
+@pytest.mark.parametrize("form", [
+    {"format": "exe"},
+    {"format": "mp3;rm -rf"},
+    {"bitrate": "192"},
+    {"bitrate": "1920000k"},
+    {"bitrate": "192k -f null"},
+])
+def test_separate_rejects_unknown_encodings(client, form):
+    response = separate(client, **form)
+    assert response.status_code == 400
+    assert client.pipeline.params == []
+
+
+def test_result_urls_carry_the_signed_token(client):
+    body = separate(client).json()
+    assert body["stems_url"] == f"/api/spleeter/results/{result_token(1)}/stems"
+    assert body["zip_url"] == f"/api/spleeter/results/{result_token(1)}/zip"
@@ -0,0 +1,120 @@
+import asyncio
+import io
+import sys
+import zipfile
+from types import SimpleNamespace
+from app.models import StemArtifact
+from app.services import stems as stems_module
+from app.services.stems import StemStore, record_artifacts
+
+RESULT_URL = "https://runpod.test/results/abc.zip"
+
+
+def zip_bytes(files: dict) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, content in files.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+class FakeS3:
+    def __init__(self, objects: dict):
+        self.objects = objects
+        self.uploads = {}
+
+    async def download_to_file(self, url, path):
+        with open(path, "wb") as f:
+            f.write(self.objects[url])
+
+    async def upload_file(self, file_content, s3_key, **kwargs):
+        self.uploads[s3_key] = file_content
+        return f"https://bucket.test/{s3_key}", "abc"
+
+
+def four_stem_artifacts():
+    return {
+        stem: StemArtifact(
+            file_hash="abc", layout=4, stem=stem, format="mp3", bitrate="192k",
+            s3_url=RESULT_URL, archive_member=f"output/{stem}.mp3"
+        )
+        for stem in ("vocals", "drums", "bass", "other")
+    }
+
+
+def four_stem_zip() -> bytes:
+    return zip_bytes({f"output/{stem}.mp3": stem.encode() for stem in ("vocals", "drums", "bass", "other")})
+
+
+def test_record_artifacts_lists_the_stems_of_the_layout():
+    record = SimpleNamespace(
+        id=1, file_hash="abc", stems=2, output_s3_url=RESULT_URL,
+        output_data={"format": "wav", "bitrate": "192k", "files": [
+            {"name": "output/vocals.wav", "size_kb": 10}, "output/accompaniment.wav", "output/readme.txt"
+        ]}
+    )
+    artifacts = record_artifacts(record)
+    assert [(artifact.stem, artifact.archive_member) for artifact in artifacts] == [
+        ("vocals", "output/vocals.wav"), ("accompaniment", "output/accompaniment.wav")
+    ]
+    # 无损格式不区分比特率
+    assert {artifact.bitrate for artifact in artifacts} == {None}
+
+
+def test_derive_mixes_fewer_stems_from_a_larger_layout(monkeypatch):
+    s3 = FakeS3({RESULT_URL: four_stem_zip()})
+    store = StemStore(s3, ffmpeg_path=sys.executable)
+    encoded = []
+
+    async def fake_encode(inputs, extension, bitrate):
+        encoded.append((inputs, extension, bitrate))
+        return b"+".join(inputs)
+
+    monkeypatch.setattr(store, "_encode", fake_encode)
+    output = asyncio.run(store.derive("abc", 2, 4, four_stem_artifacts()))
+
+    key = "derived/abc/spleeter-stems2-192k.mp3.zip"
+    assert output["download_url"] == f"https://bucket.test/{key}"
+    assert (output["format"], output["bitrate"]) == ("mp3", "192k")
+    with zipfile.ZipFile(io.BytesIO(s3.uploads[key])) as archive:
+        contents = {name: archive.read(name) for name in archive.namelist()}
+    # 编码相同的单条音轨原样复制，伴奏由其余音轨相加
+    assert contents == {"output/vocals.mp3": b"vocals", "output/accompaniment.mp3": b"drums+bass+other"}
+    assert encoded == [([b"drums", b"bass", b"other"], "mp3", "192k")]
+
+
+def test_derive_reencodes_when_the_format_differs(monkeypatch):
+    s3 = FakeS3({RESULT_URL: four_stem_zip()})
+    store = StemStore(s3, ffmpeg_path=sys.executable)
+
+    async def fake_encode(inputs, extension, bitrate):
+        return b"wav:" + b"+".join(inputs)
+
+    monkeypatch.setattr(store, "_encode", fake_encode)
+    output = asyncio.run(store.derive("abc", 4, 4, four_stem_artifacts(), "wav", None))
+    assert [entry["name"] for entry in output["files"]] == [
+        "output/vocals.wav", "output/drums.wav", "output/bass.wav", "output/other.wav"
+    ]
+    assert "derived/abc/spleeter-stems4-lossless.wav.zip" in s3.uploads
+
+
+def test_encode_compensates_amix_and_writes_to_a_file(monkeypatch):
+    calls = []
+
+    async def fake_run_process(args, timeout):
+        calls.append(args)
+        with open(args[-1], "wb") as f:
+            f.write(b"RIFF")
+        return 0, b"", b""
+
+    monkeypatch.setattr(stems_module, "run_process", fake_run_process)
+    store = StemStore(FakeS3({}), ffmpeg_path=sys.executable)
+    assert asyncio.run(store._encode([b"a", b"b", b"c"], "wav", "192k")) == b"RIFF"
+
+    args = calls[0]
+    mix = args[args.index("-filter_complex") + 1]
+    # 不依赖 amix 的 normalize 选项: 平均后乘回输入数
+    assert mix.startswith("amix=inputs=3:") and "normalize" not in mix and mix.endswith("volume=3")
+    # WAV 不使用比特率；输出到可寻址的文件而不是管道
+    assert "-b:a" not in args
+    assert args[-1].endswith("output.wav") and "pipe:1" not in args
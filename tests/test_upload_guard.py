@@ -0,0 +1,151 @@
+import asyncio
+import json
+import pytest
+from app.upload_guard import SNIFF_BYTES, UploadGuardMiddleware, scan_prefix, sniff_audio
+
+BOUNDARY = b"test-boundary"
+MP3 = b"ID3\x04\x00\x00\x00\x00\x00\x00" + b"\x00" * 100
+WAV = b"RIFF\x24\x00\x00\x00WAVEfmt " + b"\x00" * 100
+
+
+@pytest.mark.parametrize("head, expected", [
+    (MP3, "mp3"),
+    (WAV, "wav"),
+    (b"\x00\x00\x00\x20ftypM4A ", "m4a"),
+    (b"fLaC\x00\x00\x00\x22", "flac"),
+    (b"OggS\x00\x02", "ogg"),
+    (b"FORM\x00\x00\x00\x00AIFF", "aiff"),
+    (b"\x1a\x45\xdf\xa3\x01", "webm"),
+    (b"\xff\xfb\x90\x00", "mp3"),
+    (b"\xff\xf1\x50\x80", "aac"),
+    (b"%PDF-1.7\n", None),
+    (b"<html><body>", None),
+    (b"", None),
+])
+def test_sniff_audio(head, expected):
+    assert sniff_audio(head[:SNIFF_BYTES]) == expected
+
+
+def multipart(*parts) -> bytes:
+    """parts 为 (字段名, 值) 或 (字段名, 文件名, 内容)"""
+    body = b""
+    for part in parts:
+        body += b"--" + BOUNDARY + b"\r\n"
+        if len(part) == 2:
+            body += f'Content-Disposition: form-data; name="{part[0]}"\r\n\r\n'.encode() + part[1] + b"\r\n"
+        else:
+            body += (
+                f'Content-Disposition: form-data; name="{part[0]}"; filename="{part[1]}"\r\n'
+                "Content-Type: application/octet-stream\r\n\r\n"
+            ).encode() + part[2] + b"\r\n"
+    return body + b"--" + BOUNDARY + b"--\r\n"
+
+
+def test_scan_prefix_returns_fields_before_file_and_file_head():
+    fields, head, found = scan_prefix(multipart(("stems", b"4"), ("file", "a.mp3", MP3)), BOUNDARY)
+    assert fields == [("stems", "4")]
+    assert head == MP3[:SNIFF_BYTES]
+    assert found
+
+
+def test_scan_prefix_needs_more_data_for_short_file_head():
+    body = multipart(("file", "a.mp3", MP3))
+    fields, head, found = scan_prefix(body[:body.index(MP3) + 4], BOUNDARY)
+    assert (fields, head, found) == ([], None, True)
+
+
+def test_scan_prefix_without_file_part():
+    assert scan_prefix(multipart(("stems", b"2")), BOUNDARY) == ([("stems", "2")], None, False)
+
+
+class Downstream:
+    """记录中间件放行后应用读到的请求体"""
+
+    def __init__(self):
+        self.body = None
+
+    async def __call__(self, scope, receive, send):
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body", False):
+                break
+        self.body = body
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+
+def call(middleware, path, body, chunk_size=None, content_length=True):
+    headers = [(b"content-type", b"multipart/form-data; boundary=" + BOUNDARY)]
+    if content_length:
+        headers.append((b"content-length", str(len(body)).encode()))
+    scope = {"type": "http", "method": "POST", "path": path, "headers": headers}
+    chunk_size = chunk_size or len(body) or 1
+    messages = [
+        {"type": "http.request", "body": body[i:i + chunk_size], "more_body": i + chunk_size < len(body)}
+        for i in range(0, max(len(body), 1), chunk_size)
+    ]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    status = sent[0]["status"]
+    body = b"".join(message.get("body", b"") for message in sent[1:])
+    return status, json.loads(body)["detail"] if status != 200 else body
+
+
+@pytest.fixture
+def app():
+    return Downstream()
+
+
+@pytest.fixture
+def guard(settings_env, app):
+    return UploadGuardMiddleware(app, max_bytes=10_000, sniff=True)
+
+
+def test_audio_upload_is_passed_through_unchanged(guard, app):
+    body = multipart(("stems", b"2"), ("file", "a.wav", WAV))
+    assert call(guard, "/api/spleeter/separate", body, chunk_size=7) == (200, b"ok")
+    assert app.body == body
+
+
+def test_content_length_over_limit_is_413(guard, app):
+    status, detail = call(guard, "/api/piano/transcribe", multipart(("file", "a.mp3", MP3 * 200)))
+    assert status == 413
+    assert app.body is None
+
+
+def test_chunked_upload_over_limit_is_413(guard, app):
+    body = multipart(("file", "a.mp3", MP3 * 200))
+    status, _ = call(guard, "/api/piano/transcribe", body, chunk_size=1000, content_length=False)
+    assert status == 413
+
+
+def test_non_audio_upload_is_415(guard, app):
+    status, detail = call(guard, "/api/piano/transcribe", multipart(("file", "a.mp3", b"<html>" + b"x" * 100)))
+    assert status == 415
+    assert app.body is None
+
+
+def test_body_ending_inside_file_head_is_415(guard):
+    body = multipart(("file", "a.mp3", MP3))
+    status, _ = call(guard, "/api/piano/transcribe", body[:body.index(MP3) + 3])
+    assert status == 415
+
+
+def test_invalid_field_before_file_is_400(guard, app):
+    body = multipart(("stems", b"3"), ("file", "a.mp3", MP3))
+    assert call(guard, "/api/spleeter/separate", body) == (400, "stems参数必须是 2, 4 或 5")
+    assert app.body is None
+
+
+def test_other_paths_are_not_checked(guard, app):
+    body = multipart(("file", "a.txt", b"<html>" + b"x" * 100))
+    assert call(guard, "/api/jobs/1", body)[0] == 200
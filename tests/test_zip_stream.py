@@ -0,0 +1,42 @@
+import asyncio
+import io
+import zipfile
+from app.services.zip_stream import stream_zip
+
+
+async def chunks(*parts: bytes):
+    for part in parts:
+        yield part
+
+
+def build(entries) -> bytes:
+    async def collect():
+        return b"".join([chunk async for chunk in stream_zip(entries)])
+
+    return asyncio.run(collect())
+
+
+def test_stream_zip_is_readable_by_zipfile():
+    data = build([
+        ("vocals.mp3", chunks(b"ID3", b"\x00" * 1000, b"vocals")),
+        ("accompaniment.mp3", chunks(b"ID3" + b"\x01" * 5000)),
+    ])
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == ["vocals.mp3", "accompaniment.mp3"]
+        assert archive.read("vocals.mp3") == b"ID3" + b"\x00" * 1000 + b"vocals"
+        assert archive.read("accompaniment.mp3") == b"ID3" + b"\x01" * 5000
+        assert all(info.compress_type == zipfile.ZIP_STORED for info in archive.infolist())
+
+
+def test_stream_zip_handles_empty_and_utf8_entries():
+    data = build([("空.wav", chunks()), ("人声.wav", chunks(b"RIFF"))])
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.namelist() == ["空.wav", "人声.wav"]
+        assert archive.read("空.wav") == b""
+        assert archive.read("人声.wav") == b"RIFF"
+
+
+def test_stream_zip_without_entries():
+    with zipfile.ZipFile(io.BytesIO(build([]))) as archive:
+        assert archive.namelist() == []